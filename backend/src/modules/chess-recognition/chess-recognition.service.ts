@@ -34,15 +34,40 @@ export interface FrameProcessedResult {
     hand_blocks_move_detect?: number;
   };
   detection_skipped?: boolean;
+  /** Кадр совпал с предыдущим: результаты стадий взяты с прошлого кадра. */
+  duplicate?: boolean;
   board_snapshot?: boolean;
   history_frozen?: boolean;
   hand_detected?: boolean;
   fen?: string;
   success?: boolean;
   error?: string;
+  /** Номер кадра и время захвата (epoch мс), отправленные вместе с frame. */
+  seq?: number;
+  capture_ts?: number;
+  timing?: {
+    spans?: Record<string, number>;
+    transport_ms?: number;
+  };
   [key: string]: unknown;
 }
 
+/**
+ * Несжатый кадр для worker вместо JPEG: bgr — BGR24, i420/nv12 — YUV 4:2:0
+ * (чётные width и height). Длина буфера должна совпадать с размером кадра.
+ */
+export interface RawFrameInfo {
+  format: 'bgr' | 'i420' | 'nv12';
+  width: number;
+  height: number;
+}
+
+/**
+ * Движок распознавания позиции в worker: yolo — детекция фигур и треки,
+ * squares — классификация 64 клеток (без весов worker остаётся на yolo).
+ */
+export type RecognitionEngine = 'yolo' | 'squares';
+
 interface StreamSession {
   onFrameProcessed: (result: FrameProcessedResult) => void;
   onError: (error: Error) => void;
@@ -58,6 +83,10 @@ interface WorkerMessage {
   [key: string]: unknown;
 }
 
+type WorkerModel = 'yolo' | 'corner' | 'hand';
+
+const WORKER_MODELS: readonly WorkerModel[] = ['yolo', 'corner', 'hand'];
+
 @Injectable()
 export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
   private readonly logger = new Logger(ChessRecognitionService.name);
@@ -67,6 +96,9 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
   private workerReady = false;
   private workerReadyResolve: (() => void) | null = null;
   private workerReadyPromise: Promise<void> | null = null;
+  /** Модели, приславшие `<model>_ready` с момента запуска worker. */
+  private readonly readyModels = new Set<WorkerModel>();
+  private modelWaiters: Array<() => boolean> = [];
   private stdoutBuffer = '';
   private stderrBuffer = '';
 
@@ -156,6 +188,7 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
     }
 
     this.workerReady = false;
+    this.readyModels.clear();
     this.workerReadyPromise = new Promise<void>((resolve) => {
       this.workerReadyResolve = resolve;
     });
@@ -231,7 +264,36 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
     this.pendingCalibrations.clear();
   }
 
-  private async ensureWorkerReady(): Promise<void> {
+  private notifyModelWaiters(): void {
+    this.modelWaiters = this.modelWaiters.filter((check) => !check());
+  }
+
+  /** Резолвится, когда указанные модели загружены (или готов весь worker). */
+  private modelsReady(models: readonly WorkerModel[]): Promise<void> {
+    return new Promise<void>((resolve) => {
+      const check = (): boolean => {
+        if (
+          this.workerReady ||
+          models.every((m) => this.readyModels.has(m))
+        ) {
+          resolve();
+          return true;
+        }
+        return false;
+      };
+      if (!check()) {
+        this.modelWaiters.push(check);
+      }
+    });
+  }
+
+  /**
+   * Без `models` ждёт `ready` всего worker. С `models` — только эти модели:
+   * калибровка не ждёт детектор руки, а стрим — модель углов.
+   */
+  private async ensureWorkerReady(
+    models?: readonly WorkerModel[],
+  ): Promise<void> {
     if (!this.worker || this.worker.killed) {
       this.worker = null;
       this.workerReady = false;
@@ -246,7 +308,7 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
     }
     const timeoutMs = 120_000;
     await Promise.race([
-      this.workerReadyPromise,
+      models ? this.modelsReady(models) : this.workerReadyPromise,
       new Promise<void>((_, reject) =>
         setTimeout(
           () => reject(new Error('CV worker ready timeout')),
@@ -291,10 +353,21 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
     if (event === 'ready') {
       this.workerReady = true;
       this.workerReadyResolve?.();
+      this.notifyModelWaiters();
       this.logger.log('CV inference worker is ready');
       return;
     }
 
+    const model = WORKER_MODELS.find((name) => event === `${name}_ready`);
+    if (model) {
+      this.readyModels.add(model);
+      this.notifyModelWaiters();
+      this.logger.log(
+        `CV worker model ${model} is ready (${String(msg.seconds)}s)`,
+      );
+      return;
+    }
+
     if (event === 'calibrate_result' && msg.token) {
       const handler = this.pendingCalibrations.get(msg.token);
       if (handler) {
@@ -334,7 +407,11 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
       if (!line.trim()) {
         continue;
       }
-      if (
+      if (line.includes('] ERROR ') || line.includes('] CRITICAL ')) {
+        this.logger.error(`🐍 [CV] ${line.trim()}`);
+      } else if (line.includes('] WARNING ')) {
+        this.logger.warn(`🐍 [CV] ${line.trim()}`);
+      } else if (
         line.includes('[WORKER]') ||
         line.includes('[RESNET]') ||
         line.includes('[MAPPING]') ||
@@ -371,7 +448,7 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
         `${gameToken}_calibration.jpg`,
       );
       await writeFile(tempImagePath, imageBuffer);
-      await this.ensureWorkerReady();
+      await this.ensureWorkerReady(['yolo', 'corner']);
 
       const result = await new Promise<WorkerMessage>((resolve) => {
         this.pendingCalibrations.set(gameToken, resolve);
@@ -408,16 +485,21 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
     _modelPath: string,
     onFrameProcessed: (result: FrameProcessedResult) => void,
     onError: (error: Error) => void,
+    options?: { engine?: RecognitionEngine },
   ): void {
     const hadSession = this.sessions.has(gameToken);
     this.sessions.set(gameToken, { onFrameProcessed, onError });
 
-    void this.ensureWorkerReady()
+    void this.ensureWorkerReady(['yolo', 'hand'])
       .then(() => {
         if (hadSession) {
           this.sendCommand({ cmd: 'unregister', token: gameToken });
         }
-        this.sendCommand({ cmd: 'register', token: gameToken });
+        this.sendCommand({
+          cmd: 'register',
+          token: gameToken,
+          ...(options?.engine ? { engine: options.engine } : {}),
+        });
         this.logger.log(
           `Stream session registered in CV worker for token ${gameToken}${hadSession ? ' (reloaded)' : ''}`,
         );
@@ -429,11 +511,12 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
   }
 
   private readonly sendFrameSkipLogAt = new Map<string, number>();
+  private frameSeq = 0;
 
   sendFrame(
     gameToken: string,
     frameData: Buffer,
-    options?: { handProbe?: boolean },
+    options?: { handProbe?: boolean; raw?: RawFrameInfo },
   ): void {
     const session = this.sessions.get(gameToken);
     if (!this.worker?.stdin || this.worker.killed) {
@@ -489,7 +572,10 @@ export class ChessRecognitionService implements OnModuleInit, OnModuleDestroy {
           cmd: 'frame',
           token: gameToken,
           length: frameData.length,
+          seq: ++this.frameSeq,
+          ts: Date.now(),
           ...(options?.handProbe ? { hand_probe: true } : {}),
+          ...(options?.raw ?? {}),
         },
         frameData,
       );
@@ -0,0 +1,154 @@
+"""
+Сравнение движков распознавания позиции: yolo и squares.
+
+На каждой размеченной выровненной доске (board_dataset.LabelledBoardSource)
+оба движка строят board_state в порядке сетки warped-изображения:
+  yolo    — YOLO11Detector.predict, отсев по уверенности как в
+            StreamProcessor и tracks_to_board_state по равномерной сетке
+            (ByteTrack между разными снимками не имеет смысла и не замеряется);
+  squares — SquareCropClassifier.classify (вырезки 64 клеток одним батчем).
+Отчёт: задержки (mean/p50/p95/p99) и точность по разметке — по клеткам,
+по занятости и доля досок, где верны все 64 клетки. Результат пишется в
+JSON для сравнения прогонов.
+
+Пример:
+    python src/benchmark_engines.py --datasets merged_new/test --repeat 5 --output engines.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import warnings
+from typing import Callable, Dict
+
+import numpy as np
+
+warnings.filterwarnings('ignore', category=UserWarning)
+warnings.filterwarnings('ignore', message='.*pkg_resources.*')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_pipeline import _git_revision
+from board_dataset import MAPPING_MODES, BoardAccuracy, LabelledBoardSource
+from improved_board_mapping import SQUARE_COUNT, _generate_uniform_square_grid
+from model.square_classifier import ENGINES
+from model.yolo11_detector import BoardStateMapper
+from model_paths import corner_model_path, square_classifier_model_path, yolo_model_path
+from shared_models import SharedInferenceModels
+from worker_logging import configure_logging
+from worker_metrics import LatencyHistogram
+
+DEFAULT_DATASETS = ('merged_new/test',)
+# Порог уверенности детекций, как в StreamProcessor
+MIN_DETECTION_CONFIDENCE = 0.35
+
+
+def _engines(models: SharedInferenceModels) -> Dict[str, Callable[[np.ndarray], np.ndarray]]:
+    """Движок -> функция warped -> board_state (8, 8)."""
+    mapper = BoardStateMapper()
+
+    def yolo(warped: np.ndarray) -> np.ndarray:
+        tracks = [
+            {'class_name': class_name, 'bbox': bbox, 'confidence': confidence}
+            for class_name, bbox, confidence, _cls_id in models.yolo.predict(warped)
+            if confidence >= MIN_DETECTION_CONFIDENCE
+        ]
+        return mapper.tracks_to_board_state(tracks, _generate_uniform_square_grid(warped, SQUARE_COUNT))
+
+    def squares(warped: np.ndarray) -> np.ndarray:
+        return models.squares.classify(warped)[0]
+
+    return {'yolo': yolo, 'squares': squares}
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict:
+    models = SharedInferenceModels()
+    models.load(args.yolo_model or yolo_model_path(), args.corner_model or corner_model_path())
+    if 'squares' in args.engines:
+        models.load_squares(args.square_model or square_classifier_model_path())
+    engines = {name: run for name, run in _engines(models).items() if name in args.engines}
+
+    source = LabelledBoardSource(args.datasets, limit=args.limit, mapping=args.mapping, models=models)
+    latency = {name: LatencyHistogram() for name in engines}
+    accuracy = {name: BoardAccuracy() for name in engines}
+    warmed_up = False
+    for board in source:
+        if not warmed_up:
+            for run in engines.values():
+                for _ in range(args.warmup):
+                    run(board.warped)
+            warmed_up = True
+        for name, run in engines.items():
+            board_state = None
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                board_state = run(board.warped)
+                latency[name].record(time.perf_counter() - started)
+            accuracy[name].add(board_state, board.board_state)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'device': models.corner.device,
+            'datasets': args.datasets,
+            'mapping': args.mapping,
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+        },
+        'boards': accuracy[next(iter(engines))].boards if engines else 0,
+        'skipped': source.skipped,
+        'engines': {
+            name: {'latency': latency[name].summary(), 'accuracy': accuracy[name].summary()}
+            for name in engines
+        },
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(f"boards={report['boards']} skipped={report['skipped']} device={report['meta']['device']}")
+    print(f"{'engine':<10}{'p50':>10}{'p95':>10}{'square':>10}{'occupied':>10}{'exact':>10}")
+    for name, result in report['engines'].items():
+        latency, accuracy = result['latency'], result['accuracy']
+        if not latency.get('count') or not accuracy:
+            continue
+        print(f"{name:<10}{latency['p50_ms']:>10.2f}{latency['p95_ms']:>10.2f}"
+              f"{accuracy['square_accuracy']:>10.2%}{accuracy['occupancy_accuracy']:>10.2%}"
+              f"{accuracy['board_exact']:>10.2%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Сравнение движков распознавания позиции: yolo и squares')
+    parser.add_argument('--datasets', nargs='+', default=list(DEFAULT_DATASETS),
+                        help='Папки датасетов с YOLO-разметкой относительно chess-recognition/')
+    parser.add_argument('--limit', type=int, default=None, help='Не больше N изображений на датасет')
+    parser.add_argument('--mapping', choices=MAPPING_MODES, default='auto',
+                        help='auto — map_chessboard (снимки без маппинга пропускаются), synthetic — рамка с отступом')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES))
+    parser.add_argument('--repeat', type=int, default=5, help='Прогонов движка на доску')
+    parser.add_argument('--warmup', type=int, default=3, help='Прогревочных прогонов перед замером')
+    parser.add_argument('--yolo-model', default=None)
+    parser.add_argument('--corner-model', default=None)
+    parser.add_argument('--square-model', default=None, help='Веса классификатора клеток (train_square_classifier.py)')
+    parser.add_argument('--output', default=None, help='JSON с результатами прогона')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f'Saved: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Офлайн-бенчмарк CV-пайплайна на датасетах из chess-recognition.
+
+Гоняет InferenceWorker.process_frame (и, с --mapping auto, map_chessboard)
+в одном процессе по изображениям merged_new/{valid,test} и
+chess-boards-resnet/test. Отчёт: задержки стадий (p50/p95/p99), FPS,
+пиковый RSS и загрузка CPU; результат пишется в JSON для сравнения
+прогонов. С --baseline скрипт завершается с кодом 1, если какая-то
+стадия медленнее базового прогона больше чем на --threshold.
+
+Пример:
+    python src/benchmark_pipeline.py --limit 50 --output bench.json
+    python src/benchmark_pipeline.py --limit 50 --baseline bench.json --threshold 0.1
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+warnings.filterwarnings('ignore', category=UserWarning)
+warnings.filterwarnings('ignore', message='.*pkg_resources.*')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from improved_board_mapping import (
+    OUTPUT_IMAGE_SIZE,
+    SQUARE_COUNT,
+    _generate_uniform_square_grid,
+    map_chessboard,
+    order_points_clockwise,
+    perspective_transform,
+)
+from inference_worker import InferenceWorker
+from model_paths import CHESS_RECOGNITION_ROOT, corner_model_path, yolo_model_path
+from worker_logging import configure_logging
+from worker_metrics import peak_rss_bytes
+from worker_output import OutputWriter
+
+DEFAULT_DATASETS = ('merged_new/valid', 'merged_new/test', 'chess-boards-resnet/test')
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+# Доля площади кадра, отступаемая от краёв для синтетического маппинга
+SYNTHETIC_INSET = 0.05
+
+
+def _find_images(dataset: Path, limit: Optional[int]) -> List[Path]:
+    images_dir = dataset / 'images' if (dataset / 'images').is_dir() else dataset
+    images = sorted(p for p in images_dir.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    return images[:limit] if limit else images
+
+
+def _label_corners(image_path: Path, width: int, height: int) -> Optional[np.ndarray]:
+    """Углы доски из разметки chess-boards-resnet (8 нормированных координат)."""
+    label = image_path.parent.parent / 'labels' / f'{image_path.stem}.txt'
+    if not label.is_file():
+        return None
+    try:
+        values = [float(v) for v in label.read_text().split()]
+    except ValueError:
+        return None
+    if len(values) != 8:
+        return None
+    points = np.array(values, dtype=np.float32).reshape(4, 2) * np.array([width, height], dtype=np.float32)
+    return order_points_clockwise(points)
+
+
+def synthetic_mapping(image: np.ndarray, image_path: Path, game_token: str) -> Dict:
+    """
+    Маппинг без моделей: углы из разметки, если она есть (chess-boards-resnet),
+    иначе прямоугольник кадра с отступом. Формат как у map_chessboard.
+    """
+    height, width = image.shape[:2]
+    corners = _label_corners(image_path, width, height)
+    source = 'label'
+    if corners is None:
+        dx, dy = width * SYNTHETIC_INSET, height * SYNTHETIC_INSET
+        corners = np.array(
+            [[dx, dy], [width - dx, dy], [width - dx, height - dy], [dx, height - dy]],
+            dtype=np.float32,
+        )
+        source = 'inset'
+    warped, matrix = perspective_transform(image, corners, OUTPUT_IMAGE_SIZE)
+    return {
+        'success': True,
+        'game_token': game_token,
+        'synthetic': source,
+        'board_corners': corners.tolist(),
+        'perspective_matrix': matrix.tolist(),
+        'warped_image_shape': list(warped.shape),
+        'square_corners': _generate_uniform_square_grid(warped, SQUARE_COUNT).tolist(),
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=CHESS_RECOGNITION_ROOT,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict:
+    mappings_dir = Path(args.mappings_dir or tempfile.mkdtemp(prefix='cv_bench_'))
+    mappings_dir.mkdir(parents=True, exist_ok=True)
+
+    devnull = open(os.devnull, 'wb')
+    # одно и то же изображение гоняется --repeat раз — повторы не должны срезаться
+    worker = InferenceWorker(mappings_dir, output=OutputWriter(devnull), frame_dedup='off')
+    worker.hand_detection = not args.no_hand
+    worker.init_models(
+        args.yolo_model or yolo_model_path(),
+        args.corner_model or corner_model_path(),
+        lazy=('hand',) if args.no_hand else (),
+    )
+
+    datasets: Dict[str, List[Path]] = {}
+    for name in args.datasets:
+        dataset = Path(name)
+        if not dataset.is_absolute():
+            dataset = CHESS_RECOGNITION_ROOT / dataset
+        if not dataset.is_dir():
+            print(f'SKIP: dataset not found: {dataset}', file=sys.stderr)
+            continue
+        datasets[name] = _find_images(dataset, args.limit)
+
+    # Прогрев (ленивая инициализация CUDA/MediaPipe) на первом изображении,
+    # затем метрики обнуляются, чтобы он не попал в отчёт
+    first = next((images[0] for images in datasets.values() if images), None)
+    if first is not None and args.warmup:
+        image = cv2.imread(str(first))
+        if image is not None:
+            with open(mappings_dir / 'bench_warmup_mapping.json', 'w', encoding='utf-8') as f:
+                json.dump(synthetic_mapping(image, first, 'bench_warmup'), f)
+            worker.register('bench_warmup')
+            frame_data = first.read_bytes()
+            for _ in range(args.warmup):
+                worker.process_frame('bench_warmup', frame_data)
+            worker.unregister('bench_warmup')
+    worker.metrics.reset()
+
+    mapping_failures = 0
+    frames = 0
+    frame_wall = 0.0
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+
+    for name, images in datasets.items():
+        dataset = Path(name)
+        for index, image_path in enumerate(images):
+            image = cv2.imread(str(image_path))
+            if image is None:
+                continue
+            token = f'bench_{dataset.parent.name}_{dataset.name}_{index}'
+
+            mapping = None
+            if args.mapping == 'auto':
+                started = time.perf_counter()
+                mapping = map_chessboard(
+                    image,
+                    game_token=token,
+                    mappings_dir=mappings_dir,
+                    preloaded_yolo_detector=worker.models.yolo,
+                    preloaded_corner_bundle=worker.models.corner,
+                    corner_tta=args.corner_tta,
+                )
+                worker.metrics.observe('map_chessboard', time.perf_counter() - started)
+                if not mapping.get('success'):
+                    mapping_failures += 1
+                    mapping = None
+            if mapping is None:
+                mapping = synthetic_mapping(image, image_path, token)
+                with open(mappings_dir / f'{token}_mapping.json', 'w', encoding='utf-8') as f:
+                    json.dump(mapping, f)
+
+            frame_data = image_path.read_bytes()
+            worker.register(token)
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                worker.process_frame(token, frame_data)
+            frame_wall += time.perf_counter() - started
+            frames += args.repeat
+            worker.unregister(token)
+
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+    worker.output.close()
+    devnull.close()
+
+    snapshot = worker.metrics.snapshot()
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'device': worker.models.corner.device if worker.models.corner else None,
+            'mapping': args.mapping,
+            'corner_tta': args.corner_tta,
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+            'hand': not args.no_hand,
+        },
+        'datasets': {name: len(images) for name, images in datasets.items()},
+        'frames': frames,
+        'mapping_failures': mapping_failures,
+        'wall_s': round(wall, 3),
+        'fps': round(frames / frame_wall, 2) if frame_wall else 0.0,
+        # > 1.0 означает, что работало несколько потоков (torch, OpenCV)
+        'cpu_utilization': round(cpu / wall, 3) if wall else 0.0,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'model_load_seconds': snapshot['model_load_seconds'],
+        'counters': snapshot['counters'],
+        'stages': snapshot['stages'],
+    }
+
+
+def compare_with_baseline(
+    report: Dict,
+    baseline: Dict,
+    metric: str,
+    threshold: float,
+    min_delta_ms: float,
+) -> List[Tuple[str, float, float]]:
+    """Стадии, ставшие медленнее базы: [(стадия, база мс, сейчас мс)]."""
+    regressions = []
+    for stage, current in report['stages'].items():
+        base = baseline.get('stages', {}).get(stage)
+        if not base or metric not in base or metric not in current:
+            continue
+        before, after = base[metric], current[metric]
+        if after > before * (1.0 + threshold) and after - before >= min_delta_ms:
+            regressions.append((stage, before, after))
+    return regressions
+
+
+def print_report(report: Dict) -> None:
+    print(f"frames={report['frames']} fps={report['fps']} wall={report['wall_s']}s "
+          f"cpu={report['cpu_utilization']} peak_rss={report['peak_rss_bytes']}")
+    print(f"{'stage':<16}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, s in report['stages'].items():
+        if not s.get('count'):
+            continue
+        print(f"{stage:<16}{s['count']:>8}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}"
+              f"{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Бенчмарк CV-пайплайна ChessCast')
+    parser.add_argument('--datasets', nargs='+', default=list(DEFAULT_DATASETS),
+                        help='Папки датасетов относительно chess-recognition/')
+    parser.add_argument('--limit', type=int, default=None, help='Не больше N изображений на датасет')
+    parser.add_argument('--repeat', type=int, default=5, help='Прогонов process_frame на изображение')
+    parser.add_argument('--warmup', type=int, default=3, help='Прогревочных кадров перед замером')
+    parser.add_argument('--mapping', choices=('synthetic', 'auto'), default='synthetic',
+                        help='auto — калибровать через map_chessboard (с откатом на synthetic)')
+    parser.add_argument('--corner-tta', action='store_true',
+                        help='С --mapping auto: углы по батчу TTA-видов (сравнить map_chessboard с прогоном без флага)')
+    parser.add_argument('--no-hand', action='store_true', help='Без детектора руки: не загружать и не запускать')
+    parser.add_argument('--mappings-dir', default=None, help='Куда писать маппинги (по умолчанию временная папка)')
+    parser.add_argument('--yolo-model', default=None)
+    parser.add_argument('--corner-model', default=None)
+    parser.add_argument('--output', default=None, help='JSON с результатами прогона')
+    parser.add_argument('--baseline', default=None, help='JSON базового прогона для проверки регрессий')
+    parser.add_argument('--metric', default='p50_ms', choices=('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'))
+    parser.add_argument('--threshold', type=float, default=0.10, help='Допустимое замедление (доля)')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                        help='Игнорировать замедления меньше этого значения (шум)')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    report = run_benchmark(args)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f'Saved: {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.metric, args.threshold, args.min_delta_ms)
+        for stage, before, after in regressions:
+            print(f'REGRESSION: {stage} {args.metric} {before:.2f} -> {after:.2f} '
+                  f'(+{(after / before - 1) * 100 if before else 0:.1f}%)')
+        if regressions:
+            sys.exit(1)
+        print(f'OK: no stage slower than baseline by more than {args.threshold:.0%}')
+
+
+if __name__ == '__main__':
+    main()
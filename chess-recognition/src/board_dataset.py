@@ -0,0 +1,171 @@
+"""
+Размеченные выровненные доски для обучения и проверки моделей клеток.
+
+Для каждого снимка датасета строится маппинг доски (map_chessboard или,
+с mapping='synthetic', прямоугольник с отступом), кадр выравнивается в
+640×640, а рамки фигур из YOLO-разметки переносятся гомографией на
+равномерную сетку 8×8. Классы merged_new совпадают с ID фигур
+BoardStateMapper, поэтому разметка сразу даёт board_state (-1 — пусто).
+Используется train_occupancy.py, train_square_classifier.py и
+benchmark_engines.py.
+"""
+from __future__ import annotations
+
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from benchmark_pipeline import _find_images, synthetic_mapping
+from improved_board_mapping import OUTPUT_IMAGE_SIZE, SQUARE_COUNT, map_chessboard
+from model_paths import CHESS_RECOGNITION_ROOT, corner_model_path, yolo_model_path
+
+DEFAULT_TRAIN_DATASETS = ('merged_new/train', 'merged_new/valid')
+MAPPING_MODES = ('auto', 'synthetic')
+# Точка рамки, по которой фигура относится к клетке: ближе к основанию —
+# высокие фигуры в перспективе заходят верхушкой на соседнюю клетку
+ANCHOR_HEIGHT = 0.75
+
+
+@dataclass
+class LabelledBoard:
+    image_path: Path
+    # выровненная доска OUTPUT_IMAGE_SIZE, BGR
+    warped: np.ndarray
+    # (8, 8) ID фигур в порядке сетки warped-изображения, -1 — пусто
+    board_state: np.ndarray
+
+    @property
+    def occupancy(self) -> np.ndarray:
+        return self.board_state != -1
+
+
+def label_board_state(label_path: Path, width: int, height: int, matrix: np.ndarray) -> Optional[np.ndarray]:
+    """
+    (8, 8) ID фигур по YOLO-разметке (cls cx cy w h, нормированные) или
+    None без разметки. Если на клетку попали две рамки, остаётся последняя.
+    """
+    if not label_path.is_file():
+        return None
+    classes = []
+    points = []
+    for line in label_path.read_text().splitlines():
+        values = line.split()
+        if len(values) != 5:
+            continue
+        cls, cx, cy, _w, h = (float(v) for v in values)
+        classes.append(int(cls))
+        points.append((cx * width, (cy - h / 2 + h * ANCHOR_HEIGHT) * height))
+    board_state = np.full((SQUARE_COUNT, SQUARE_COUNT), -1, dtype=np.int16)
+    if not points:
+        return board_state
+    warped = cv2.perspectiveTransform(np.array([points], dtype=np.float32), matrix)[0]
+    out_w, out_h = OUTPUT_IMAGE_SIZE
+    cols = np.floor(warped[:, 0] / (out_w / SQUARE_COUNT)).astype(int)
+    rows = np.floor(warped[:, 1] / (out_h / SQUARE_COUNT)).astype(int)
+    inside = (cols >= 0) & (cols < SQUARE_COUNT) & (rows >= 0) & (rows < SQUARE_COUNT)
+    board_state[rows[inside], cols[inside]] = np.array(classes)[inside]
+    return board_state
+
+
+class LabelledBoardSource:
+    """
+    Итератор LabelledBoard по датасетам (пути относительно chess-recognition/).
+    С mapping='auto' снимки, где map_chessboard не нашёл доску, пропускаются;
+    skipped — число пропущенных снимков (нет доски, разметки или не читается).
+    """
+
+    def __init__(
+        self,
+        datasets: Sequence[str] = DEFAULT_TRAIN_DATASETS,
+        *,
+        limit: Optional[int] = None,
+        mapping: str = 'auto',
+        yolo_model: Optional[str] = None,
+        corner_model: Optional[str] = None,
+        models=None,
+    ):
+        if mapping not in MAPPING_MODES:
+            raise ValueError(f'Unknown mapping mode: {mapping}')
+        self.datasets = list(datasets)
+        self.limit = limit
+        self.mapping = mapping
+        self.models = models
+        if mapping == 'auto' and models is None:
+            from shared_models import SharedInferenceModels
+
+            self.models = SharedInferenceModels()
+            self.models.load(yolo_model or yolo_model_path(), corner_model or corner_model_path())
+        self.skipped = 0
+        self._mappings_dir = Path(tempfile.mkdtemp(prefix='cv_boards_'))
+
+    def __iter__(self) -> Iterator[LabelledBoard]:
+        index = 0
+        for name in self.datasets:
+            dataset = CHESS_RECOGNITION_ROOT / name
+            if not dataset.is_dir():
+                print(f'WARNING: dataset not found: {dataset}', file=sys.stderr)
+                continue
+            for image_path in _find_images(dataset, self.limit):
+                board = self._load(image_path, index)
+                if board is None:
+                    self.skipped += 1
+                    continue
+                index += 1
+                yield board
+
+    def _load(self, image_path: Path, index: int) -> Optional[LabelledBoard]:
+        image = cv2.imread(str(image_path))
+        if image is None:
+            return None
+        if self.mapping == 'auto':
+            mapping = map_chessboard(
+                image,
+                game_token=f'board_{index}',
+                mappings_dir=self._mappings_dir,
+                preloaded_yolo_detector=self.models.yolo,
+                preloaded_corner_bundle=self.models.corner,
+            )
+            if not mapping.get('success'):
+                return None
+        else:
+            mapping = synthetic_mapping(image, image_path, 'board')
+        matrix = np.array(mapping['perspective_matrix'], dtype=np.float64)
+        height, width = image.shape[:2]
+        board_state = label_board_state(image_path.parent.parent / 'labels' / f'{image_path.stem}.txt', width, height, matrix)
+        if board_state is None:
+            return None
+        warped = cv2.warpPerspective(image, matrix, OUTPUT_IMAGE_SIZE)
+        return LabelledBoard(image_path=image_path, warped=warped, board_state=board_state)
+
+
+class BoardAccuracy:
+    """Сравнение предсказанных board_state с разметкой (оба в порядке сетки warped)."""
+
+    def __init__(self):
+        self.boards = 0
+        self.correct = 0
+        self.occupancy_correct = 0
+        self.exact = 0
+
+    def add(self, predicted: np.ndarray, expected: np.ndarray) -> None:
+        same = predicted == expected
+        self.boards += 1
+        self.correct += int(np.count_nonzero(same))
+        self.occupancy_correct += int(np.count_nonzero((predicted != -1) == (expected != -1)))
+        self.exact += int(same.all())
+
+    def summary(self) -> Dict:
+        if not self.boards:
+            return {}
+        squares = self.boards * SQUARE_COUNT * SQUARE_COUNT
+        return {
+            'boards': self.boards,
+            'square_accuracy': round(self.correct / squares, 4),
+            'occupancy_accuracy': round(self.occupancy_correct / squares, 4),
+            'board_exact': round(self.exact / self.boards, 4),
+        }
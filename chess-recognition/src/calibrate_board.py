@@ -3,6 +3,7 @@
 """
 import argparse
 import cv2
+import numpy as np
 import json
 import warnings
 from pathlib import Path
@@ -14,7 +15,8 @@ warnings.filterwarnings('ignore', message='.*pkg_resources.*')
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from improved_board_mapping import map_chessboard
+from calibration_artifacts import ARTIFACT_LEVELS, configure_artifacts, get_artifact_writer
+from improved_board_mapping import load_mapping_data, map_chessboard
 
 
 def main():
@@ -23,8 +25,13 @@ def main():
     parser.add_argument('--image', required=True, help='Путь к изображению доски')
     parser.add_argument('--mappings-dir', default='./chessboard_mappings', help='Директория для маппингов')
     parser.add_argument('--model', default=None, help='Путь к модели YOLO11 для детекции фигур')
+    parser.add_argument('--debug-artifacts', choices=ARTIFACT_LEVELS, default='always',
+                        help='Отладочные изображения калибровки (в <mappings-dir>/debug)')
+    parser.add_argument('--seeded', action='store_true',
+                        help='Кроп по углам существующего маппинга токена вместо прохода YOLO')
 
     args = parser.parse_args()
+    configure_artifacts(args.debug_artifacts)
 
     mappings_dir = Path(args.mappings_dir)
     mappings_dir.mkdir(parents=True, exist_ok=True)
@@ -34,6 +41,12 @@ def main():
         print(f"ERROR: Не удалось загрузить изображение: {args.image}")
         sys.exit(1)
 
+    prior_corners = None
+    if args.seeded:
+        previous = load_mapping_data(args.token, mappings_dir)
+        if previous and previous.get('success') and previous.get('board_corners'):
+            prior_corners = np.array(previous['board_corners'], dtype=np.float32)
+
     result = map_chessboard(
         image=image,
         game_token=args.token,
@@ -42,7 +55,10 @@ def main():
         mappings_dir=mappings_dir,
         model_path=args.model,
         conf_threshold=0.5,
+        prior_corners=prior_corners,
     )
+    # Дождаться фоновой записи отладочных изображений перед выходом
+    get_artifact_writer().flush()
 
     if result['success']:
         print(f"SUCCESS: Маппинг выполнен успешно для токена {args.token}")
@@ -0,0 +1,185 @@
+"""
+Отладочные изображения калибровки: рамки YOLO/кропа и углы доски на
+исходном кадре, сетка на выровненной доске.
+
+Во время калибровки только запоминаются примитивы (CalibrationDebug) —
+без копии полного кадра. Рисование и JPEG-кодирование выполняет фоновый
+поток ArtifactWriter; для каждого токена хранится не больше
+keep_per_token последних наборов, старые удаляются.
+
+Уровни: off — ничего не пишем, on_failure — только неудачные
+калибровки (по умолчанию), always — каждую.
+"""
+from __future__ import annotations
+
+import os
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from worker_logging import get_logger
+
+ARTIFACT_LEVELS = ('off', 'on_failure', 'always')
+DEFAULT_ARTIFACT_LEVEL = os.environ.get('CV_DEBUG_ARTIFACTS', 'on_failure')
+DEFAULT_KEEP_PER_TOKEN = 3
+ARTIFACTS_SUBDIR = 'debug'
+_QUEUE_SIZE = 16
+
+_log = get_logger('artifacts')
+
+Box = Tuple[int, int, int, int]
+
+
+@dataclass
+class CalibrationDebug:
+    """Что рисовать на исходном кадре; заполняется по ходу _detect_board_corners_resnet."""
+
+    pieces: List[Tuple[Box, float, Tuple[float, float]]] = field(default_factory=list)
+    board_area: Optional[Box] = None
+    crop_area: Optional[Box] = None
+    # подпись рамки на весь кадр, если кроп не применялся
+    full_frame_label: Optional[str] = None
+    corners: Optional[np.ndarray] = None
+
+    def render(self, image: np.ndarray) -> np.ndarray:
+        out = image.copy()
+        height, width = out.shape[:2]
+        for (x1, y1, x2, y2), conf, (cx, cy) in self.pieces:
+            cv2.rectangle(out, (x1, y1), (x2, y2), (0, 165, 255), 3)
+            cv2.putText(out, f'{conf:.2f}', (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 165, 255), 1)
+            cv2.circle(out, (int(cx), int(cy)), 3, (0, 165, 255), -1)
+        if self.board_area is not None:
+            x1, y1, x2, y2 = self.board_area
+            cv2.rectangle(out, (x1, y1), (x2, y2), (255, 0, 0), 5)
+            cv2.putText(out, 'Board Area', (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 3)
+        if self.crop_area is not None:
+            x1, y1, x2, y2 = self.crop_area
+            cv2.rectangle(out, (x1, y1), (x2, y2), (255, 0, 255), 5)
+            cv2.putText(out, 'Crop Area (3:4)', (x1, y2 + 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 255), 3)
+        elif self.full_frame_label:
+            cv2.rectangle(out, (0, 0), (width, height), (255, 0, 255), 5)
+            cv2.putText(out, self.full_frame_label, (10, height - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 255), 3)
+        if self.corners is not None:
+            for i, corner in enumerate(self.corners):
+                pt = tuple(int(v) for v in corner)
+                cv2.circle(out, pt, 15, (0, 255, 0), -1)
+                cv2.putText(out, str(i), (pt[0] + 20, pt[1]), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 3)
+            for i in range(4):
+                pt1 = tuple(int(v) for v in self.corners[i])
+                pt2 = tuple(int(v) for v in self.corners[(i + 1) % 4])
+                cv2.line(out, pt1, pt2, (0, 255, 0), 5)
+        return out
+
+
+def render_grid(warped_image: np.ndarray, square_corners: np.ndarray) -> np.ndarray:
+    """Сетка клеток поверх выровненной доски."""
+    out = warped_image.copy()
+    count = square_corners.shape[0] - 1
+    for i in range(count + 1):
+        for j in range(count + 1):
+            pt = tuple(int(v) for v in square_corners[i, j])
+            cv2.circle(out, pt, 3, (0, 255, 0), -1)
+            if i < count:
+                cv2.line(out, pt, tuple(int(v) for v in square_corners[i + 1, j]), (0, 255, 0), 1)
+            if j < count:
+                cv2.line(out, pt, tuple(int(v) for v in square_corners[i, j + 1]), (0, 255, 0), 1)
+    return out
+
+
+class ArtifactWriter:
+    """Фоновая отрисовка и запись артефактов с ротацией по токену."""
+
+    def __init__(self, level: str = DEFAULT_ARTIFACT_LEVEL, keep_per_token: int = DEFAULT_KEEP_PER_TOKEN):
+        self.configure(level, keep_per_token)
+        self._queue: queue.Queue = queue.Queue(maxsize=_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name='calibration-artifacts', daemon=True)
+        self._thread.start()
+
+    def configure(self, level: Optional[str] = None, keep_per_token: Optional[int] = None) -> None:
+        if level is not None:
+            if level not in ARTIFACT_LEVELS:
+                raise ValueError(f'Unknown debug artifact level: {level}')
+            self.level = level
+        if keep_per_token is not None:
+            self.keep_per_token = max(1, keep_per_token)
+
+    @property
+    def enabled(self) -> bool:
+        return self.level != 'off'
+
+    def wants(self, success: bool) -> bool:
+        return self.level == 'always' or (self.level == 'on_failure' and not success)
+
+    def path_for(self, mappings_dir: Path, game_token: str, stamp: str, kind: str) -> Path:
+        return mappings_dir / ARTIFACTS_SUBDIR / f'{game_token}_{stamp}_{kind}.jpg'
+
+    def submit(self, mappings_dir: Path, game_token: str, jobs: List[Tuple[Path, Callable[[], np.ndarray]]]) -> None:
+        """
+        jobs: (путь, функция рисования). Функции выполняются в фоне — массивы,
+        которые они захватывают, вызывающий больше не должен менять.
+        """
+        try:
+            self._queue.put_nowait((mappings_dir, game_token, jobs))
+        except queue.Full:
+            _log.warning('Artifact queue is full, dropping debug images for %s', game_token)
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Ждёт записи всего, что уже в очереди (для CLI-скриптов перед выходом)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _run(self) -> None:
+        while True:
+            mappings_dir, game_token, jobs = self._queue.get()
+            try:
+                for path, render in jobs:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    if not cv2.imwrite(str(path), render()):
+                        _log.warning('Failed to write %s', path)
+                self._rotate(mappings_dir / ARTIFACTS_SUBDIR, game_token)
+            except Exception as exc:
+                _log.warning('Failed to save debug images for %s: %s', game_token, exc)
+            finally:
+                self._queue.task_done()
+
+    def _rotate(self, directory: Path, game_token: str) -> None:
+        # имя: <token>_<stamp>_<kind>.jpg; у файлов одной калибровки общий stamp
+        pattern = re.compile(rf'^{re.escape(game_token)}_(\d{{8}}_\d{{9}})_[a-z_]+\.jpg$')
+        sets: Dict[str, List[Path]] = {}
+        for path in directory.glob(f'{game_token}_*.jpg'):
+            match = pattern.match(path.name)
+            if match:
+                sets.setdefault(match.group(1), []).append(path)
+        for stamp in sorted(sets)[:-self.keep_per_token]:
+            for path in sets[stamp]:
+                path.unlink(missing_ok=True)
+
+
+_writer: Optional[ArtifactWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_artifact_writer() -> ArtifactWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ArtifactWriter()
+        return _writer
+
+
+def configure_artifacts(level: Optional[str] = None, keep_per_token: Optional[int] = None) -> None:
+    get_artifact_writer().configure(level, keep_per_token)
+
+
+def artifact_stamp() -> str:
+    """Метка набора артефактов: YYYYmmdd_HHMMSSmmm (сортируется по времени)."""
+    now = time.time()
+    return time.strftime('%Y%m%d_%H%M%S', time.localtime(now)) + f'{int(now * 1000) % 1000:03d}'
@@ -0,0 +1,74 @@
+"""
+Распознавание повторных кадров сессии (--frame-dedup / CV_FRAME_DEDUP).
+
+Статичная камера и WebRTC на паузе часто шлют побайтно одинаковые кадры.
+Режимы:
+  off       — каждый кадр проходит весь конвейер;
+  exact     — совпадает хеш тела кадра с прошлым кадром сессии (до декодирования);
+  thumbnail — exact, а после декодирования ещё и серая миниатюра
+              THUMBNAIL_SIZE×THUMBNAIL_SIZE отличается от миниатюры последнего
+              полностью обработанного кадра не больше чем на THUMBNAIL_TOLERANCE
+              уровней в каждом пикселе (перекодированный JPEG того же изображения).
+              Сравнение не с соседним кадром: иначе медленный дрейф картинки
+              по шагам в пределах допуска бесконечно считался бы повтором.
+
+Повтор не гоняет warp/руку/YOLO: StreamProcessor берёт результаты прошлого
+кадра, история голосования продвигается как обычно.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+DEDUP_MODES = ('off', 'exact', 'thumbnail')
+DEFAULT_DEDUP_MODE = os.environ.get('CV_FRAME_DEDUP', 'exact')
+THUMBNAIL_SIZE = 32
+# Ход фигуры меняет клетку миниатюры на десятки уровней, шум JPEG — на единицы
+THUMBNAIL_TOLERANCE = 3
+
+
+def _thumbnail(frame: np.ndarray) -> np.ndarray:
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+class FrameDeduplicator:
+    def __init__(self, mode: str = DEFAULT_DEDUP_MODE):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f'Unknown frame dedup mode: {mode}')
+        self.mode = mode
+        self._digests: Dict[str, bytes] = {}
+        self._thumbnails: Dict[str, np.ndarray] = {}
+
+    def same_payload(self, token: str, payload: bytes | memoryview) -> bool:
+        """Тело кадра побайтно совпало с прошлым кадром сессии."""
+        if self.mode == 'off':
+            return False
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        previous = self._digests.get(token)
+        self._digests[token] = digest
+        return digest == previous
+
+    def same_image(self, token: str, frame: np.ndarray) -> bool:
+        """
+        Только в режиме thumbnail: декодированный кадр почти не отличается
+        от последнего кадра, прошедшего конвейер. Миниатюра запоминается
+        только у таких кадров, у повторов — нет.
+        """
+        if self.mode != 'thumbnail':
+            return False
+        thumbnail = _thumbnail(frame)
+        previous: Optional[np.ndarray] = self._thumbnails.get(token)
+        if previous is not None and int(np.abs(thumbnail - previous).max()) <= THUMBNAIL_TOLERANCE:
+            return True
+        self._thumbnails[token] = thumbnail
+        return False
+
+    def forget(self, token: str) -> None:
+        """Следующий кадр сессии обрабатывается полностью."""
+        self._digests.pop(token, None)
+        self._thumbnails.pop(token, None)
@@ -0,0 +1,92 @@
+"""
+Декодирование тела команды frame по полю format.
+
+  jpeg — сжатый кадр (JPEG/PNG), cv2.imdecode; по умолчанию;
+  bgr  — height×width×3 BGR24 как есть: массив — view на буфер, без копии;
+  i420 — планарный YUV 4:2:0 (Y, U, V), один cv2.cvtColor в BGR;
+  nv12 — Y и чередующиеся UV, один cv2.cvtColor в BGR.
+
+Сырые форматы требуют width и height; длина тела должна совпадать с
+raw_frame_size. Они избавляют отправителя от кодирования JPEG, а воркер —
+от декодирования.
+"""
+from __future__ import annotations
+
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+FRAME_FORMATS = ('jpeg', 'bgr', 'i420', 'nv12')
+DEFAULT_FRAME_FORMAT = 'jpeg'
+
+_YUV_TO_BGR = {
+    'i420': cv2.COLOR_YUV2BGR_I420,
+    'nv12': cv2.COLOR_YUV2BGR_NV12,
+}
+
+
+class FrameFormatError(ValueError):
+    pass
+
+
+def raw_frame_size(fmt: str, width: int, height: int) -> int:
+    """Ожидаемая длина тела сырого кадра в байтах."""
+    if width <= 0 or height <= 0:
+        raise FrameFormatError(f'Invalid frame size {width}x{height} for format {fmt}')
+    if fmt == 'bgr':
+        return width * height * 3
+    if fmt in _YUV_TO_BGR:
+        # хрома 4:2:0 — по одному отсчёту U и V на блок 2×2
+        if width % 2 or height % 2:
+            raise FrameFormatError(f'{fmt} needs even width and height, got {width}x{height}')
+        return width * height * 3 // 2
+    raise FrameFormatError(f'Unknown frame format: {fmt}')
+
+
+def decode_frame(
+    data: bytes | memoryview,
+    fmt: str = DEFAULT_FRAME_FORMAT,
+    width: int = 0,
+    height: int = 0,
+) -> Optional[np.ndarray]:
+    """
+    BGR-кадр или None, если JPEG не декодировался. Для bgr результат
+    ссылается на data и действителен, пока жив буфер.
+    """
+    buf = np.frombuffer(data, np.uint8)
+    if fmt == DEFAULT_FRAME_FORMAT:
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    expected = raw_frame_size(fmt, width, height)
+    if buf.size != expected:
+        raise FrameFormatError(f'{fmt} {width}x{height} needs {expected} bytes, got {buf.size}')
+    if fmt == 'bgr':
+        return buf.reshape(height, width, 3)
+    return cv2.cvtColor(buf.reshape(height * 3 // 2, width), _YUV_TO_BGR[fmt])
+
+
+def encode_frame(image: np.ndarray, fmt: str) -> Tuple[bytes, Dict]:
+    """
+    Обратное к decode_frame (для нагрузочных тестов): тело и поля команды
+    frame. Для YUV нечётная строка/столбец обрезаются.
+    """
+    if fmt == DEFAULT_FRAME_FORMAT:
+        ok, encoded = cv2.imencode('.jpg', image)
+        if not ok:
+            raise FrameFormatError('JPEG encoding failed')
+        return encoded.tobytes(), {}
+    height, width = image.shape[:2]
+    if fmt in _YUV_TO_BGR:
+        height, width = height - height % 2, width - width % 2
+    raw_frame_size(fmt, width, height)
+    image = np.ascontiguousarray(image[:height, :width])
+    if fmt == 'bgr':
+        data = image.tobytes()
+    else:
+        i420 = cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420)
+        if fmt == 'nv12':
+            # плоскости U и V -> чередующиеся пары UV
+            u, v = i420[height:].reshape(2, -1)
+            i420[height:] = np.stack((u, v), axis=1).reshape(height // 2, width)
+        data = i420.tobytes()
+    return data, {'format': fmt, 'width': width, 'height': height}
@@ -0,0 +1,109 @@
+"""
+Бюджет времени импорта CLI-модулей (python -X importtime).
+
+Каждый модуль импортируется в отдельном процессе. Проверка падает, если
+импорт дольше --budget-ms или тянет тяжёлый фреймворк из FORBIDDEN:
+torch/ultralytics/mediapipe должны загружаться только там, где
+действительно нужна модель. Код выхода 1 — для CI.
+
+Пример:
+    python src/import_budget.py --budget-ms 500
+    python src/import_budget.py --modules calibrate_board --show 15
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+SRC_DIR = Path(__file__).resolve().parent
+
+# Импорт этих модулей не должен загружать модели и их фреймворки
+ENTRY_MODULES = ('calibrate_board', 'stream_server', 'improved_board_mapping', 'worker_logging', 'model_paths')
+FORBIDDEN = ('torch', 'torchvision', 'ultralytics', 'PIL', 'mediapipe')
+DEFAULT_BUDGET_MS = 500.0
+
+
+class ImportReport(NamedTuple):
+    module: str
+    total_ms: float
+    # накопленное время импорта каждого пакета (на любой глубине), мс
+    packages: Dict[str, float]
+    error: str
+
+
+def measure(module: str) -> ImportReport:
+    """module='' — пустой процесс: что импортирует сам интерпретатор при старте"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(SRC_DIR), str(SRC_DIR.parent)]))
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}' if module else 'pass'],
+        cwd=str(SRC_DIR),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    packages: Dict[str, float] = {}
+    total_ms = 0.0
+    error = ''
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            error = line if line.strip() else error
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # заголовок таблицы
+        cumulative_ms = int(parts[1]) / 1000.0
+        name = parts[2].strip()
+        # самый внешний импорт пакета накрывает все вложенные — берём максимум
+        package = name.split('.')[0]
+        packages[package] = max(packages.get(package, 0.0), cumulative_ms)
+        if name == module:
+            total_ms = cumulative_ms
+    if proc.returncode != 0:
+        error = error or f'exit code {proc.returncode}'
+    else:
+        error = ''
+    return ImportReport(module, total_ms, packages, error)
+
+
+def check(report: ImportReport, budget_ms: float) -> List[str]:
+    if report.error:
+        return [f'import failed: {report.error}']
+    problems = [f'pulls in {name}' for name in FORBIDDEN if name in report.packages]
+    if report.total_ms > budget_ms:
+        problems.append(f'{report.total_ms:.0f} ms > budget {budget_ms:.0f} ms')
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Бюджет времени импорта CLI-модулей')
+    parser.add_argument('--modules', nargs='+', default=list(ENTRY_MODULES))
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--show', type=int, default=5, help='Сколько самых дорогих пакетов выводить')
+    args = parser.parse_args()
+
+    startup = set(measure('').packages)
+    failed = False
+    for module in args.modules:
+        report = measure(module)
+        problems = check(report, args.budget_ms)
+        failed = failed or bool(problems)
+        status = 'FAIL' if problems else 'ok'
+        print(f'{module:<28}{report.total_ms:>9.1f} ms  {status}')
+        for problem in problems:
+            print(f'    {problem}')
+        heaviest = sorted(
+            ((name, ms) for name, ms in report.packages.items() if name != module and name not in startup),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        for name, ms in heaviest[:args.show]:
+            print(f'    {name:<24}{ms:>9.1f} ms')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,37 @@
 """
 Улучшенный маппинг шахматной доски - экспорт функций из notebook
 """
+from __future__ import annotations
+
 import cv2
 import numpy as np
 import json
 import os
 import sys
+import threading
 from pathlib import Path
-from typing import Tuple, List, Optional, Dict
+from typing import TYPE_CHECKING, Tuple, List, Optional, Dict
 from datetime import datetime
-from model.yolo11_detector import YOLO11Detector
-
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
-from PIL import Image
+from calibration_artifacts import CalibrationDebug, artifact_stamp, get_artifact_writer, render_grid
+from model.square_features import extract_square_features
+from worker_logging import get_logger
 
+# torch, torchvision и ultralytics импортируются внутри функций, которым нужна
+# модель: load_mapping_data/apply_mapping и CLI без модели не платят за их загрузку
+if TYPE_CHECKING:
+    import torch
 
-class CornerRegressor(nn.Module):
-    """Модель ResNet для регрессии углов доски (8 координат)"""
 
-    def __init__(self, model_name: str = 'resnet34', pretrained: bool = False):
-        super().__init__()
-        self.model_name = model_name
+def __getattr__(name: str):
+    # CornerRegressor переехал в shared_models; старый импорт отсюда продолжает работать
+    if name == 'CornerRegressor':
+        from shared_models import CornerRegressor
+        return CornerRegressor
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-        if model_name == 'resnet18':
-            self.backbone = models.resnet18(weights=None)
-        elif model_name == 'resnet34':
-            self.backbone = models.resnet34(weights=None)
-        elif model_name == 'resnet50':
-            self.backbone = models.resnet50(weights=None)
-        else:
-            raise ValueError(f"Неизвестная ResNet модель: {model_name}")
 
-        in_features = self.backbone.fc.in_features
-        self.backbone.fc = nn.Sequential(
-            nn.Linear(in_features, 512),
-            nn.ReLU(),
-            nn.Dropout(0.2),
-            nn.Linear(512, 8),
-        )
-
-    def forward(self, x):
-        output = self.backbone(x)
-        return torch.sigmoid(output)
+_resnet_log = get_logger('resnet')
+_mapping_log = get_logger('mapping')
 
 # Параметры маппинга
 OUTPUT_IMAGE_SIZE = (640, 640)
@@ -55,6 +43,19 @@ ADAPTIVE_THRESH_C = 2
 CANNY_LOW_THRESHOLD = 50
 CANNY_HIGH_THRESHOLD = 150
 
+# Test-time augmentation для регрессии углов: батч из нескольких видов кадра.
+# Четыре вида на CPU стоят почти четыре прохода ResNet, поэтому по умолчанию
+# выключено; цену замеряет benchmark_pipeline.py --mapping auto --corner-tta
+CORNER_TTA = os.environ.get('CV_CORNER_TTA', '0') == '1'
+# Масштаб вида "отдаление" и доля обрезки с каждой стороны для вида "приближение"
+TTA_ZOOM_OUT = 0.9
+TTA_ZOOM_IN_MARGIN = 0.04
+# Расхождение видов (доля стороны доски), при котором калибровка отклоняется
+CORNER_MAX_DISAGREEMENT = float(os.environ.get('CV_CORNER_MAX_DISAGREEMENT', '0.05'))
+# Сдвиг углов относительно прошлого маппинга (доля стороны доски), после
+# которого быстрый путь перекалибровки отбрасывается в пользу полного
+PRIOR_MAX_SHIFT = float(os.environ.get('CV_PRIOR_MAX_SHIFT', '0.08'))
+
 
 def order_points_clockwise(pts: np.ndarray) -> np.ndarray:
     """Упорядочивание точек по часовой стрелке"""
@@ -105,33 +106,20 @@ def perspective_transform(image: np.ndarray, corners: np.ndarray, output_size: T
 
 def is_board_empty(warped_image: np.ndarray, square_corners: np.ndarray, 
                    threshold: float = 0.15) -> Tuple[bool, float]:
-    """Проверка, пуста ли доска"""
-    gray = cv2.cvtColor(warped_image, cv2.COLOR_BGR2GRAY) if len(warped_image.shape) == 3 else warped_image
-    square_variations = []
-    
-    for i in range(SQUARE_COUNT):
-        for j in range(SQUARE_COUNT):
-            pt1 = square_corners[i, j].astype(int)
-            pt2 = square_corners[i, j + 1].astype(int)
-            pt3 = square_corners[i + 1, j + 1].astype(int)
-            pt4 = square_corners[i + 1, j].astype(int)
-            
-            mask = np.zeros(gray.shape, dtype=np.uint8)
-            pts = np.array([pt1, pt2, pt3, pt4], dtype=np.int32)
-            cv2.fillPoly(mask, [pts], 255)
-            
-            square_pixels = gray[mask > 0]
-            
-            if len(square_pixels) > 0:
-                std = np.std(square_pixels)
-                mean = np.mean(square_pixels)
-                variation = std / (mean + 1e-5)
-                square_variations.append(variation)
-    
-    if not square_variations:
+    """
+    Проверка, пуста ли доска: средний по клеткам коэффициент вариации
+    яркости. Сетка square_corners равномерная, поэтому клетки берутся
+    блоками внутри её рамки (extract_square_features), без масок.
+    """
+    grid = np.asarray(square_corners)
+    x0, y0 = np.floor(grid[0, 0]).astype(int)
+    x1, y1 = np.ceil(grid[-1, -1]).astype(int)
+    board = warped_image[max(y0, 0):y1 + 1, max(x0, 0):x1 + 1]
+    if min(board.shape[:2]) < SQUARE_COUNT:
         return False, 0.0
-    
-    avg_variation = np.mean(square_variations)
+
+    features = extract_square_features(board, square_count=SQUARE_COUNT, inset=0.0)
+    avg_variation = float(features.variation.mean())
     is_empty = avg_variation < threshold
     confidence = 1.0 - min(avg_variation / threshold, 1.0)
     
@@ -174,15 +162,71 @@ def _default_corner_model_path() -> str:
     return str(possible_paths[0])
 
 
+def _tta_batch(img_tensor: torch.Tensor) -> Tuple[torch.Tensor, List]:
+    """
+    Виды одного входа ResNet (C, S, S): исходный, отражение по горизонтали,
+    отдаление и приближение. Возвращает батч и обратные преобразования
+    нормированных координат (4, 2) каждого вида в систему исходного.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    size = img_tensor.shape[-1]
+    views = [img_tensor, torch.flip(img_tensor, dims=[2])]
+    inverses = [
+        lambda p: p,
+        lambda p: np.stack([1.0 - p[:, 0], p[:, 1]], axis=1),
+    ]
+
+    # Отдаление: уменьшенный кадр по центру, поля нулевые (= средний цвет после Normalize)
+    inner = int(round(size * TTA_ZOOM_OUT))
+    offset = (size - inner) // 2
+    small = F.interpolate(img_tensor[None], size=(inner, inner), mode='bilinear', align_corners=False)[0]
+    zoom_out = torch.zeros_like(img_tensor)
+    zoom_out[:, offset:offset + inner, offset:offset + inner] = small
+    shift, scale = offset / size, inner / size
+    views.append(zoom_out)
+    inverses.append(lambda p, shift=shift, scale=scale: (p - shift) / scale)
+
+    # Приближение: центральная часть, растянутая на весь вход
+    cut = int(round(size * TTA_ZOOM_IN_MARGIN))
+    crop = img_tensor[:, cut:size - cut, cut:size - cut]
+    zoom_in = F.interpolate(crop[None], size=(size, size), mode='bilinear', align_corners=False)[0]
+    shift, scale = cut / size, (size - 2 * cut) / size
+    views.append(zoom_in)
+    inverses.append(lambda p, shift=shift, scale=scale: p * scale + shift)
+
+    return torch.stack(views), inverses
+
+
+def _fuse_tta(outputs: np.ndarray, inverses: List) -> Tuple[np.ndarray, float]:
+    """
+    Медиана углов по видам и расхождение: средняя по углам медиана
+    отклонения видов от итоговой точки, в долях стороны доски.
+    """
+    views = np.stack([
+        order_points_clockwise(inverse(output.reshape(4, 2)).astype(np.float32))
+        for output, inverse in zip(outputs, inverses)
+    ])
+    fused = np.median(views, axis=0)
+    deviation = np.linalg.norm(views - fused[None], axis=2)
+    sides = np.linalg.norm(fused - np.roll(fused, -1, axis=0), axis=1)
+    disagreement = float(np.median(deviation, axis=0).mean() / max(sides.mean(), 1e-6))
+    return fused.reshape(-1), disagreement
+
+
 def _detect_board_corners_resnet(image: np.ndarray, 
                                   model_path: Optional[str] = None,
                                   img_size: int = 640,
                                   device: str = 'cpu',
                                   yolo_model_path: Optional[str] = None,
                                   use_crop: bool = False,
-                                  debug_image_out: Optional[np.ndarray] = None,
+                                  debug_out: Optional[CalibrationDebug] = None,
                                   preloaded_corner_bundle=None,
-                                  preloaded_yolo_detector=None) -> Optional[np.ndarray]:
+                                  preloaded_yolo_detector=None,
+                                  tta: bool = False,
+                                  quality_out: Optional[Dict] = None,
+                                  prior_corners: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
     """
     Детекция углов доски через модель ResNet.
     
@@ -193,15 +237,22 @@ def _detect_board_corners_resnet(image: np.ndarray,
         device: Устройство для вычислений ('cpu' или 'cuda')
         yolo_model_path: Путь к модели YOLO для предварительной детекции области доски
         use_crop: Использовать ли предварительный кроп области доски через YOLO
+        debug_out: Куда записать рамки для отладочного изображения (None — не собирать)
+        tta: Предсказывать по батчу аугментированных видов и брать медиану
+        quality_out: Сюда пишутся disagreement/confidence при tta
+        prior_corners: Углы из предыдущего маппинга — кроп строится по ним, YOLO не запускается
     
     Returns:
         Массив из 4 углов доски (4, 2) в координатах исходного изображения или None
     """
+    import torch
+    from shared_models import CornerModelBundle, CornerRegressor
+
     if preloaded_corner_bundle is None:
         if model_path is None:
             model_path = _default_corner_model_path()
         if not Path(model_path).exists():
-            print(f"[RESNET] Model not found: {model_path}", file=sys.stderr, flush=True)
+            _resnet_log.error('Model not found: %s', model_path)
             return None
     else:
         device = preloaded_corner_bundle.device
@@ -211,22 +262,27 @@ def _detect_board_corners_resnet(image: np.ndarray,
     h_orig_full, w_orig_full = image.shape[:2]
     crop_x_offset = 0
     crop_y_offset = 0
-    crop_bbox = None  # Для визуализации области поиска (с margin)
-    board_bbox_raw = None  # Для визуализации чистой области доски (без margin)
     was_cropped = False
     
-    # ВСЕГДА создаем debug изображение для визуализации (если не передано, создаем копию)
-    if debug_image_out is None:
-        debug_image_out = image.copy()
-    
     # Порог кропа
     crop_threshold_ratio = 0.8  # 80% порог
     
-    # ВСЕГДА ищем фигуры через YOLO (YOLO возвращает ТОЛЬКО фигуры, не область доски!)
-    board_bbox = None
+    # Область доски: из прошлого маппинга (prior_corners, без YOLO) или из фигур YOLO
+    board_area = None
     pieces_info = []
     
-    if yolo_model_path or preloaded_yolo_detector is not None:
+    if prior_corners is not None:
+        # Быстрый путь перекалибровки: кроп по углам предыдущего маппинга
+        prior = np.asarray(prior_corners, dtype=np.float32).reshape(4, 2)
+        margin = int((prior[:, 0].max() - prior[:, 0].min()) * 0.1)
+        board_area = (
+            max(0, int(prior[:, 0].min()) - margin),
+            max(0, int(prior[:, 1].min()) - margin),
+            min(w_orig_full, int(prior[:, 0].max()) + margin),
+            min(h_orig_full, int(prior[:, 1].max()) + margin),
+        )
+    elif yolo_model_path or preloaded_yolo_detector is not None:
+        # ВСЕГДА ищем фигуры через YOLO (YOLO возвращает ТОЛЬКО фигуры, не область доски!)
         try:
             # Используем высокий порог уверенности (0.7) чтобы исключить ложные срабатывания
             result = _detect_board_from_pieces(
@@ -249,19 +305,11 @@ def _detect_board_corners_resnet(image: np.ndarray,
                     # Если вернулся не tuple, значит что-то не так
                     pieces_info = []
             
-            # ВСЕГДА визуализируем фигуры на debug изображении (оранжевый цвет)
-            if pieces_info:
-                for i, piece in enumerate(pieces_info):
-                    x1, y1, x2, y2 = piece['bbox']
-                    conf = piece['confidence']
-                    # Рисуем bbox фигуры (оранжевый цвет, толстая рамка)
-                    cv2.rectangle(debug_image_out, (int(x1), int(y1)), (int(x2), int(y2)), (0, 165, 255), 3)
-                    # Показываем уверенность
-                    cv2.putText(debug_image_out, f'{conf:.2f}', (int(x1), int(y1) - 5), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 165, 255), 1)
-                    # Рисуем центр фигуры
-                    cx, cy = int(piece['center'][0]), int(piece['center'][1])
-                    cv2.circle(debug_image_out, (cx, cy), 3, (0, 165, 255), -1)
+            # Фигуры для отладочного изображения (оранжевые рамки)
+            if debug_out is not None:
+                debug_out.pieces = [
+                    (piece['bbox'], piece['confidence'], piece['center']) for piece in pieces_info
+                ]
             
             # ВСЕГДА строим область доски из фигур (с margin для большей области!)
             if pieces_info:
@@ -273,96 +321,83 @@ def _detect_board_corners_resnet(image: np.ndarray,
                 
                 # Добавляем margin 10% от ширины области доски чтобы область доски была больше фигур
                 board_width_temp = x_max_raw - x_min_raw
-                board_height_temp = y_max_raw - y_min_raw
                 margin_x = int(board_width_temp * 0.1)  # 10% от ширины области доски
                 margin_y = int(board_width_temp * 0.1)  # 10% от ширины области доски (используем ширину для обеих сторон)
-                x_min_raw = max(0, x_min_raw - margin_x)
-                y_min_raw = max(0, y_min_raw - margin_y)
-                x_max_raw = min(w_orig_full, x_max_raw + margin_x)
-                y_max_raw = min(h_orig_full, y_max_raw + margin_y)
-                
-                # Сохраняем область доски для визуализации
-                board_bbox_raw = (x_min_raw, y_min_raw, x_max_raw, y_max_raw)
-                
-                # ВСЕГДА рисуем синюю рамку области доски
-                cv2.rectangle(debug_image_out, (x_min_raw, y_min_raw), (x_max_raw, y_max_raw), (255, 0, 0), 5)
-                cv2.putText(debug_image_out, 'Board Area', (x_min_raw, y_min_raw - 10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 3)
-                
-                # Вычисляем ширину области доски
-                board_width = x_max_raw - x_min_raw
-                board_height = y_max_raw - y_min_raw
-                board_width_ratio = board_width / w_orig_full
-                
-                # Если доска маленькая (< 80% ширины кадра), кропаем добавляя сверху/снизу для 3:4
-                if board_width_ratio < crop_threshold_ratio:
-                    
-                    target_aspect = 3 / 4  # Портретное соотношение (width/height = 0.75)
-                    
-                    # Берем ширину области доски как основу для кропа
-                    crop_width = board_width
-                    # Вычисляем нужную высоту для соотношения 3:4
-                    crop_height = int(crop_width / target_aspect)
-                    
-                    # Вычисляем сколько нужно добавить сверху/снизу
-                    height_to_add = crop_height - board_height
-                    top_padding = height_to_add // 2
-                    bottom_padding = height_to_add - top_padding
-                    
-                    # Вычисляем координаты кропа: берем область доски и добавляем сверху/снизу
-                    x_min = x_min_raw
-                    x_max = x_max_raw
-                    y_min = max(0, y_min_raw - top_padding)
-                    y_max = min(h_orig_full, y_max_raw + bottom_padding)
-                    
-                    # Если не хватает места сверху, добавляем снизу
-                    if y_min_raw - top_padding < 0:
-                        extra_bottom = abs(y_min_raw - top_padding)
-                        y_min = 0
-                        y_max = min(h_orig_full, y_max_raw + bottom_padding + extra_bottom)
-                    
-                    # Если не хватает места снизу, добавляем сверху
-                    if y_max_raw + bottom_padding > h_orig_full:
-                        extra_top = (y_max_raw + bottom_padding) - h_orig_full
-                        y_max = h_orig_full
-                        y_min = max(0, y_min_raw - top_padding - extra_top)
-                    
-                    # Кропаем изображение с правильным соотношением сторон 3:4
-                    cropped_image = image[y_min:y_max, x_min:x_max]
-                    crop_x_offset = x_min
-                    crop_y_offset = y_min
-                    
-                    # Сохраняем bbox для визуализации (фиолетовый цвет)
-                    crop_bbox = (x_min, y_min, x_max, y_max)
-                    
-                    # ВСЕГДА рисуем фиолетовую рамку кропа (толстая яркая рамка, БЕЗ заливки!)
-                    cv2.rectangle(debug_image_out, (x_min, y_min), (x_max, y_max), (255, 0, 255), 5)
-                    cv2.putText(debug_image_out, 'Crop Area (3:4)', (x_min, y_max + 30), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 255), 3)
-                    
-                    # Используем кропнутое изображение для ResNet
-                    image = cropped_image
-                    was_cropped = True
-                else:
-                    # Рисуем фиолетовую рамку на полном изображении, чтобы показать что используется полное изображение
-                    cv2.rectangle(debug_image_out, (0, 0), (w_orig_full, h_orig_full), (255, 0, 255), 5)
-                    cv2.putText(debug_image_out, 'Full Image (No Crop)', (10, h_orig_full - 20), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 255), 3)
-            else:
-                # Если фигур нет, рисуем рамку кропа на полном изображении
-                cv2.rectangle(debug_image_out, (0, 0), (w_orig_full, h_orig_full), (255, 0, 255), 5)
-                cv2.putText(debug_image_out, 'Full Image (No Pieces)', (10, h_orig_full - 20), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 255), 3)
+                board_area = (
+                    max(0, x_min_raw - margin_x),
+                    max(0, y_min_raw - margin_y),
+                    min(w_orig_full, x_max_raw + margin_x),
+                    min(h_orig_full, y_max_raw + margin_y),
+                )
+            elif debug_out is not None:
+                debug_out.full_frame_label = 'Full Image (No Pieces)'
         except Exception as e:
-            print(f"[RESNET] ERROR searching board area via YOLO: {e}", file=sys.stderr, flush=True)
-            import traceback
-            traceback.print_exc()
-            print(f"[RESNET] Using full image due to YOLO error", file=sys.stderr, flush=True)
+            _resnet_log.exception('Error searching board area via YOLO, using full image: %s', e)
+    
+    if board_area is not None:
+        x_min_raw, y_min_raw, x_max_raw, y_max_raw = board_area
+        
+        # Синяя рамка области доски на отладочном изображении
+        if debug_out is not None:
+            debug_out.board_area = board_area
+        
+        # Вычисляем ширину области доски
+        board_width = x_max_raw - x_min_raw
+        board_height = y_max_raw - y_min_raw
+        board_width_ratio = board_width / w_orig_full
+        
+        # Если доска маленькая (< 80% ширины кадра), кропаем добавляя сверху/снизу для 3:4
+        if board_width_ratio < crop_threshold_ratio:
+            
+            target_aspect = 3 / 4  # Портретное соотношение (width/height = 0.75)
+            
+            # Берем ширину области доски как основу для кропа
+            crop_width = board_width
+            # Вычисляем нужную высоту для соотношения 3:4
+            crop_height = int(crop_width / target_aspect)
+            
+            # Вычисляем сколько нужно добавить сверху/снизу
+            height_to_add = crop_height - board_height
+            top_padding = height_to_add // 2
+            bottom_padding = height_to_add - top_padding
+            
+            # Вычисляем координаты кропа: берем область доски и добавляем сверху/снизу
+            x_min = x_min_raw
+            x_max = x_max_raw
+            y_min = max(0, y_min_raw - top_padding)
+            y_max = min(h_orig_full, y_max_raw + bottom_padding)
+            
+            # Если не хватает места сверху, добавляем снизу
+            if y_min_raw - top_padding < 0:
+                extra_bottom = abs(y_min_raw - top_padding)
+                y_min = 0
+                y_max = min(h_orig_full, y_max_raw + bottom_padding + extra_bottom)
+            
+            # Если не хватает места снизу, добавляем сверху
+            if y_max_raw + bottom_padding > h_orig_full:
+                extra_top = (y_max_raw + bottom_padding) - h_orig_full
+                y_max = h_orig_full
+                y_min = max(0, y_min_raw - top_padding - extra_top)
+            
+            # Кропаем изображение с правильным соотношением сторон 3:4
+            cropped_image = image[y_min:y_max, x_min:x_max]
+            crop_x_offset = x_min
+            crop_y_offset = y_min
+            
+            # Фиолетовая рамка кропа на отладочном изображении
+            if debug_out is not None:
+                debug_out.crop_area = (x_min, y_min, x_max, y_max)
+            
+            # Используем кропнутое изображение для ResNet
+            image = cropped_image
+            was_cropped = True
+        elif debug_out is not None:
+            # Рамка на весь кадр: используется полное изображение
+            debug_out.full_frame_label = 'Full Image (No Crop)'
     
     try:
         if preloaded_corner_bundle is not None:
-            model = preloaded_corner_bundle.model
-            model_input_size = preloaded_corner_bundle.img_size
+            bundle = preloaded_corner_bundle
         else:
             model_name = 'resnet34'
             if 'resnet18' in model_path.lower():
@@ -373,45 +408,27 @@ def _detect_board_corners_resnet(image: np.ndarray,
             model.load_state_dict(torch.load(model_path, map_location=device))
             model.to(device)
             model.eval()
-            model_input_size = img_size
+            bundle = CornerModelBundle(model=model, device=device, img_size=img_size, model_name=model_name)
+        model = bundle.model
         
         h_resnet, w_resnet = image.shape[:2]
         
-        if was_cropped:
-            max_dim = max(h_resnet, w_resnet)
-        
-        # Преобразуем изображение для модели
-        # Для кропнутого изображения используем качественный ресайз через OpenCV перед PIL
-        if was_cropped:
-            # Используем cv2.INTER_LANCZOS4 для качественного ресайза (лучше чем стандартный PIL)
-            # Это особенно важно при upscale маленького кропнутого изображения
-            interpolation = cv2.INTER_LANCZOS4 if max(h_resnet, w_resnet) < 640 else cv2.INTER_AREA
-            image_resized = cv2.resize(image, (model_input_size, model_input_size), interpolation=interpolation)
-            img_rgb = cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB)
-            img_pil = Image.fromarray(img_rgb)
-        else:
-            # Для полного изображения используем стандартный PIL ресайз
-            img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            img_pil = Image.fromarray(img_rgb)
-        
-        # Трансформации: если уже ресайзили через OpenCV, то только нормализация
-        if was_cropped:
-            transform = transforms.Compose([
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-            ])
-        else:
-            transform = transforms.Compose([
-                transforms.Resize((model_input_size, model_input_size)),  # Стандартный ресайз через PIL
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-            ])
-        
-        img_tensor = transform(img_pil).unsqueeze(0).to(device)
+        # Ресайз через OpenCV и нормализация прямо во входной тензор (без PIL и Compose)
+        img_tensor = bundle.preprocess(image)
         
         # Предсказание
-        with torch.no_grad():
-            coords_normalized = model(img_tensor).cpu().numpy().reshape(-1)  # 8 чисел [0, 1]
+        with torch.inference_mode():
+            if tta:
+                # Все виды за один батчевый проход
+                batch, inverses = _tta_batch(img_tensor[0])
+                outputs = model(batch).cpu().numpy()
+                coords_normalized, disagreement = _fuse_tta(outputs, inverses)
+                if quality_out is not None:
+                    quality_out['views'] = len(inverses)
+                    quality_out['disagreement'] = round(disagreement, 4)
+                    quality_out['confidence'] = round(max(0.0, 1.0 - disagreement / CORNER_MAX_DISAGREEMENT), 3)
+            else:
+                coords_normalized = model(img_tensor).cpu().numpy().reshape(-1)  # 8 чисел [0, 1]
         
         
         # Преобразуем нормализованные координаты в пиксели
@@ -460,9 +477,7 @@ def _detect_board_corners_resnet(image: np.ndarray,
         return ordered_corners.astype(np.float32)
         
     except Exception as e:
-        print(f"[RESNET] Ошибка при детекции: {e}", file=sys.stderr, flush=True)
-        import traceback
-        traceback.print_exc()
+        _resnet_log.exception('Ошибка при детекции: %s', e)
         return None
 
 
@@ -475,16 +490,10 @@ def _generate_uniform_square_grid(warped_image: np.ndarray,
     с координатами углов в пикселях warped_image.
     """
     h, w = warped_image.shape[:2]
-    step_x = w / square_count
-    step_y = h / square_count
-    
-    grid = np.zeros((square_count + 1, square_count + 1, 2), dtype=np.float32)
-    for i in range(square_count + 1):
-        for j in range(square_count + 1):
-            x = j * step_x
-            y = i * step_y
-            grid[i, j] = [x, y]
-    return grid
+    xs = (np.arange(square_count + 1) * (w / square_count)).astype(np.float32)
+    ys = (np.arange(square_count + 1) * (h / square_count)).astype(np.float32)
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    return np.stack((grid_x, grid_y), axis=-1)
 
 
 def _detect_border_size(warped_image: np.ndarray) -> Tuple[int, int]:
@@ -612,6 +621,8 @@ def _detect_board_from_pieces(image: np.ndarray,
     Возвращает массив углов доски (4, 2) или None, если данных недостаточно.
     """
     if detector is None:
+        from model.yolo11_detector import YOLO11Detector
+
         if model_path is None:
             model_path = _default_model_path()
         detector = YOLO11Detector(model_path, conf_threshold=conf_threshold)
@@ -735,6 +746,41 @@ def _detect_board_from_pieces(image: np.ndarray,
     return pts
 
 
+def _save_artifacts(artifacts,
+                    mappings_dir: Path,
+                    game_token: str,
+                    image: np.ndarray,
+                    debug: Optional[CalibrationDebug],
+                    success: bool,
+                    warped_image: Optional[np.ndarray] = None,
+                    square_corners: Optional[np.ndarray] = None) -> Dict[str, Path]:
+    """
+    Ставит отладочные изображения калибровки в фоновую запись (по уровню
+    артефактов). Возвращает пути, по которым они появятся.
+    """
+    if debug is None or not artifacts.wants(success):
+        return {}
+    stamp = artifact_stamp()
+    jobs = []
+    paths = {'board_corners': artifacts.path_for(mappings_dir, game_token, stamp, 'board_corners')}
+    jobs.append((paths['board_corners'], lambda: debug.render(image)))
+    if warped_image is not None and square_corners is not None:
+        paths['calibration_result'] = artifacts.path_for(mappings_dir, game_token, stamp, 'calibration_result')
+        jobs.append((paths['calibration_result'], lambda: render_grid(warped_image, square_corners)))
+    artifacts.submit(mappings_dir, game_token, jobs)
+    return paths
+
+
+def _prior_shift(corners: np.ndarray, prior_corners: np.ndarray) -> float:
+    """Наибольший сдвиг угла относительно прошлого маппинга, в долях средней стороны доски"""
+    current = order_points_clockwise(np.asarray(corners, dtype=np.float32))
+    prior = order_points_clockwise(np.asarray(prior_corners, dtype=np.float32))
+    side = float(np.linalg.norm(prior - np.roll(prior, -1, axis=0), axis=1).mean())
+    if side <= 0:
+        return float('inf')
+    return float(np.linalg.norm(current - prior, axis=1).max()) / side
+
+
 def map_chessboard(image: np.ndarray,
                   game_token: str,
                   check_empty: bool = False,
@@ -744,7 +790,9 @@ def map_chessboard(image: np.ndarray,
                   model_path: Optional[str] = None,
                   conf_threshold: float = 0.5,
                   preloaded_yolo_detector=None,
-                  preloaded_corner_bundle=None) -> Dict:
+                  preloaded_corner_bundle=None,
+                  corner_tta: Optional[bool] = None,
+                  prior_corners: Optional[np.ndarray] = None) -> Dict:
     """
     Полный процесс маппинга шахматной доски.
     
@@ -755,6 +803,15 @@ def map_chessboard(image: np.ndarray,
     
     Если фигур недостаточно или они слишком скучены, возвращаем ошибку
     и даём фронтенду возможность сделать ручную калибровку.
+    
+    corner_tta (по умолчанию CV_CORNER_TTA): углы по батчу аугментированных
+    видов; при расхождении видов больше CORNER_MAX_DISAGREEMENT калибровка
+    отклоняется, в результате — corner_confidence.
+    
+    prior_corners: углы доски из прошлого маппинга того же токена. ResNet
+    запускается на кропе вокруг них без прохода YOLO; если углы ушли
+    дальше PRIOR_MAX_SHIFT (или ResNet не справился), выполняется полный
+    путь. В результате calibration_path — 'seeded' или 'full'.
     """
     if mappings_dir is None:
         mappings_dir = Path('./chessboard_mappings')
@@ -790,60 +847,91 @@ def map_chessboard(image: np.ndarray,
         
         # Шаг 1: Определение границ доски через ResNet модель
         # Определяем устройство (GPU если доступно, иначе CPU)
+        import torch
+
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
         
         # Используем YOLO для предварительного кропа области доски (если модель доступна)
         yolo_model_path = model_path if model_path else None
         
-        # Создаем debug изображение для визуализации области поиска
-        # ВАЖНО: создаем копию ДО передачи, чтобы изменения сохранялись
-        debug_image = image.copy()
+        # Рамки для отладочного изображения собираются без копии кадра;
+        # рисование и запись JPEG — в фоне (calibration_artifacts)
+        artifacts = get_artifact_writer()
+        debug = CalibrationDebug() if artifacts.enabled else None
         
-        # Передаем debug_image по ссылке - все изменения будут видны в оригинале
-        board_corners = _detect_board_corners_resnet(
-            image,
-            model_path=None,
-            device=device,
-            yolo_model_path=yolo_model_path if preloaded_yolo_detector is None else None,
-            use_crop=True,
-            debug_image_out=debug_image,
-            preloaded_corner_bundle=preloaded_corner_bundle,
-            preloaded_yolo_detector=preloaded_yolo_detector,
-        )
+        if corner_tta is None:
+            corner_tta = CORNER_TTA
+        quality: Dict = {}
         
-        # После вызова debug_image содержит все нарисованные рамки из _detect_board_corners_resnet
+        board_corners = None
+        if prior_corners is not None:
+            board_corners = _detect_board_corners_resnet(
+                image,
+                model_path=None,
+                device=device,
+                use_crop=True,
+                debug_out=debug,
+                preloaded_corner_bundle=preloaded_corner_bundle,
+                tta=corner_tta,
+                quality_out=quality,
+                prior_corners=prior_corners,
+            )
+            shift = _prior_shift(board_corners, prior_corners) if board_corners is not None else None
+            if shift is not None and shift <= PRIOR_MAX_SHIFT:
+                result['calibration_path'] = 'seeded'
+                result['prior_shift'] = round(shift, 4)
+            else:
+                _mapping_log.info(
+                    'Seeded calibration for %s disagrees with previous mapping (shift=%s), running full path',
+                    game_token, 'n/a' if shift is None else f'{shift:.3f}',
+                )
+                board_corners = None
+                debug = CalibrationDebug() if artifacts.enabled else None
+                quality = {}
+        
+        if board_corners is None:
+            result['calibration_path'] = 'full'
+            board_corners = _detect_board_corners_resnet(
+                image,
+                model_path=None,
+                device=device,
+                yolo_model_path=yolo_model_path if preloaded_yolo_detector is None else None,
+                use_crop=True,
+                debug_out=debug,
+                preloaded_corner_bundle=preloaded_corner_bundle,
+                preloaded_yolo_detector=preloaded_yolo_detector,
+                tta=corner_tta,
+                quality_out=quality,
+            )
         
         if board_corners is None:
             result['error'] = (
                 'Не удалось автоматически определить границы доски. '
                 'Проверьте ракурс камеры и освещение.'
             )
+            _save_artifacts(artifacts, mappings_dir, game_token, image, debug, success=False)
             return result
         
         result['board_corners'] = board_corners.tolist()
+        if debug is not None:
+            # Найденные углы доски и рамка по ним (зеленый цвет)
+            debug.corners = board_corners
         
-        # Сохраняем исходное изображение с нарисованными границами для отладки
-        # debug_image уже содержит визуализацию области поиска из функции детекции:
-        # - Синяя рамка области доски (Board Area) - ВСЕГДА если найдена
-        # - Фиолетовая рамка кропа (если был применен кроп) - ВСЕГДА если кроп применен
-        # - Оранжевые фигуры, участвующие в определении области доски - ВСЕГДА если найдены
-        # ВСЕГДА добавляем найденные углы доски и рамку по ним (зеленый цвет)
-        try:
-            # Рисуем углы доски (зеленые точки)
-            for i, corner in enumerate(board_corners):
-                pt = tuple(corner.astype(int))
-                cv2.circle(debug_image, pt, 15, (0, 255, 0), -1)
-                cv2.putText(debug_image, str(i), (pt[0] + 20, pt[1]), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 3)
-            # Рисуем рамку по углам доски (зеленые линии, толстые и яркие)
-            for i in range(4):
-                pt1 = tuple(board_corners[i].astype(int))
-                pt2 = tuple(board_corners[(i + 1) % 4].astype(int))
-                cv2.line(debug_image, pt1, pt2, (0, 255, 0), 5)
-            # Сохраняем изображение ПОСЛЕ всего рисования
-            debug_path = mappings_dir / f'{game_token}_board_corners_debug.jpg'
-            cv2.imwrite(str(debug_path), debug_image)
-        except Exception as e:
-            print(f"[MAPPING] Failed to save debug image: {e}", file=sys.stderr, flush=True)
+        if quality:
+            result['corner_confidence'] = quality['confidence']
+            result['corner_disagreement'] = quality['disagreement']
+            if quality['disagreement'] > CORNER_MAX_DISAGREEMENT:
+                # Виды не согласны — не сохраняем заведомо кривой маппинг
+                result['error'] = (
+                    'Углы доски определены неуверенно. '
+                    'Проверьте ракурс камеры и освещение или откалибруйте вручную.'
+                )
+                _mapping_log.warning(
+                    'Calibration rejected for %s: corner disagreement %.3f > %.3f',
+                    game_token, quality['disagreement'], CORNER_MAX_DISAGREEMENT,
+                )
+                _save_artifacts(artifacts, mappings_dir, game_token, image, debug, success=False)
+                return result
         
         # Шаг 2: перспективное преобразование
         warped_image, perspective_matrix = perspective_transform(
@@ -857,6 +945,7 @@ def map_chessboard(image: np.ndarray,
         square_corners = _generate_uniform_square_grid(warped_image, SQUARE_COUNT)
         if np.asarray(square_corners).shape != (9, 9, 2):
             result['error'] = 'Invalid square grid generated during calibration'
+            _save_artifacts(artifacts, mappings_dir, game_token, image, debug, success=False)
             return result
         
         result['square_corners'] = square_corners.tolist()
@@ -865,75 +954,40 @@ def map_chessboard(image: np.ndarray,
         
         result['success'] = True
         
-        # Сохранение результата калибровки (warped image с сеткой)
-        try:
-            # Рисуем сетку на warped image
-            warped_with_grid = warped_image.copy()
-            for i in range(SQUARE_COUNT + 1):
-                for j in range(SQUARE_COUNT + 1):
-                    pt = square_corners[i, j].astype(int)
-                    # Рисуем точки углов
-                    cv2.circle(warped_with_grid, tuple(pt), 3, (0, 255, 0), -1)
-                    # Рисуем линии сетки
-                    if i < SQUARE_COUNT:
-                        pt_next = square_corners[i + 1, j].astype(int)
-                        cv2.line(warped_with_grid, tuple(pt), tuple(pt_next), (0, 255, 0), 1)
-                    if j < SQUARE_COUNT:
-                        pt_next = square_corners[i, j + 1].astype(int)
-                        cv2.line(warped_with_grid, tuple(pt), tuple(pt_next), (0, 255, 0), 1)
-            
-            # Подписи всех квадратов (a1, a2, ..., h8) закомментированы
-            # columns = list("abcdefgh")
-            # rows = list("12345678")
-            # for i in range(SQUARE_COUNT):
-            #     for j in range(SQUARE_COUNT):
-            #         # Координаты углов квадрата
-            #         pt1 = square_corners[i, j].astype(int)
-            #         pt2 = square_corners[i, j + 1].astype(int)
-            #         pt3 = square_corners[i + 1, j + 1].astype(int)
-            #         pt4 = square_corners[i + 1, j].astype(int)
-            #         
-            #         # Центр квадрата
-            #         center_x = (pt1[0] + pt3[0]) // 2
-            #         center_y = (pt1[1] + pt3[1]) // 2
-            #         
-            #         # Название квадрата (a1, b1, ..., h8)
-            #         # i=7 это нижний ряд (белые), i=0 это верхний ряд (черные)
-            #         # j=0 это колонка a, j=7 это колонка h
-            #         square_name = columns[j] + rows[7 - i]  # 7-i потому что i=7 это ряд 1, i=0 это ряд 8
-            #         
-            #         # Рисуем текст с фоном для лучшей читаемости
-            #         text_size = cv2.getTextSize(square_name, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)[0]
-            #         text_x = center_x - text_size[0] // 2
-            #         text_y = center_y + text_size[1] // 2
-            #         
-            #         # Фон для текста
-            #         cv2.rectangle(warped_with_grid, 
-            #                     (text_x - 3, text_y - text_size[1] - 3),
-            #                     (text_x + text_size[0] + 3, text_y + 3),
-            #                     (0, 0, 0), -1)
-            #         # Текст
-            #         cv2.putText(warped_with_grid, square_name, (text_x, text_y),
-            #                   cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 255), 1)
-            
-            # Сохраняем результат калибровки
-            calibration_result_path = mappings_dir / f'{game_token}_calibration_result.jpg'
-            cv2.imwrite(str(calibration_result_path), warped_with_grid)
-            result['calibration_result_path'] = str(calibration_result_path)
-        except Exception as e:
-            print(f"[MAPPING] Failed to save calibration result: {e}", file=sys.stderr, flush=True)
+        # Отладочные изображения (кадр с рамками и warped с сеткой)
+        paths = _save_artifacts(
+            artifacts, mappings_dir, game_token, image, debug,
+            success=True, warped_image=warped_image, square_corners=square_corners,
+        )
+        if 'calibration_result' in paths:
+            result['calibration_result_path'] = str(paths['calibration_result'])
         
-        mapping_file = mappings_dir / f'{game_token}_mapping.json'
-        with open(mapping_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
+        save_mapping_data(game_token, result, mappings_dir)
         
-            return result
+        return result
         
     except Exception as e:
         result['error'] = str(e)
         return result
 
 
+def save_mapping_data(game_token: str, data: Dict, mappings_dir: Path) -> Path:
+    """
+    Атомарная запись <token>_mapping.json (временный файл и os.replace):
+    калибровка пишет его на своём потоке, сессия — на основном, и читатель
+    никогда не видит недописанный файл.
+    """
+    mapping_file = mappings_dir / f'{game_token}_mapping.json'
+    tmp = mapping_file.with_name(f'.{mapping_file.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, mapping_file)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return mapping_file
+
+
 def load_mapping_data(game_token: str, mappings_dir: Path = None) -> Optional[Dict]:
     """Загрузка данных маппинга"""
     if mappings_dir is None:
@@ -8,9 +8,12 @@ import argparse
 import json
 import os
 import sys
+import threading
+import time
 import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Callable, Dict, Iterable, List, Optional
 
 import cv2
 import numpy as np
@@ -20,158 +23,609 @@ warnings.filterwarnings('ignore', message='.*pkg_resources.*')
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from improved_board_mapping import map_chessboard
-from model.hand_detector import close_hand_detector
+from frame_dedup import DEDUP_MODES, DEFAULT_DEDUP_MODE, FrameDeduplicator
+from frame_formats import DEFAULT_FRAME_FORMAT, FrameFormatError, decode_frame
+from calibration_artifacts import ARTIFACT_LEVELS, DEFAULT_ARTIFACT_LEVEL, DEFAULT_KEEP_PER_TOKEN, configure_artifacts
+from improved_board_mapping import load_mapping_data, map_chessboard
+from model.hand_detector import close_hand_detector, warm_up_hand_detector
+from model.occupancy import DEFAULT_OCCUPANCY_MODE, OCCUPANCY_MODES, OccupancyClassifier, load_occupancy_classifier
+from model.square_classifier import DEFAULT_ENGINE, ENGINES
 from model.stream_processor import StreamProcessor
-from model_paths import corner_model_path, yolo_model_path
+from model_cache import DEFAULT_MODEL_CACHE_DIR, ModelCache
+from model_optimization import DEFAULT_OPTIMIZE_MODE, OPTIMIZE_MODES
+from model_paths import corner_model_path, occupancy_model_path, square_classifier_model_path, yolo_model_path
 from shared_models import SharedInferenceModels
+from worker_capture import CaptureWriter
+from worker_framing import FrameReader
+from worker_logging import (
+    DEFAULT_LOG_LEVEL,
+    configure_logging,
+    forget_session,
+    get_logger,
+    set_log_config,
+)
+from worker_metrics import FrameTrace, MetricsRegistry, start_metrics_server
+from worker_output import DEFAULT_QUEUE_SIZE, SERIALIZERS, OutputWriter
+from worker_profiling import DEFAULT_PROFILE_FRAMES, DEFAULT_PROFILE_TOP, FrameProfiler
+from worker_tracing import DEFAULT_TRACE_BUFFER, FrameRecord, TraceBuffer, frame_timing
 
 MAX_FRAME_SIZE = 10 * 1024 * 1024
+MODEL_NAMES = ('yolo', 'corner', 'hand')
+# Модели, которые грузятся только через ensure_model (движок squares в register)
+OPTIONAL_MODEL_NAMES = ('squares',)
+# Модели, которые грузятся только при первом использовании (через запятую)
+DEFAULT_LAZY_MODELS = [name for name in os.environ.get('CV_LAZY_MODELS', '').split(',') if name]
+# Сколько калибровок может ждать/выполняться одновременно; остальные отклоняются
+DEFAULT_CALIBRATION_QUEUE = 32
+
+_log = get_logger('worker')
 
 
 class InferenceWorker:
-    def __init__(self, mappings_dir: Path):
+    def __init__(
+        self,
+        mappings_dir: Path,
+        output: Optional[OutputWriter] = None,
+        trace_buffer: int = DEFAULT_TRACE_BUFFER,
+        calibration_queue: int = DEFAULT_CALIBRATION_QUEUE,
+        frame_dedup: str = DEFAULT_DEDUP_MODE,
+    ):
         self.mappings_dir = mappings_dir
+        # Диагностика (трейсы, профили) лежит рядом с chessboard_mappings
+        self.diagnostics_dir = mappings_dir.resolve().parent / 'cv_diagnostics'
+        self.output = output if output is not None else OutputWriter()
+        self.metrics = MetricsRegistry()
+        self.traces = TraceBuffer(trace_buffer)
+        # Повторные кадры сессии не гоняются через конвейер (см. frame_dedup)
+        self.dedup = FrameDeduplicator(frame_dedup)
+        # Активный профайлер команды profile; None — профилирование выключено
+        self.profiler: Optional[FrameProfiler] = None
+        # Запись протокола для replay (--record); None — запись выключена
+        self.capture: Optional[CaptureWriter] = None
+        # Чтение stdin (создаётся в run); кадры приходят memoryview на его буфер
+        self.reader: Optional[FrameReader] = None
+        self.output.on_serialize = self._observe_serialize
         self.models = SharedInferenceModels()
+        self.model_cache: Optional[ModelCache] = None
+        # Классификатор занятости клеток для новых сессий (--occupancy)
+        self.occupancy: Optional[OccupancyClassifier] = None
+        self.occupancy_mode = 'off'
+        # Движок распознавания новых сессий, если register его не указал (--engine)
+        self.engine = DEFAULT_ENGINE
+        # Детекция руки в новых сессиях; без неё модель руки не нужна (benchmark --no-hand)
+        self.hand_detection = True
+        self.square_model_path = square_classifier_model_path()
         self.sessions: Dict[str, StreamProcessor] = {}
         self.model_path = ''
-
-    def init_models(self, yolo_path: str, corner_path: str) -> None:
+        self._model_loaders: Dict[str, Callable[[], None]] = {}
+        self._model_loads: Dict[str, Future] = {}
+        self._model_lock = threading.Lock()
+        self._model_pool = ThreadPoolExecutor(max_workers=len(MODEL_NAMES), thread_name_prefix='model-load')
+        # Калибровки идут в отдельном потоке, чтобы не задерживать кадры живых сессий
+        self.calibrations = ThreadPoolExecutor(max_workers=1, thread_name_prefix='calibration')
+        self._calibration_slots = threading.BoundedSemaphore(max(1, calibration_queue))
+        # Калибровки в очереди и в работе по токенам: пока они есть, сессия
+        # не пишет в файл маппинга (его перепишет калибровка)
+        self._calibrating: Dict[str, int] = {}
+        self._calibrating_lock = threading.Lock()
+
+    def start_model_loads(
+        self,
+        yolo_path: str,
+        corner_path: str,
+        optimize: str = DEFAULT_OPTIMIZE_MODE,
+        lazy: Iterable[str] = (),
+    ) -> List[Future]:
+        """
+        Параллельная загрузка моделей (каждая с прогревом) на потоках
+        model-load; по готовности каждой — событие <model>_ready.
+        Модели из lazy грузятся при первом использовании (ensure_model).
+        """
         self.model_path = yolo_path
-        self.models.load(yolo_path, corner_path)
-        print(
-            f'[WORKER] Models loaded: YOLO + ResNet corners',
-            file=sys.stderr,
-            flush=True,
-        )
-
-    def register(self, token: str) -> None:
+        self._model_loaders = {
+            'yolo': lambda: self.models.load_yolo(yolo_path, optimize),
+            'corner': lambda: self.models.load_corner(corner_path, optimize=optimize, cache=self.model_cache),
+            'hand': warm_up_hand_detector,
+            'squares': lambda: self.models.load_squares(self.square_model_path),
+        }
+        with self._model_lock:
+            # повторный init: уже загруженные модели с теми же путями не перезагружаются
+            self._model_loads = {name: f for name, f in self._model_loads.items() if not f.done()}
+        return [self._model_future(name) for name in MODEL_NAMES if name not in lazy]
+
+    def init_models(
+        self,
+        yolo_path: str,
+        corner_path: str,
+        optimize: str = DEFAULT_OPTIMIZE_MODE,
+        lazy: Iterable[str] = (),
+    ) -> None:
+        """start_model_loads с ожиданием всех неленивых моделей."""
+        for future in self.start_model_loads(yolo_path, corner_path, optimize, lazy):
+            future.result()
+        _log.info('Models loaded: %s', ', '.join(name for name in MODEL_NAMES if name not in lazy))
+
+    def ensure_model(self, name: str) -> None:
+        """Ждёт готовности модели; ленивую модель здесь же и запускает."""
+        self._model_future(name).result()
+
+    def _model_future(self, name: str) -> Future:
+        with self._model_lock:
+            future = self._model_loads.get(name)
+            if future is None:
+                future = self._model_loads[name] = self._model_pool.submit(self._load_model, name)
+            return future
+
+    def _load_model(self, name: str) -> None:
+        started = time.perf_counter()
+        try:
+            self._model_loaders[name]()
+        except Exception as exc:
+            _log.exception('Failed to load %s model', name)
+            with self._model_lock:
+                # следующий ensure_model попробует снова
+                self._model_loads.pop(name, None)
+            self.emit({'event': 'error', 'message': f'Failed to load {name} model: {exc}'})
+            raise
+        seconds = time.perf_counter() - started
+        self.metrics.set_model_load_time(name, seconds)
+        _log.info('Model %s ready in %.2fs', name, seconds)
+        self.emit({'event': f'{name}_ready', 'seconds': round(seconds, 3)})
+
+    def emit_ready_when_loaded(self, loads: List[Future]) -> None:
+        """ready — когда готовы все неленивые модели; ошибка загрузки завершает воркер."""
+        try:
+            for future in loads:
+                future.result()
+        except Exception:
+            self.output.close()
+            os._exit(1)
+        self.emit({'event': 'ready'})
+
+    def register(self, token: str, engine: Optional[str] = None) -> None:
+        """engine — yolo или squares (model.square_classifier); None — движок воркера."""
+        self.ensure_model('yolo')
+        engine = self._session_engine(engine or self.engine)
         if token in self.sessions:
             del self.sessions[token]
+        self.dedup.forget(token)
         self.sessions[token] = StreamProcessor(
             model_path=self.model_path,
             game_token=token,
             mapping_dir=self.mappings_dir,
             detector=self.models.yolo,
+            occupancy=self.occupancy,
+            occupancy_mode=self.occupancy_mode,
+            engine=engine,
+            square_classifier=self.models.squares,
+            mapping_busy=lambda: self.calibration_pending(token),
+            hand_detection=self.hand_detection,
         )
-        print(f'[WORKER] Session registered: {token}', file=sys.stderr, flush=True)
+        _log.info('Session registered: %s (engine %s)', token, engine)
+
+    def _session_engine(self, engine: str) -> str:
+        """Без весов классификатора клеток или при ошибке их загрузки сессия остаётся на yolo."""
+        if engine not in ENGINES:
+            _log.warning('Unknown engine %s, session uses yolo', engine)
+            return 'yolo'
+        if engine == 'squares':
+            if not Path(self.square_model_path).is_file():
+                _log.warning('Square classifier not found at %s, session uses yolo', self.square_model_path)
+                return 'yolo'
+            try:
+                self.ensure_model('squares')
+            except Exception:
+                # _load_model уже записал ошибку в лог и отправил событие error
+                return 'yolo'
+        return engine
 
     def unregister(self, token: str) -> None:
         if token in self.sessions:
             del self.sessions[token]
-            print(f'[WORKER] Session unregistered: {token}', file=sys.stderr, flush=True)
-
-    def process_frame(self, token: str, frame_data: bytes, *, hand_probe_only: bool = False) -> dict:
+            _log.info('Session unregistered: %s', token)
+        self.dedup.forget(token)
+        forget_session(token)
+        self.metrics.drop_session(token)
+
+    def process_frame(
+        self,
+        token: str,
+        frame_data: bytes | memoryview,
+        *,
+        frame_format: str = DEFAULT_FRAME_FORMAT,
+        width: int = 0,
+        height: int = 0,
+        hand_probe_only: bool = False,
+        trace: Optional[FrameTrace] = None,
+    ) -> dict:
+        """
+        frame_format/width/height — см. frame_formats (jpeg или сырые bgr/i420/nv12).
+        Повтор прошлого кадра сессии (frame_dedup) не декодируется и не
+        проходит стадии: в результате duplicate=True.
+        """
         processor = self.sessions.get(token)
         if processor is None:
+            self.metrics.incr('frames_dropped')
             return {'status': 'error', 'message': f'Unknown session: {token}'}
 
-        nparr = np.frombuffer(frame_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if frame is None:
-            return {'status': 'error', 'message': 'Failed to decode image'}
-
-        return processor.process_frame(frame, hand_probe_only=hand_probe_only)
+        if processor.hand_detection:
+            try:
+                self.ensure_model('hand')
+            except Exception as exc:
+                # _load_model уже записал ошибку в лог; следующий кадр попробует снова
+                self.metrics.incr('frames_dropped', token)
+                return {'status': 'error', 'message': f'Hand model unavailable: {exc}'}
+        if trace is None:
+            trace = FrameTrace()
+        with trace.span('dedup'):
+            same_payload = self.dedup.same_payload(token, frame_data)
+        result = None
+        if same_payload:
+            result = processor.process_duplicate_frame(hand_probe_only=hand_probe_only, trace=trace)
+        if result is None:
+            try:
+                with trace.span('decode'):
+                    frame = decode_frame(frame_data, frame_format, width, height)
+            except FrameFormatError as exc:
+                self.metrics.incr('frames_dropped', token)
+                self.dedup.forget(token)
+                return {'status': 'error', 'message': str(exc)}
+            if frame is None:
+                self.metrics.incr('frames_dropped', token)
+                self.dedup.forget(token)
+                return {'status': 'error', 'message': 'Failed to decode image'}
+            if not same_payload:
+                with trace.span('dedup'):
+                    same_image = self.dedup.same_image(token, frame)
+                if same_image:
+                    result = processor.process_duplicate_frame(hand_probe_only=hand_probe_only, trace=trace)
+        if result is not None:
+            result['duplicate'] = True
+            self.metrics.incr('frames_duplicate', token)
+        else:
+            result = processor.process_frame(frame, hand_probe_only=hand_probe_only, trace=trace)
+        trace.add('total', trace.started, time.perf_counter() - trace.started)
+        self.metrics.observe_trace(token, trace)
+        self._count_frame(token, result, hand_probe_only)
+        return result
 
-    def calibrate_auto(self, token: str, image_path: str) -> dict:
+    def _count_frame(self, token: str, result: dict, hand_probe_only: bool) -> None:
+        self.metrics.incr('frames_processed', token)
+        if result.get('status') == 'error':
+            self.metrics.incr('frames_error', token)
+        elif hand_probe_only or result.get('history_frozen') or 'board_snapshot' not in result:
+            # кадр не дошёл до YOLO: пробник руки, рука на доске или нет маппинга
+            self.metrics.incr('frames_skipped', token)
+        elif result.get('board_snapshot'):
+            self.metrics.incr('board_snapshots', token)
+        if 'board_drift' in result:
+            self.metrics.incr('drift_updates', token)
+        info = result.get('detections_info') or {}
+        if info.get('occupancy_gated'):
+            self.metrics.incr('occupancy_gated', token)
+        elif info.get('occupancy_mismatch'):
+            self.metrics.incr('occupancy_mismatch', token)
+        if info.get('occupancy_recheck'):
+            self.metrics.incr('occupancy_recheck', token)
+            if info.get('occupancy_recheck_failed'):
+                self.metrics.incr('occupancy_recheck_failed', token)
+
+    def _observe_serialize(self, payload, seconds: float) -> None:
+        if isinstance(payload, dict) and payload.get('event') == 'frame_result':
+            self.metrics.observe('serialize', seconds, payload.get('token'))
+
+    def calibrate_auto(self, token: str, image_path: str, seeded: bool = True) -> dict:
         image = cv2.imread(image_path)
         if image is None:
             return {'success': False, 'error': f'Cannot read image: {image_path}'}
+        self.ensure_model('corner')
+        self.ensure_model('yolo')
+        prior_corners = None
+        if seeded:
+            # Перекалибровка: кроп по углам прошлого маппинга вместо прохода YOLO
+            previous = load_mapping_data(token, self.mappings_dir)
+            if previous and previous.get('success') and previous.get('board_corners'):
+                prior_corners = np.array(previous['board_corners'], dtype=np.float32)
         result = map_chessboard(
             image,
             game_token=token,
             mappings_dir=self.mappings_dir,
             preloaded_yolo_detector=self.models.yolo,
             preloaded_corner_bundle=self.models.corner,
+            prior_corners=prior_corners,
         )
+        if result.get('calibration_path') == 'seeded':
+            self.metrics.incr('calibrations_seeded')
         return result
 
+    def submit_calibration(self, token: str, image_path: str, seeded: bool = True) -> None:
+        """Ставит calibrate_auto в очередь; calibrate_result придёт по готовности."""
+        if not self._calibration_slots.acquire(blocking=False):
+            self.metrics.incr('calibrations_rejected')
+            self.emit({
+                'event': 'calibrate_result',
+                'token': token,
+                'success': False,
+                'error': 'Calibration queue is full, retry later',
+            })
+            return
+        with self._calibrating_lock:
+            self._calibrating[token] = self._calibrating.get(token, 0) + 1
+        self.calibrations.submit(self._run_calibration, token, image_path, seeded, time.perf_counter())
+
+    def calibration_pending(self, token: str) -> bool:
+        with self._calibrating_lock:
+            return token in self._calibrating
+
+    def _run_calibration(self, token: str, image_path: str, seeded: bool, queued: float) -> None:
+        started = time.perf_counter()
+        self.metrics.observe('calibrate_wait', started - queued)
+        try:
+            result = self.calibrate_auto(token, image_path, seeded)
+        except Exception as exc:
+            _log.exception('Calibration failed for %s', token)
+            result = {'success': False, 'error': str(exc)}
+        finally:
+            self._calibration_slots.release()
+            with self._calibrating_lock:
+                left = self._calibrating.pop(token, 1) - 1
+                if left:
+                    self._calibrating[token] = left
+        self.metrics.observe('calibrate', time.perf_counter() - started)
+        self.emit({'event': 'calibrate_result', 'token': token, **result})
+
     def emit(self, payload: dict) -> None:
-        print(json.dumps(payload, ensure_ascii=False), flush=True)
+        self.output.emit(payload)
 
     def handle_command(self, msg: dict) -> None:
         cmd = msg.get('cmd')
 
         if cmd == 'init':
-            self.init_models(msg['yolo_model'], msg['corner_model'])
+            self.init_models(msg['yolo_model'], msg['corner_model'], msg.get('optimize', DEFAULT_OPTIMIZE_MODE))
             self.emit({'event': 'ready'})
             return
 
         if cmd == 'register':
-            self.register(msg['token'])
-            self.emit({'event': 'registered', 'token': msg['token']})
+            try:
+                self.ensure_model('yolo')
+            except Exception as exc:
+                # _load_model уже записал ошибку в лог; следующий register попробует снова
+                self.emit({'event': 'error', 'token': msg['token'], 'message': f'Cannot register session: {exc}'})
+                return
+            self.register(msg['token'], msg.get('engine'))
+            if self.capture is not None:
+                # маппинг перед register: replay успевает положить его на диск
+                self.capture.mapping(msg['token'], self.mappings_dir)
+                self.capture.command(msg)
+            self.emit({'event': 'registered', 'token': msg['token'], 'engine': self.sessions[msg['token']].engine})
             return
 
         if cmd == 'unregister':
             self.unregister(msg['token'])
+            if self.capture is not None:
+                self.capture.command(msg)
             self.emit({'event': 'unregistered', 'token': msg['token']})
             return
 
         if cmd == 'calibrate_auto':
-            result = self.calibrate_auto(msg['token'], msg['image_path'])
-            self.emit({'event': 'calibrate_result', 'token': msg['token'], **result})
+            self.submit_calibration(msg['token'], msg['image_path'], bool(msg.get('seeded', True)))
+            return
+
+        if cmd == 'stats':
+            if msg.get('reset'):
+                self.metrics.reset()
+            stats = self.metrics.snapshot(msg.get('token'))
+            self.emit({
+                'event': 'stats',
+                'active_sessions': len(self.sessions),
+                'model_optimization': self.models.optimization,
+                **stats,
+            })
+            return
+
+        if cmd == 'trace_dump':
+            self.dump_traces(msg.get('n'), inline=bool(msg.get('inline')))
+            return
+
+        if cmd == 'profile':
+            self.start_profile(msg)
+            return
+
+        if cmd == 'log_config':
+            try:
+                config = set_log_config(
+                    level=msg.get('level'),
+                    loggers=msg.get('loggers'),
+                    sample_interval=msg.get('sample_interval'),
+                )
+            except (TypeError, ValueError) as exc:
+                self.emit({'event': 'error', 'message': f'Invalid log_config: {exc}'})
+                return
+            self.emit({'event': 'log_config', **config})
             return
 
         if cmd == 'shutdown':
+            if self.profiler is not None:
+                self.profiler.cancel()
+            if self.capture is not None:
+                self.capture.close()
+            self.calibrations.shutdown(wait=False, cancel_futures=True)
+            self._model_pool.shutdown(wait=False, cancel_futures=True)
             close_hand_detector()
             self.emit({'event': 'shutdown'})
+            self.output.close()
             sys.exit(0)
 
         self.emit({'event': 'error', 'message': f'Unknown command: {cmd}'})
 
-    def process_frame_command(self, msg: dict, buffer: bytes) -> bytes:
-        """Читает length байт JPEG из buffer/stdin (не через текстовую строку)."""
+    def dump_traces(self, n: Optional[int] = None, *, inline: bool = False) -> None:
+        """Спаны последних n кадров в формате Chrome trace (файл или прямо в ответе)."""
+        try:
+            n = int(n) if n else None
+        except (TypeError, ValueError) as exc:
+            self.emit({'event': 'error', 'message': f'Invalid trace_dump: {exc}'})
+            return
+        if inline:
+            self.emit({'event': 'trace_dump', **self.traces.chrome_trace(n)})
+            return
+        path = self.diagnostics_dir / f'trace_{time.strftime("%Y%m%d_%H%M%S")}.json'
+        try:
+            frames = self.traces.dump(path, n)
+        except OSError as exc:
+            self.emit({'event': 'error', 'message': f'Failed to write trace: {exc}'})
+            return
+        self.emit({'event': 'trace_dump', 'path': str(path), 'frames': frames})
+
+    def start_profile(self, msg: dict) -> None:
+        """
+        Профилирует следующие frames кадров (mode: cprofile | sampling) и
+        снимает дельту памяти tracemalloc. Ответ profile со status=started
+        приходит сразу, со status=done — после N-го кадра.
+        """
+        if self.profiler is not None:
+            self.emit({'event': 'error', 'message': 'Profiling is already running'})
+            return
+        try:
+            self.profiler = FrameProfiler(
+                self.diagnostics_dir,
+                int(msg.get('frames', DEFAULT_PROFILE_FRAMES)),
+                mode=msg.get('mode', 'cprofile'),
+                top=int(msg.get('top', DEFAULT_PROFILE_TOP)),
+                memory=bool(msg.get('memory', True)),
+            )
+        except (TypeError, ValueError) as exc:
+            self.emit({'event': 'error', 'message': f'Invalid profile: {exc}'})
+            return
+        _log.info('Profiling next %d frames (%s)', self.profiler.frames, self.profiler.mode)
+        self.emit({
+            'event': 'profile',
+            'status': 'started',
+            'frames': self.profiler.frames,
+            'mode': self.profiler.mode,
+        })
+
+    def _finish_profile(self) -> None:
+        profiler, self.profiler = self.profiler, None
+        try:
+            result = profiler.finish()
+        except OSError as exc:
+            profiler.cancel()
+            self.emit({'event': 'error', 'message': f'Failed to write profile: {exc}'})
+            return
+        _log.info('Profile written: %s', ', '.join(result['files'].values()))
+        self.emit({'event': 'profile', 'status': 'done', **result})
+
+    def process_frame_command(self, msg: dict) -> None:
+        """
+        Читает length байт кадра из self.reader (не через текстовую строку):
+        JPEG или, при format bgr/i420/nv12, сырые пиксели width×height.
+        Необязательные seq и ts (время захвата кадра, epoch мс) возвращаются
+        в frame_result вместе с таймингами стадий.
+        """
+        trace = FrameTrace()
         token = msg['token']
         length = int(msg['length'])
+        echo = {}
+        if 'seq' in msg:
+            echo['seq'] = msg['seq']
+        capture_ts = msg.get('ts')
+        if capture_ts is not None:
+            echo['capture_ts'] = capture_ts
         if length <= 0 or length > MAX_FRAME_SIZE:
+            # тело кадра уже в потоке — пропускаем его, чтобы не потерять синхронизацию
+            self.reader.skip(max(length, 0))
+            self.metrics.incr('frames_dropped', token)
             self.emit({
                 'event': 'frame_result',
                 'token': token,
                 'status': 'error',
                 'message': f'Invalid frame length: {length}',
+                **echo,
+            })
+            return
+
+        read_started = time.perf_counter()
+        # memoryview на буфер reader: действителен до следующего чтения из stdin
+        frame_data = self.reader.read_exact(length)
+        if frame_data is None:
+            self.metrics.incr('frames_dropped', token)
+            self.emit({
+                'event': 'frame_result',
+                'token': token,
+                'status': 'error',
+                'message': 'Incomplete frame data',
+                **echo,
             })
-            return buffer
-
-        while len(buffer) < length:
-            chunk = sys.stdin.buffer.read1(65536)
-            if not chunk:
-                self.emit({
-                    'event': 'frame_result',
-                    'token': token,
-                    'status': 'error',
-                    'message': 'Incomplete frame data',
-                })
-                return buffer
-            buffer += chunk
-
-        frame_data = buffer[:length]
-        buffer = buffer[length:]
-        hand_probe_only = bool(msg.get('hand_probe'))
-        result = self.process_frame(token, frame_data, hand_probe_only=hand_probe_only)
-        self.emit({'event': 'frame_result', 'token': token, **result})
-        return buffer
+            return
+        trace.add('read', read_started, time.perf_counter() - read_started)
+        if self.capture is not None:
+            self.capture.command(msg, frame_data)
+        try:
+            options = {
+                'frame_format': msg.get('format', DEFAULT_FRAME_FORMAT),
+                'width': int(msg.get('width', 0)),
+                'height': int(msg.get('height', 0)),
+                'hand_probe_only': bool(msg.get('hand_probe')),
+            }
+        except (TypeError, ValueError) as exc:
+            # тело кадра уже прочитано — поток остаётся синхронным
+            self.metrics.incr('frames_dropped', token)
+            self.emit({
+                'event': 'frame_result',
+                'token': token,
+                'status': 'error',
+                'message': f'Invalid frame size: {exc}',
+                **echo,
+            })
+            return
+        profiler = self.profiler
+        if profiler is None:
+            result = self.process_frame(token, frame_data, trace=trace, **options)
+        else:
+            profiler.enable()
+            try:
+                result = self.process_frame(token, frame_data, trace=trace, **options)
+            finally:
+                profile_done = profiler.disable()
+
+        record = FrameRecord(
+            token=token,
+            seq=msg.get('seq'),
+            capture_ts=float(capture_ts) if isinstance(capture_ts, (int, float)) else None,
+            trace=trace,
+        )
+        self.traces.add(record)
+        payload = {
+            'event': 'frame_result',
+            'token': token,
+            **result,
+            **echo,
+            'timing': frame_timing(record),
+        }
+        if self.capture is not None:
+            self.capture.result(payload)
+        self.emit(payload)
+        if profiler is not None and profile_done:
+            self._finish_profile()
 
     def run(self) -> None:
-        buffer = b''
+        self.reader = FrameReader(sys.stdin.buffer)
         while True:
-            chunk = sys.stdin.buffer.read1(65536)
-            if not chunk:
+            line = self.reader.readline()
+            if line is None:
                 break
-            buffer += chunk
-            while b'\n' in buffer:
-                line, buffer = buffer.split(b'\n', 1)
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    msg = json.loads(line.decode('utf-8'))
-                except json.JSONDecodeError as exc:
-                    self.emit({'event': 'error', 'message': f'Invalid JSON: {exc}'})
-                    continue
-                if msg.get('cmd') == 'frame':
-                    buffer = self.process_frame_command(msg, buffer)
-                else:
-                    self.handle_command(msg)
+            line = line.tobytes().strip()
+            if not line:
+                continue
+            try:
+                msg = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError) as exc:
+                self.emit({'event': 'error', 'message': f'Invalid JSON: {exc}'})
+                continue
+            if msg.get('cmd') == 'frame':
+                self.process_frame_command(msg)
+            else:
+                self.handle_command(msg)
 
 
 def main() -> None:
@@ -179,20 +633,118 @@ def main() -> None:
     parser.add_argument('--mappings-dir', default='./chessboard_mappings')
     parser.add_argument('--yolo-model', default=None)
     parser.add_argument('--corner-model', default=None)
+    parser.add_argument('--serializer', choices=SERIALIZERS, default='auto')
+    parser.add_argument('--output-queue', type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument('--log-level', default=DEFAULT_LOG_LEVEL)
+    parser.add_argument(
+        '--debug-artifacts',
+        choices=ARTIFACT_LEVELS,
+        default=DEFAULT_ARTIFACT_LEVEL,
+        help='Отладочные JPEG калибровки: off, on_failure или always',
+    )
+    parser.add_argument('--debug-artifacts-keep', type=int, default=DEFAULT_KEEP_PER_TOKEN, help='Наборов артефактов на токен')
+    parser.add_argument(
+        '--optimize-models',
+        choices=OPTIMIZE_MODES,
+        default=DEFAULT_OPTIMIZE_MODE,
+        help='Оптимизация моделей при загрузке: off, fuse, trace или compile (с проверкой на пробном входе)',
+    )
+    parser.add_argument(
+        '--lazy-models',
+        nargs='*',
+        choices=MODEL_NAMES,
+        default=DEFAULT_LAZY_MODELS,
+        help='Модели, которые грузятся при первом использовании, а не на старте',
+    )
+    parser.add_argument(
+        '--model-cache',
+        default=DEFAULT_MODEL_CACHE_DIR,
+        help='Каталог кеша готовых весов (ключ — хеш весов и версий библиотек); пустая строка — без кеша',
+    )
+    parser.add_argument(
+        '--frame-dedup',
+        choices=DEDUP_MODES,
+        default=DEFAULT_DEDUP_MODE,
+        help='Повторные кадры сессии: off, exact (хеш тела кадра) или thumbnail (ещё и миниатюра)',
+    )
+    parser.add_argument(
+        '--occupancy',
+        choices=OCCUPANCY_MODES,
+        default=DEFAULT_OCCUPANCY_MODE,
+        help='Классификатор занятости клеток: off, check (сверка с YOLO) или gate (пропуск YOLO без изменений)',
+    )
+    parser.add_argument('--occupancy-model', default=None, help='Веса классификатора занятости (train_occupancy.py)')
+    parser.add_argument(
+        '--engine',
+        choices=ENGINES,
+        default=DEFAULT_ENGINE,
+        help='Движок сессий без engine в register: yolo (детекция) или squares (классификация 64 клеток)',
+    )
+    parser.add_argument('--square-model', default=None, help='Веса классификатора клеток (train_square_classifier.py)')
+    parser.add_argument('--calibration-queue', type=int, default=DEFAULT_CALIBRATION_QUEUE, help='Максимум калибровок в очереди')
+    parser.add_argument('--trace-buffer', type=int, default=DEFAULT_TRACE_BUFFER, help='Сколько последних кадров хранить для trace_dump')
+    parser.add_argument(
+        '--record',
+        default=os.environ.get('CV_RECORD_PATH') or None,
+        help='Записывать register/frame/unregister и frame_result в файл захвата (см. replay_capture.py)',
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=int(os.environ.get('CV_METRICS_PORT', '0')),
+        help='Порт Prometheus-эндпоинта /metrics на 127.0.0.1 (0 — выключен)',
+    )
     args = parser.parse_args()
+    configure_logging(args.log_level)
+    configure_artifacts(args.debug_artifacts, args.debug_artifacts_keep)
 
     yolo_path = args.yolo_model or yolo_model_path()
     corner_path = args.corner_model or corner_model_path()
     mappings_dir = Path(args.mappings_dir)
     mappings_dir.mkdir(parents=True, exist_ok=True)
 
-    from model.hand_detector import _get_landmarker
-
-    worker = InferenceWorker(mappings_dir)
-    worker.init_models(yolo_path, corner_path)
-    _get_landmarker()
-    worker.emit({'event': 'ready'})
-    worker.run()
+    output = OutputWriter(serializer=args.serializer, max_queue=args.output_queue)
+    worker = InferenceWorker(
+        mappings_dir,
+        output=output,
+        trace_buffer=args.trace_buffer,
+        calibration_queue=args.calibration_queue,
+        frame_dedup=args.frame_dedup,
+    )
+    if args.record:
+        worker.capture = CaptureWriter(Path(args.record))
+        _log.info('Recording protocol to %s', args.record)
+    if args.occupancy != 'off':
+        occupancy_path = args.occupancy_model or occupancy_model_path()
+        try:
+            worker.occupancy = load_occupancy_classifier(occupancy_path)
+        except (OSError, ValueError) as exc:
+            _log.warning('Occupancy model %s is unusable: %s', occupancy_path, exc)
+        if worker.occupancy is None:
+            _log.warning('Occupancy %s disabled: no model at %s', args.occupancy, occupancy_path)
+        else:
+            worker.occupancy_mode = args.occupancy
+    worker.engine = args.engine
+    if args.square_model:
+        worker.square_model_path = args.square_model
+    if args.model_cache:
+        try:
+            worker.model_cache = ModelCache(Path(args.model_cache))
+        except OSError as exc:
+            _log.warning('Model cache disabled (%s): %s', args.model_cache, exc)
+    if args.metrics_port:
+        start_metrics_server(worker.metrics, args.metrics_port)
+        _log.info('Metrics endpoint: http://127.0.0.1:%d/metrics', args.metrics_port)
+    try:
+        # Модели грузятся параллельно, команды читаются сразу: register/frame/calibrate_auto
+        # ждут только нужные им модели, ready — когда готовы все неленивые
+        loads = worker.start_model_loads(yolo_path, corner_path, args.optimize_models, lazy=args.lazy_models)
+        threading.Thread(target=worker.emit_ready_when_loaded, args=(loads,), name='ready', daemon=True).start()
+        worker.run()
+    finally:
+        if worker.capture is not None:
+            worker.capture.close()
+        output.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,321 @@
+"""
+Нагрузочный генератор: K синтетических сессий против inference_worker.py
+по его настоящему протоколу, с наращиванием K до насыщения воркера.
+
+Каждая сессия шлёт кадры с частотой --fps и, как Node, держит в полёте
+не больше одного кадра: если к очередному тику ответ на предыдущий ещё
+не пришёл, кадр считается пропущенным (drop). Источник кадров — снимки
+из датасетов (одна фотография на сессию, синтетический маппинг) или
+файл захвата (inference_worker.py --record).
+
+На каждом уровне K: пропускная способность, перцентили задержки
+отправка→frame_result, доля пропусков и стадии воркера по команде stats.
+Результат — кривая ёмкости (JSON) для расчёта числа воркеров на турнир.
+
+Пример:
+    python src/load_generator.py --levels 1 2 4 8 16 --fps 10 --duration 30 --output capacity.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import queue
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_pipeline import DEFAULT_DATASETS, _find_images, synthetic_mapping
+from frame_dedup import DEDUP_MODES
+from frame_formats import DEFAULT_FRAME_FORMAT, FRAME_FORMATS, encode_frame
+from model_paths import CHESS_RECOGNITION_ROOT
+from worker_capture import KIND_COMMAND, KIND_MAPPING, CaptureReader
+from worker_client import RESULT_TIMEOUT_S, WorkerProcess
+from worker_metrics import LatencyHistogram
+
+# Уровень считается насыщенным, если пропускная способность ниже цели на 5%
+SATURATION_THROUGHPUT = 0.95
+
+# Кадр: тело и поля команды frame (format/width/height для сырых кадров)
+Frame = Tuple[bytes, Dict]
+# Источник кадров сессии: кадры по кругу и маппинг доски
+SessionSource = Tuple[List[Frame], bytes]
+
+
+def dataset_sources(datasets: List[str], limit: int, frame_format: str = DEFAULT_FRAME_FORMAT) -> List[SessionSource]:
+    sources: List[SessionSource] = []
+    for name in datasets:
+        dataset = CHESS_RECOGNITION_ROOT / name
+        if not dataset.is_dir():
+            continue
+        for image_path in _find_images(dataset, limit):
+            image = cv2.imread(str(image_path))
+            if image is None:
+                continue
+            mapping = synthetic_mapping(image, image_path, 'load')
+            if frame_format == DEFAULT_FRAME_FORMAT:
+                frame = (image_path.read_bytes(), {})
+            else:
+                frame = encode_frame(image, frame_format)
+            sources.append(([frame], json.dumps(mapping).encode('utf-8')))
+    return sources
+
+
+def capture_sources(path: Path) -> List[SessionSource]:
+    """Кадры каждой записанной сессии с её маппингом."""
+    reader = CaptureReader(path)
+    frames: Dict[str, List[Frame]] = {}
+    mappings: Dict[str, bytes] = {}
+    try:
+        for record in reader:
+            token = record.msg.get('token')
+            if record.kind == KIND_MAPPING:
+                mappings.setdefault(token, record.payload)
+            elif record.kind == KIND_COMMAND and record.msg.get('cmd') == 'frame':
+                fields = {key: record.msg[key] for key in ('format', 'width', 'height') if key in record.msg}
+                frames.setdefault(token, []).append((record.payload, fields))
+    finally:
+        reader.close()
+    return [(payloads, mappings[token]) for token, payloads in frames.items() if token in mappings]
+
+
+class _Session:
+    __slots__ = ('token', 'frames', 'cursor', 'next_due', 'sent_at')
+
+    def __init__(self, token: str, frames: List[Frame], next_due: float):
+        self.token = token
+        self.frames = frames
+        self.cursor = 0
+        self.next_due = next_due
+        self.sent_at: Optional[float] = None
+
+
+def run_level(
+    worker: WorkerProcess,
+    k: int,
+    sources: List[SessionSource],
+    mappings_dir: Path,
+    args: argparse.Namespace,
+) -> Dict:
+    interval = 1.0 / args.fps
+    sessions: Dict[str, _Session] = {}
+    for i in range(k):
+        token = f'load_{k}_{i}'
+        frames, mapping = sources[i % len(sources)]
+        (mappings_dir / f'{token}_mapping.json').write_bytes(mapping)
+        worker.send({'cmd': 'register', 'token': token})
+        worker.wait_event('registered', RESULT_TIMEOUT_S)
+        sessions[token] = _Session(token, frames, 0.0)
+
+    worker.send({'cmd': 'stats', 'reset': True})
+    worker.wait_event('stats', RESULT_TIMEOUT_S)
+
+    latency = LatencyHistogram()
+    sent = dropped = completed = errors = 0
+    seq = 0
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    deadline = measure_from + args.duration
+    # Сессии разнесены по фазе, чтобы кадры не приходили пачкой
+    for i, session in enumerate(sessions.values()):
+        session.next_due = started + interval * i / k
+
+    def handle(event: Dict) -> None:
+        nonlocal completed, errors
+        if event.get('event') != 'frame_result':
+            return
+        session = sessions.get(event.get('token'))
+        if session is None or session.sent_at is None:
+            return
+        sent_at, session.sent_at = session.sent_at, None
+        if sent_at >= measure_from:
+            latency.record(time.perf_counter() - sent_at)
+            completed += 1
+            if event.get('status') == 'error':
+                errors += 1
+
+    now = started
+    while now < deadline:
+        for session in sessions.values():
+            if session.next_due > now:
+                continue
+            session.next_due += interval
+            if session.next_due < now:
+                # генератор сам отстал — не догоняем пачкой
+                session.next_due = now + interval
+            measuring = now >= measure_from
+            if session.sent_at is not None:
+                if now - session.sent_at > RESULT_TIMEOUT_S:
+                    session.sent_at = None  # ответ потерян
+                elif measuring:
+                    dropped += 1
+                continue
+            payload, fields = session.frames[session.cursor % len(session.frames)]
+            session.cursor += 1
+            seq += 1
+            worker.send(
+                {
+                    'cmd': 'frame',
+                    'token': session.token,
+                    'length': len(payload),
+                    'seq': seq,
+                    'ts': time.time() * 1e3,
+                    **fields,
+                },
+                payload,
+            )
+            session.sent_at = time.perf_counter()
+            if measuring:
+                sent += 1
+
+        wait = min(session.next_due for session in sessions.values()) - time.perf_counter()
+        try:
+            event = worker.events.get(timeout=max(0.0, wait))
+            while event is not None:
+                handle(event)
+                event = worker.events.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            # None в очереди — воркер завершился, слать ему кадры дальше бессмысленно
+            raise RuntimeError(f'Worker exited during level K={k}')
+        now = time.perf_counter()
+
+    # Дожидаемся ответов на кадры, оставшиеся в полёте
+    drain_until = time.perf_counter() + RESULT_TIMEOUT_S
+    while any(s.sent_at is not None for s in sessions.values()) and time.perf_counter() < drain_until:
+        try:
+            event = worker.events.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if event is None:
+            raise RuntimeError(f'Worker exited during level K={k}')
+        handle(event)
+
+    worker.send({'cmd': 'stats'})
+    stats = worker.wait_event('stats', RESULT_TIMEOUT_S)
+    for token in sessions:
+        worker.send({'cmd': 'unregister', 'token': token})
+        worker.wait_event('unregistered', RESULT_TIMEOUT_S)
+
+    target = k * args.fps
+    throughput = completed / args.duration
+    return {
+        'sessions': k,
+        'target_fps': target,
+        'throughput_fps': round(throughput, 2),
+        'sent': sent,
+        'completed': completed,
+        'dropped': dropped,
+        'errors': errors,
+        'drop_rate': round(dropped / (sent + dropped), 4) if sent + dropped else 0.0,
+        'latency': latency.summary(),
+        'worker_stages': {
+            name: stats.get('stages', {}).get(name, {}).get('p95_ms')
+            for name in ('read', 'decode', 'hand', 'yolo', 'serialize', 'total')
+        },
+        'rss_bytes': stats.get('rss_bytes'),
+        'saturated': throughput < target * SATURATION_THROUGHPUT or (
+            dropped / (sent + dropped) > args.max_drop_rate if sent + dropped else False
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест inference-воркера (кривая ёмкости)')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help='Числа одновременных сессий по порядку')
+    parser.add_argument('--fps', type=float, default=10.0, help='Кадров в секунду на сессию')
+    parser.add_argument('--duration', type=float, default=20.0, help='Секунд замера на уровень')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Секунд прогрева на уровень (не учитываются)')
+    parser.add_argument('--capture', default=None, help='Кадры из файла захвата вместо датасетов')
+    parser.add_argument('--datasets', nargs='+', default=list(DEFAULT_DATASETS))
+    parser.add_argument('--images', type=int, default=16, help='Снимков из каждого датасета')
+    parser.add_argument(
+        '--frame-format',
+        choices=FRAME_FORMATS,
+        default=DEFAULT_FRAME_FORMAT,
+        help='Формат кадров из датасетов: jpeg или сырые bgr/i420/nv12',
+    )
+    parser.add_argument('--max-drop-rate', type=float, default=0.05,
+                        help='Доля пропусков, после которой уровень считается насыщенным')
+    parser.add_argument('--stop-on-saturation', action='store_true', help='Не наращивать K после насыщения')
+    parser.add_argument(
+        '--frame-dedup',
+        choices=DEDUP_MODES,
+        default='off',
+        help='Режим повторов воркера; по умолчанию off — кадры сессии идут по кругу и иначе срезались бы',
+    )
+    parser.add_argument('--yolo-model', default=None)
+    parser.add_argument('--corner-model', default=None)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', default=None, help='JSON с кривой ёмкости')
+    args = parser.parse_args()
+
+    sources = capture_sources(Path(args.capture)) if args.capture else dataset_sources(args.datasets, args.images, args.frame_format)
+    if not sources:
+        print('ERROR: no frame sources', file=sys.stderr)
+        sys.exit(1)
+
+    mappings_dir = Path(tempfile.mkdtemp(prefix='cv_load_'))
+    worker_args = [
+        '--mappings-dir', str(mappings_dir),
+        '--log-level', args.log_level,
+        '--frame-dedup', args.frame_dedup,
+    ]
+    if args.yolo_model:
+        worker_args += ['--yolo-model', args.yolo_model]
+    if args.corner_model:
+        worker_args += ['--corner-model', args.corner_model]
+    worker = WorkerProcess(worker_args)
+
+    levels = []
+    failure: Optional[str] = None
+    try:
+        worker.wait_event('ready', 120.0)
+        print(f"{'K':>4}{'target':>9}{'fps':>9}{'drop':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+        for k in args.levels:
+            try:
+                level = run_level(worker, k, sources, mappings_dir, args)
+            except (RuntimeError, BrokenPipeError) as exc:
+                # воркер завершился: уровень не даёт точки кривой, отчёт — по завершённым
+                failure = str(exc)
+                print(f'ERROR: {failure}', file=sys.stderr)
+                break
+            levels.append(level)
+            lat = level['latency']
+            print(f"{k:>4}{level['target_fps']:>9.1f}{level['throughput_fps']:>9.1f}"
+                  f"{level['drop_rate']:>8.1%}{lat.get('p50_ms', 0):>9.1f}{lat.get('p95_ms', 0):>9.1f}"
+                  f"{lat.get('p99_ms', 0):>9.1f}{'  SATURATED' if level['saturated'] else ''}")
+            if level['saturated'] and args.stop_on_saturation:
+                break
+    finally:
+        worker.close()
+
+    capacity = max((level['sessions'] for level in levels if not level['saturated']), default=0)
+    print(f'Capacity: {capacity} sessions at {args.fps:g} FPS')
+    if args.output:
+        report = {
+            'fps_per_session': args.fps,
+            'duration_s': args.duration,
+            'source': args.capture or 'datasets',
+            'frame_format': args.frame_format,
+            'capacity_sessions': capacity,
+            'levels': levels,
+            'failure': failure,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f'Saved: {args.output}')
+    if failure:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
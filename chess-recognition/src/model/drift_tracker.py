@@ -0,0 +1,123 @@
+"""
+Слежение за сдвигом доски после калибровки.
+
+На первом кадре без руки запоминается уменьшенный серый кадр и точки
+(углы клеток, края фигур) внутри доски; если точек мало или сменилось
+разрешение, новый эталон пробуется тоже раз в check_interval кадров,
+а не на каждом. Раз в check_interval кадров
+точки ищутся на текущем кадре пирамидальным Lucas–Kanade, по ним
+RANSAC строит гомографию «эталон -> сейчас», и через неё переносятся
+углы доски. Если углы сместились больше порога, сессия получает новые
+углы без полной перекалибровки YOLO+ResNet. Сравнение всегда идёт с
+эталонным кадром, поэтому ошибка не накапливается.
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+DRIFT_TRACKING = os.environ.get('CV_DRIFT_TRACKING', '1') != '0'
+# Длинная сторона кадра, на котором ищутся точки
+DRIFT_FRAME_SIZE = 480
+DRIFT_CHECK_INTERVAL = 15
+# Сдвиг углов (доля средней стороны доски): ниже — шум, выше max — потеря слежения
+DRIFT_MIN_SHIFT = 0.01
+DRIFT_MAX_SHIFT = 0.25
+DRIFT_MIN_INLIERS = 12
+_MAX_FEATURES = 200
+
+
+@dataclass
+class DriftUpdate:
+    corners: np.ndarray
+    shift_px: float
+    inliers: int
+
+
+class BoardDriftTracker:
+    """Оптический поток по точкам доски относительно эталонного кадра."""
+
+    def __init__(
+        self,
+        corners: np.ndarray,
+        *,
+        check_interval: int = DRIFT_CHECK_INTERVAL,
+        min_shift: float = DRIFT_MIN_SHIFT,
+        max_shift: float = DRIFT_MAX_SHIFT,
+    ):
+        self.reference_corners = np.asarray(corners, dtype=np.float32).reshape(4, 2)
+        self.corners = self.reference_corners.copy()
+        self.check_interval = max(1, check_interval)
+        self.min_shift = min_shift
+        self.max_shift = max_shift
+        self.lost = False
+        self._frames = 0
+        self._scale = 1.0
+        self._reference: Optional[np.ndarray] = None
+        self._points: Optional[np.ndarray] = None
+
+    def _prepare(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        self._scale = min(1.0, DRIFT_FRAME_SIZE / max(height, width))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self._scale < 1.0:
+            gray = cv2.resize(gray, None, fx=self._scale, fy=self._scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def _init_reference(self, gray: np.ndarray) -> None:
+        mask = np.zeros_like(gray)
+        cv2.fillConvexPoly(mask, (self.reference_corners * self._scale).astype(np.int32), 255)
+        points = cv2.goodFeaturesToTrack(gray, _MAX_FEATURES, 0.01, 8, mask=mask)
+        if points is None or len(points) < DRIFT_MIN_INLIERS:
+            return
+        self._reference = gray
+        self._points = points
+
+    def update(self, frame: np.ndarray) -> Optional[DriftUpdate]:
+        """
+        Вызывается на кадрах без руки на доске. Возвращает DriftUpdate,
+        если углы доски нужно заменить, иначе None.
+        """
+        self._frames += 1
+        # первый кадр сразу даёт эталон; дальше и проверки, и повторные
+        # попытки эталона — раз в check_interval кадров
+        if self._frames != 1 and self._frames % self.check_interval:
+            return None
+
+        gray = self._prepare(frame)
+        if self._reference is None:
+            self._init_reference(gray)
+            return None
+        if gray.shape != self._reference.shape:
+            # сменилось разрешение камеры — эталон больше не подходит
+            self._reference = None
+            return None
+
+        moved, status, _err = cv2.calcOpticalFlowPyrLK(
+            self._reference, gray, self._points, None, winSize=(21, 21), maxLevel=3,
+        )
+        good = status.reshape(-1) == 1
+        if good.sum() < DRIFT_MIN_INLIERS:
+            return None
+        homography, inliers = cv2.findHomography(self._points[good], moved[good], cv2.RANSAC, 2.0)
+        if homography is None or int(inliers.sum()) < DRIFT_MIN_INLIERS:
+            return None
+
+        scaled = (self.reference_corners * self._scale).reshape(1, 4, 2)
+        corners = cv2.perspectiveTransform(scaled, homography)[0] / self._scale
+        side = float(np.linalg.norm(self.corners - np.roll(self.corners, -1, axis=0), axis=1).mean())
+        shift = float(np.linalg.norm(corners - self.corners, axis=1).max())
+        if shift < self.min_shift * side:
+            return None
+        if shift > self.max_shift * side:
+            # доску сдвинули слишком сильно (или поток ошибся) — нужна перекалибровка
+            self.lost = True
+            return None
+
+        self.lost = False
+        self.corners = corners.astype(np.float32)
+        return DriftUpdate(corners=self.corners.copy(), shift_px=round(shift, 1), inliers=int(inliers.sum()))
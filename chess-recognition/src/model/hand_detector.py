@@ -44,6 +44,13 @@ def _get_landmarker() -> vision.HandLandmarker:
         return _hand_landmarker
 
 
+def warm_up_hand_detector() -> None:
+    """Создание landmarker и один прогон на пустом кадре (инициализация графа MediaPipe)."""
+    landmarker = _get_landmarker()
+    blank = np.zeros((256, 256, 3), dtype=np.uint8)
+    landmarker.detect(mp.Image(image_format=mp.ImageFormat.SRGB, data=blank))
+
+
 def _point_in_quad(px: float, py: float, quad: np.ndarray) -> bool:
     def sign(p1, p2, p3):
         return (p1[0] - p3[0]) * (p2[1] - p3[1]) - (p2[0] - p3[0]) * (p1[1] - p3[1])
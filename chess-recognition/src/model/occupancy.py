@@ -0,0 +1,182 @@
+"""
+Дешёвая проверка занятости клеток перед YOLO.
+
+Логистическая регрессия по признакам клеток (square_features) с
+отдельными весами для светлых и тёмных полей: все 64 клетки — одно
+матричное умножение на уменьшенной копии доски, доли миллисекунды.
+Веса обучаются train_occupancy.py по разметке merged_new.
+
+Режимы (--occupancy / CV_OCCUPANCY):
+  off   — только YOLO;
+  check — YOLO на каждом кадре, расхождение с занятостью по YOLO
+          считается (occupancy_mismatch в detections_info);
+  gate  — если занятость совпала с последним снимком позиции, YOLO не
+          запускается и в историю голосования идёт этот снимок; если
+          нет — кадр проходит YOLO как перепроверка. Раз в окно
+          голосования совпавший кадр всё равно проходит YOLO
+          (occupancy_recheck); если позиция разошлась со снимком, gate
+          выключается до следующего снимка по детекциям.
+"""
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from model.square_features import HIST_BINS, SQUARE_COUNT, SquareFeatures, extract_square_features
+
+OCCUPANCY_MODES = ('off', 'check', 'gate')
+DEFAULT_OCCUPANCY_MODE = os.environ.get('CV_OCCUPANCY', 'off')
+# Сторона уменьшенной доски для признаков: 32 px на клетку
+OCCUPANCY_BOARD_SIZE = 256
+OCCUPANCY_INSET = 0.1
+FEATURE_COUNT = 4 + 3 * HIST_BINS
+_FORMAT_VERSION = 1
+
+
+def square_feature_matrix(features: SquareFeatures) -> np.ndarray:
+    """(64, FEATURE_COUNT): яркость, СКО, вариация, доля границ, гистограммы BGR."""
+    columns = [
+        features.mean.reshape(-1, 1) / 255.0,
+        features.std.reshape(-1, 1) / 255.0,
+        features.variation.reshape(-1, 1),
+        features.edge_density.reshape(-1, 1),
+        features.histograms.reshape(SQUARE_COUNT * SQUARE_COUNT, -1),
+    ]
+    return np.hstack(columns).astype(np.float32)
+
+
+def square_colors(features: SquareFeatures) -> np.ndarray:
+    """
+    (64,) 1 — светлое поле, 0 — тёмное. Ориентация доски неизвестна,
+    поэтому светлой считается та шахматная чётность, у которой медианная
+    яркость выше (фигуры на части клеток медиану почти не сдвигают).
+    """
+    rows, cols = np.indices((SQUARE_COUNT, SQUARE_COUNT))
+    parity = ((rows + cols) % 2).reshape(-1)
+    mean = features.mean.reshape(-1)
+    odd_lighter = np.median(mean[parity == 1]) > np.median(mean[parity == 0])
+    return parity if odd_lighter else 1 - parity
+
+
+def board_features(warped: np.ndarray) -> SquareFeatures:
+    small = cv2.resize(warped, (OCCUPANCY_BOARD_SIZE, OCCUPANCY_BOARD_SIZE), interpolation=cv2.INTER_AREA)
+    return extract_square_features(small, inset=OCCUPANCY_INSET, histograms=True)
+
+
+@dataclass
+class OccupancyClassifier:
+    # (2, FEATURE_COUNT) и (2,): строка 0 — тёмные поля, 1 — светлые
+    weights: np.ndarray
+    bias: np.ndarray
+    feature_mean: np.ndarray
+    feature_scale: np.ndarray
+    threshold: float = 0.5
+
+    def square_probabilities(self, x: np.ndarray, colors: np.ndarray) -> np.ndarray:
+        """(N,) по строкам square_feature_matrix и цветам полей square_colors."""
+        x = (x - self.feature_mean) / self.feature_scale
+        logits = np.einsum('ij,ij->i', x, self.weights[colors]) + self.bias[colors]
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def probabilities(self, warped: np.ndarray) -> np.ndarray:
+        """(8, 8) вероятность занятости в порядке сетки warped-изображения."""
+        features = board_features(warped)
+        probabilities = self.square_probabilities(square_feature_matrix(features), square_colors(features))
+        return probabilities.reshape(SQUARE_COUNT, SQUARE_COUNT)
+
+    def predict(self, warped: np.ndarray) -> np.ndarray:
+        """(8, 8) bool: клетка занята."""
+        return self.probabilities(warped) >= self.threshold
+
+    @classmethod
+    def fit(
+        cls,
+        x: np.ndarray,
+        y: np.ndarray,
+        colors: np.ndarray,
+        *,
+        l2: float = 1e-2,
+        iterations: int = 25,
+    ) -> 'OccupancyClassifier':
+        """
+        Обучение методом Ньютона (IRLS) отдельно для тёмных и светлых полей.
+        x (N, FEATURE_COUNT), y (N,) 0/1, colors (N,) 0/1 — из square_colors.
+        """
+        feature_mean = x.mean(axis=0)
+        feature_scale = x.std(axis=0) + 1e-6
+        xs = (x - feature_mean) / feature_scale
+        weights = np.zeros((2, x.shape[1]), dtype=np.float64)
+        bias = np.zeros(2, dtype=np.float64)
+        for color in (0, 1):
+            subset = colors == color
+            if not subset.any():
+                continue
+            design = np.hstack([xs[subset], np.ones((int(subset.sum()), 1))])
+            target = y[subset].astype(np.float64)
+            theta = np.zeros(design.shape[1])
+            penalty = l2 * np.eye(design.shape[1])
+            penalty[-1, -1] = 0.0  # смещение не штрафуется
+            for _ in range(iterations):
+                p = 1.0 / (1.0 + np.exp(-design @ theta))
+                gradient = design.T @ (p - target) + penalty @ theta
+                hessian = (design * (p * (1 - p))[:, None]).T @ design + penalty
+                step = np.linalg.solve(hessian, gradient)
+                theta -= step
+                if np.abs(step).max() < 1e-6:
+                    break
+            weights[color], bias[color] = theta[:-1], theta[-1]
+        return cls(
+            weights=weights.astype(np.float32),
+            bias=bias.astype(np.float32),
+            feature_mean=feature_mean.astype(np.float32),
+            feature_scale=feature_scale.astype(np.float32),
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': _FORMAT_VERSION,
+            'board_size': OCCUPANCY_BOARD_SIZE,
+            'inset': OCCUPANCY_INSET,
+            'hist_bins': HIST_BINS,
+            'weights': self.weights.tolist(),
+            'bias': self.bias.tolist(),
+            'feature_mean': self.feature_mean.tolist(),
+            'feature_scale': self.feature_scale.tolist(),
+            'threshold': self.threshold,
+        }
+
+    def save(self, path: Path, **meta) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({**self.to_dict(), **meta}, f, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: Path) -> 'OccupancyClassifier':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        expected = (_FORMAT_VERSION, OCCUPANCY_BOARD_SIZE, OCCUPANCY_INSET, HIST_BINS)
+        actual = (data.get('version'), data.get('board_size'), data.get('inset'), data.get('hist_bins'))
+        if actual != expected:
+            raise ValueError(f'Occupancy model {path} was trained with other features: {actual} != {expected}')
+        weights = np.asarray(data['weights'], dtype=np.float32)
+        if weights.shape != (2, FEATURE_COUNT):
+            raise ValueError(f'Occupancy model {path}: weights shape {weights.shape} != {(2, FEATURE_COUNT)}')
+        return cls(
+            weights=weights,
+            bias=np.asarray(data['bias'], dtype=np.float32),
+            feature_mean=np.asarray(data['feature_mean'], dtype=np.float32),
+            feature_scale=np.asarray(data['feature_scale'], dtype=np.float32),
+            threshold=float(data.get('threshold', 0.5)),
+        )
+
+
+def load_occupancy_classifier(path: Optional[str]) -> Optional[OccupancyClassifier]:
+    """None, если файла весов нет — режимы check/gate тогда не включаются."""
+    if not path or not Path(path).is_file():
+        return None
+    return OccupancyClassifier.load(Path(path))
@@ -0,0 +1,146 @@
+"""
+Распознавание позиции классификацией клеток вместо детекции фигур.
+
+После warp доска — квадрат с равномерной сеткой 8×8, поэтому рамки, NMS,
+ByteTrack и поиск клетки по точке (tracks_to_board_state) не нужны: доска
+уменьшается до CLASSIFIER_BOARD_SIZE, дополняется полем CROP_CONTEXT, и
+64 вырезки клеток с контекстом берутся одним strided view
+(sliding_window_view с шагом в клетку). Маленькая свёрточная сеть
+SquareNet классифицирует их одним батчем на SQUARE_CLASSES классов:
+0 — пусто, k — фигура с ID k - 1 (как в BoardStateMapper), так что
+результат сразу board_state.
+
+Движок распознавания сессии (engine в register, --engine / CV_ENGINE):
+  yolo    — YOLO11Detector + ByteTrack + tracks_to_board_state;
+  squares — SquareCropClassifier; веса обучает train_square_classifier.py,
+            сравнение с YOLO — benchmark_engines.py.
+"""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from numpy.lib.stride_tricks import sliding_window_view
+
+ENGINES = ('yolo', 'squares')
+DEFAULT_ENGINE = os.environ.get('CV_ENGINE', 'yolo')
+SQUARE_COUNT = 8
+# 12 фигур (ID BoardStateMapper) + пустая клетка
+SQUARE_CLASSES = 13
+# Сторона уменьшенной доски: 32 px на клетку
+CLASSIFIER_BOARD_SIZE = 256
+CELL_SIZE = CLASSIFIER_BOARD_SIZE // SQUARE_COUNT
+# Поле вокруг клетки (четверть клетки): верхушки высоких фигур в
+# перспективе выходят за свою клетку
+CROP_CONTEXT = 8
+CROP_SIZE = CELL_SIZE + 2 * CROP_CONTEXT
+_FORMAT_VERSION = 1
+
+
+def square_crops(warped: np.ndarray) -> np.ndarray:
+    """
+    (8, 8, CROP_SIZE, CROP_SIZE, 3) — вырезки клеток выровненной BGR-доски
+    в порядке сетки. Окна — view на дополненную доску, копируются только
+    при сборке батча.
+    """
+    board = cv2.resize(warped, (CLASSIFIER_BOARD_SIZE, CLASSIFIER_BOARD_SIZE), interpolation=cv2.INTER_AREA)
+    padded = cv2.copyMakeBorder(board, CROP_CONTEXT, CROP_CONTEXT, CROP_CONTEXT, CROP_CONTEXT, cv2.BORDER_REPLICATE)
+    windows = sliding_window_view(padded, (CROP_SIZE, CROP_SIZE, 3))
+    return windows[::CELL_SIZE, ::CELL_SIZE, 0]
+
+
+def crops_to_tensor(crops: np.ndarray, device: str) -> torch.Tensor:
+    """(..., CROP_SIZE, CROP_SIZE, 3) uint8 -> (N, 3, CROP_SIZE, CROP_SIZE) float в [0, 1]."""
+    batch = np.ascontiguousarray(crops.reshape(-1, CROP_SIZE, CROP_SIZE, 3))
+    tensor = torch.from_numpy(batch).to(device).permute(0, 3, 1, 2)
+    return tensor.float().div_(255.0)
+
+
+def _conv_block(channels_in: int, channels_out: int) -> nn.Sequential:
+    return nn.Sequential(
+        nn.Conv2d(channels_in, channels_out, 3, padding=1, bias=False),
+        nn.BatchNorm2d(channels_out),
+        nn.ReLU(inplace=True),
+        nn.MaxPool2d(2),
+    )
+
+
+class SquareNet(nn.Module):
+    """48×48 -> 3×3 за четыре блока conv-BN-ReLU-pool, затем линейный слой."""
+
+    def __init__(self, num_classes: int = SQUARE_CLASSES):
+        super().__init__()
+        self.features = nn.Sequential(
+            _conv_block(3, 16),
+            _conv_block(16, 32),
+            _conv_block(32, 64),
+            _conv_block(64, 96),
+        )
+        self.head = nn.Sequential(
+            nn.AdaptiveAvgPool2d(1),
+            nn.Flatten(),
+            nn.Dropout(0.2),
+            nn.Linear(96, num_classes),
+        )
+
+    def forward(self, x):
+        return self.head(self.features(x))
+
+
+class SquareCropClassifier:
+    """Движок squares: board_state по выровненной доске одним прогоном SquareNet."""
+
+    def __init__(self, model: SquareNet, device: str = 'cpu'):
+        self.model = model.to(device).eval()
+        self.device = device
+
+    def classify(self, warped: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (board_state, confidence): (8, 8) int32 ID фигур в порядке сетки
+        warped-изображения (-1 — пусто) и вероятность выбранного класса.
+        """
+        with torch.inference_mode():
+            logits = self.model(crops_to_tensor(square_crops(warped), self.device))
+            confidence, classes = torch.softmax(logits, dim=1).max(dim=1)
+        board_state = classes.cpu().numpy().astype(np.int32).reshape(SQUARE_COUNT, SQUARE_COUNT) - 1
+        return board_state, confidence.cpu().numpy().astype(np.float32).reshape(SQUARE_COUNT, SQUARE_COUNT)
+
+    def save(self, path: Path, **meta) -> None:
+        torch.save({
+            'version': _FORMAT_VERSION,
+            'board_size': CLASSIFIER_BOARD_SIZE,
+            'crop_context': CROP_CONTEXT,
+            'classes': SQUARE_CLASSES,
+            'state_dict': self.model.state_dict(),
+            'meta': meta,
+        }, path)
+
+    @classmethod
+    def load(cls, path: Path, device: Optional[str] = None) -> 'SquareCropClassifier':
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        checkpoint = torch.load(path, map_location=device)
+        expected = (_FORMAT_VERSION, CLASSIFIER_BOARD_SIZE, CROP_CONTEXT, SQUARE_CLASSES)
+        actual = (
+            checkpoint.get('version'),
+            checkpoint.get('board_size'),
+            checkpoint.get('crop_context'),
+            checkpoint.get('classes'),
+        )
+        if actual != expected:
+            raise ValueError(f'Square classifier {path} was trained with other crops: {actual} != {expected}')
+        model = SquareNet()
+        model.load_state_dict(checkpoint['state_dict'])
+        return cls(model, device)
+
+
+def load_square_classifier(path: Optional[str], device: Optional[str] = None) -> Optional[SquareCropClassifier]:
+    """None, если файла весов нет — сессии тогда остаются на движке yolo."""
+    if not path or not Path(path).is_file():
+        return None
+    return SquareCropClassifier.load(Path(path), device)
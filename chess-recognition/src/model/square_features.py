@@ -0,0 +1,100 @@
+"""
+Признаки всех клеток выровненной доски за один проход.
+
+После warp доска — квадрат с равномерной сеткой 8×8 (см.
+_generate_uniform_square_grid), поэтому клетки — это блоки изображения:
+reshape в (8, 8, h, w) даёт view без копирования, и среднее, СКО,
+доля границ Canny и гистограммы цвета считаются сразу для всех 64 клеток
+векторными операциями numpy вместо маски на каждую клетку.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+SQUARE_COUNT = 8
+# Доля клетки, отрезаемая с каждого края: линии сетки и края соседних фигур
+SQUARE_INSET = 0.1
+HIST_BINS = 8
+# Пороги Canny — как при калибровке
+EDGE_LOW_THRESHOLD = 50
+EDGE_HIGH_THRESHOLD = 150
+
+
+@dataclass
+class SquareFeatures:
+    """Массивы (8, 8, ...) в порядке сетки: [строка, столбец] warped-изображения."""
+
+    mean: np.ndarray
+    std: np.ndarray
+    edge_density: np.ndarray
+    # (8, 8, 3, HIST_BINS): доли пикселей клетки по корзинам каждого канала BGR
+    histograms: Optional[np.ndarray] = None
+
+    @property
+    def variation(self) -> np.ndarray:
+        """Коэффициент вариации яркости: у пустой клетки близок к нулю."""
+        return self.std / (self.mean + 1e-5)
+
+
+def square_blocks(image: np.ndarray, square_count: int = SQUARE_COUNT, inset: float = 0.0) -> np.ndarray:
+    """
+    Клетки как view (square_count, square_count, h, w[, C]) без копирования.
+    Остаток от деления размера на square_count справа и снизу отбрасывается.
+    """
+    height, width = image.shape[:2]
+    cell_h, cell_w = height // square_count, width // square_count
+    if cell_h == 0 or cell_w == 0:
+        raise ValueError(f'Image {width}x{height} is too small for a {square_count}x{square_count} grid')
+    board = image[:cell_h * square_count, :cell_w * square_count]
+    blocks = board.reshape(square_count, cell_h, square_count, cell_w, *image.shape[2:]).swapaxes(1, 2)
+    dy, dx = int(cell_h * inset), int(cell_w * inset)
+    return blocks[:, :, dy:cell_h - dy, dx:cell_w - dx]
+
+
+def _histograms(blocks: np.ndarray, bins: int) -> np.ndarray:
+    """blocks (n, n, h, w, 3) uint8 -> (n, n, 3, bins) через один bincount на канал."""
+    n = blocks.shape[0]
+    pixels = blocks.shape[2] * blocks.shape[3]
+    square_ids = np.repeat(np.arange(n * n, dtype=np.intp), pixels)
+    shift = 8 - int(np.log2(bins))
+    result = np.empty((n * n, 3, bins), dtype=np.float32)
+    for channel in range(3):
+        values = blocks[..., channel].reshape(-1) >> shift
+        counts = np.bincount(square_ids * bins + values, minlength=n * n * bins)
+        result[:, channel] = counts.reshape(n * n, bins)
+    result /= pixels
+    return result.reshape(n, n, 3, bins)
+
+
+def extract_square_features(
+    warped: np.ndarray,
+    *,
+    square_count: int = SQUARE_COUNT,
+    inset: float = SQUARE_INSET,
+    histograms: bool = False,
+) -> SquareFeatures:
+    """
+    Признаки клеток выровненной доски (BGR или серое изображение).
+    histograms=True добавляет гистограммы цвета (только для BGR).
+    """
+    color = warped.ndim == 3
+    gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY) if color else warped
+
+    gray_blocks = square_blocks(gray, square_count, inset)
+    # float32 вместо float64 по умолчанию: вдвое меньше памяти, точности хватает
+    mean = gray_blocks.mean(axis=(2, 3), dtype=np.float32)
+    std = gray_blocks.std(axis=(2, 3), dtype=np.float32)
+
+    edges = cv2.Canny(gray, EDGE_LOW_THRESHOLD, EDGE_HIGH_THRESHOLD)
+    edge_density = np.count_nonzero(square_blocks(edges, square_count, inset), axis=(2, 3)).astype(np.float32)
+    edge_density /= gray_blocks.shape[2] * gray_blocks.shape[3]
+
+    hists = None
+    if histograms and color:
+        hists = _histograms(square_blocks(warped, square_count, inset), HIST_BINS)
+    return SquareFeatures(mean=mean, std=std, edge_density=edge_density, histograms=hists)
+
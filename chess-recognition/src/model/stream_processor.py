@@ -2,16 +2,29 @@
 Обработчик потока в реальном времени для шахматной доски
 """
 import cv2
+import logging
 import numpy as np
 import json
-import sys
-from typing import Any, Optional, Dict, Callable, List, Tuple
+from typing import TYPE_CHECKING, Any, Optional, Dict, Callable, List, Tuple
 from collections import Counter
 from pathlib import Path
 from model.yolo11_detector import YOLO11Detector, BoardStateMapper
-from model.hand_detector import detect_hand_on_board
+from model.hand_detector import HandDetectionResult, detect_hand_on_board
+from model.drift_tracker import DRIFT_TRACKING, BoardDriftTracker
+from model.occupancy import OccupancyClassifier
+from improved_board_mapping import load_mapping_data, save_mapping_data
+from worker_logging import get_logger, log_sampled
+from worker_metrics import NULL_TRACE
 import chess
 
+if TYPE_CHECKING:
+    # torch грузится только там, где включён движок squares
+    from model.square_classifier import SquareCropClassifier
+
+_log = get_logger('stream')
+_detection_log = get_logger('detection')
+_orientation_log = get_logger('orientation')
+
 # ID фигур (как в BoardStateMapper / virtual_board)
 _PIECE_ID_TO_SYMBOL = {
     0: 'P', 1: 'R', 2: 'B', 3: 'N', 4: 'K', 5: 'Q',
@@ -27,7 +40,13 @@ class StreamProcessor:
                  game_token: str,
                  mapping_dir: Path = Path('./chessboard_mappings'),
                  on_move_detected: Optional[Callable] = None,
-                 detector: Optional[YOLO11Detector] = None):
+                 detector: Optional[YOLO11Detector] = None,
+                 occupancy: Optional[OccupancyClassifier] = None,
+                 occupancy_mode: str = 'off',
+                 engine: str = 'yolo',
+                 square_classifier: Optional['SquareCropClassifier'] = None,
+                 mapping_busy: Optional[Callable[[], bool]] = None,
+                 hand_detection: bool = True):
         """
         Инициализация обработчика потока
         
@@ -37,10 +56,20 @@ class StreamProcessor:
             mapping_dir: Директория с маппингами
             on_move_detected: Callback функция при обнаружении хода
             detector: Общий экземпляр YOLO (для inference-воркера)
+            occupancy: Классификатор занятости клеток (см. model.occupancy)
+            occupancy_mode: off, check или gate; без occupancy — всегда off
+            engine: yolo (детекция и треки) или squares (классификация клеток,
+                см. model.square_classifier); без square_classifier — всегда yolo
+            square_classifier: Общий классификатор клеток для движка squares
+            mapping_busy: True, пока файл маппинга токена может переписать
+                калибровка (index_map тогда на диск не сохраняется)
+            hand_detection: False — MediaPipe не запускается, рука считается
+                не найденной (замеры конвейера без стадии hand)
         """
         self.game_token = game_token
         self.mapping_dir = mapping_dir
         self.on_move_detected = on_move_detected
+        self.mapping_busy = mapping_busy
         
         if detector is not None:
             self.detector = detector
@@ -49,15 +78,13 @@ class StreamProcessor:
             try:
                 self.detector = YOLO11Detector(model_path)
             except (FileNotFoundError, Exception) as e:
-                import warnings
-                warnings.warn(f"Custom model not found, trying pretrained YOLO11n: {str(e)}")
+                _log.warning('Custom model not found, trying pretrained YOLO11n: %s', e)
                 try:
                     self.detector = YOLO11Detector('yolo11n.pt')
                 except Exception as e2:
-                    import warnings
-                    warnings.warn(
-                        f"Could not load any model. System will work in calibration-only mode. "
-                        f"Error: {str(e2)}."
+                    _log.warning(
+                        'Could not load any model. System will work in calibration-only mode. Error: %s',
+                        e2,
                     )
                     self.detector = None
         
@@ -65,12 +92,25 @@ class StreamProcessor:
         self.mapping_data = self._load_mapping()
         if not self.mapping_data or not self.mapping_data.get('success'):
             # Маппинг не найден - работаем без маппинга (режим калибровки)
-            import warnings
-            warnings.warn(f"Маппинг для токена {game_token} не найден. Система будет работать без маппинга.")
+            _log.warning('Маппинг для токена %s не найден. Система будет работать без маппинга.', game_token)
             self.mapping_data = None
+
+        # Гомография доски держится в памяти; трекер сдвига обновляет её без
+        # перекалибровки. mapping_data остаётся как в файле: сдвинутые углы
+        # живут только в _board_corners и в файл маппинга не попадают
+        self._board_corners = None  # type: Optional[np.ndarray]
+        self._warp_matrix = None  # type: Optional[np.ndarray]
+        self._warp_size = None  # type: Optional[Tuple[int, int]]
+        self.drift_tracker = None  # type: Optional[BoardDriftTracker]
+        self._board_drift = None  # type: Optional[Dict]
+        if self.mapping_data is not None:
+            self._set_board_corners(np.array(self.mapping_data['board_corners'], dtype=np.float32))
+            if DRIFT_TRACKING:
+                self.drift_tracker = BoardDriftTracker(self.mapping_data['board_corners'])
         
         # Маппер для преобразования треков в состояние доски
         self.board_mapper = BoardStateMapper()
+        self._piece_id_to_class = {piece_id: name for name, piece_id in self.board_mapper.piece_class_to_id.items()}
         
         # Ориентация доски (сырые индексы -> ориентированные, где a1 внизу слева)
         self.index_map = None  # type: Optional[np.ndarray]
@@ -80,17 +120,33 @@ class StreamProcessor:
         self.history_size = 10
         self.snapshot_vote_min = 6  # ≥60% кадров за клетку (6 из 10)
         self.hand_landmarks_inside_min = 1
+        self.hand_detection = hand_detection
+
+        # Занятость клеток перед YOLO: gate пропускает YOLO, пока она совпадает
+        # с последним снимком позиции (_snapshot_state, ориентированный).
+        # Каждый gate_recheck_interval-й совпавший кадр всё равно идёт через
+        # детекцию: иначе ошибка в классе фигуры снимка воспроизводилась бы
+        # голосованием, пока не сменится занятость
+        self.occupancy = occupancy
+        self.occupancy_mode = occupancy_mode if occupancy is not None else 'off'
+        self._snapshot_state = None  # type: Optional[np.ndarray]
+        self.gate_recheck_interval = self.history_size
+        self._gated_streak = 0
+
+        # Движок распознавания: squares пишет board_state сразу по вырезкам клеток
+        self.square_classifier = square_classifier
+        self.engine = engine if square_classifier is not None else 'yolo'
+
+        # Результаты стадий последнего кадра для повторных кадров (process_duplicate_frame):
+        # {'hand_result': ..., 'board': (state, confidence_map, detections_info, tracks) | None}
+        self._last_observation = None  # type: Optional[Dict[str, Any]]
         
     def _load_mapping(self) -> Optional[Dict]:
         """Загрузка данных маппинга"""
         mapping_file = self.mapping_dir / f'{self.game_token}_mapping.json'
         
-        # Логирование для отладки
-        import warnings
-        warnings.warn(f"Loading mapping from: {mapping_file.absolute()}, exists: {mapping_file.exists()}")
-        
         if not mapping_file.exists():
-            warnings.warn(f"Mapping file not found: {mapping_file.absolute()}")
+            _log.debug('Mapping file not found: %s', mapping_file)
             return None
         
         try:
@@ -103,17 +159,66 @@ class StreamProcessor:
                     if 'index_map' in data:
                         index_map_data = np.array(data['index_map'], dtype=np.int32)
                         self.index_map = index_map_data
-                    warnings.warn(f"Mapping loaded successfully for token {self.game_token}")
+                    _log.debug('Mapping loaded for token %s from %s', self.game_token, mapping_file)
                     return data
                 else:
-                    warnings.warn(f"Mapping file exists but invalid: success={data.get('success')}, has square_corners={'square_corners' in data}")
+                    _log.warning(
+                        'Mapping file exists but invalid: success=%s, has square_corners=%s',
+                        data.get('success'),
+                        'square_corners' in data,
+                    )
                 return None
         except Exception as e:
-            warnings.warn(f"Error loading mapping: {str(e)}")
+            _log.warning('Error loading mapping: %s', e)
             return None
     
     
     
+    def _set_board_corners(self, board_corners: np.ndarray) -> None:
+        """Пересчёт матрицы warp (как perspective_transform в improved_board_mapping)"""
+        from improved_board_mapping import OUTPUT_IMAGE_SIZE, order_points_clockwise
+
+        if 'warped_image_shape' in self.mapping_data:
+            shape = self.mapping_data['warped_image_shape']
+            width, height = shape[1], shape[0]
+        else:
+            width, height = OUTPUT_IMAGE_SIZE
+        dst_points = np.array(
+            [[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]],
+            dtype=np.float32,
+        )
+        ordered = order_points_clockwise(board_corners)
+        self._warp_matrix = cv2.getPerspectiveTransform(ordered, dst_points)
+        self._warp_size = (width, height)
+        self._board_corners = ordered
+
+    def _track_drift(self, frame: np.ndarray) -> Optional[Dict]:
+        """
+        Проверка сдвига доски на кадре без руки. При сдвиге обновляет
+        гомографию сессии в памяти (файл маппинга не трогается) и
+        возвращает событие для frame_result.
+        """
+        was_lost = self.drift_tracker.lost
+        update = self.drift_tracker.update(frame)
+        if self.drift_tracker.lost and not was_lost:
+            _log.warning(
+                'Board moved too far for drift tracking (token %s), recalibration needed',
+                self.game_token,
+            )
+        if update is None:
+            return None
+        self._set_board_corners(update.corners)
+        self.board_state_history.clear()
+        _log.info(
+            'Board drift for %s: shift=%.1fpx inliers=%d, homography updated',
+            self.game_token, update.shift_px, update.inliers,
+        )
+        return {
+            'shift_px': update.shift_px,
+            'inliers': update.inliers,
+            'corners': self._board_corners.tolist(),
+        }
+
     def _hand_detections_info(
         self,
         hand_result,
@@ -145,16 +250,51 @@ class StreamProcessor:
             'history_target': self.history_size,
         }
 
-    def process_frame(self, frame: np.ndarray, *, hand_probe_only: bool = False) -> Dict:
+    def _hand_on_board(self, hand_result) -> bool:
+        return (
+            hand_result.available
+            and hand_result.landmarks_inside >= self.hand_landmarks_inside_min
+        )
+
+    def _hand_frame_result(self, hand_result, hand_on_board: bool) -> Dict:
+        """Кадр без YOLO: пробник руки или рука на доске (история сбрасывается)."""
+        if hand_on_board:
+            self.board_state_history.clear()
+        return {
+            'status': 'processed',
+            'board_snapshot': False,
+            'history_frozen': hand_on_board,
+            'hand_detected': hand_on_board,
+            'detections_info': self._history_hand_info(
+                hand_result,
+                history_frozen=hand_on_board,
+            ),
+        }
+
+    def process_frame(self, frame: np.ndarray, *, hand_probe_only: bool = False, trace=None) -> Dict:
         """
         Обработка одного кадра с использованием ByteTrack трекинга
         
         Args:
             frame: Входной кадр (BGR)
+            trace: FrameTrace для таймингов стадий (warp, hand, drift, occupancy,
+                yolo, squares или classify, voting)
             
         Returns:
-            Словарь с результатами обработки
+            Словарь с результатами обработки; board_drift — если на этом
+            кадре гомография доски была обновлена трекером сдвига
         """
+        if trace is None:
+            trace = NULL_TRACE
+        self._board_drift = None
+        self._last_observation = None
+        result = self._process_frame(frame, hand_probe_only, trace)
+        if self._board_drift is not None:
+            result['board_drift'] = self._board_drift
+        return result
+
+    def _process_frame(self, frame: np.ndarray, hand_probe_only: bool, trace) -> Dict:
+
         # Если маппинг не загружен, работаем без него
         if self.mapping_data is None:
             return {
@@ -169,15 +309,9 @@ class StreamProcessor:
                 }
             }
         
-        # Применяем маппинг
-        from improved_board_mapping import apply_mapping
-        warped = apply_mapping(frame, self.game_token, self.mapping_dir)
-        
-        if warped is None:
-            return {
-                'status': 'error',
-                'message': 'Failed to apply mapping'
-            }
+        # Применяем маппинг (матрица закеширована, файл маппинга не читается)
+        with trace.span('warp'):
+            warped = cv2.warpPerspective(frame, self._warp_matrix, self._warp_size)
         
         # Визуализация маппинга отключена - файлы _mapping_original_vis и _mapping_warped_vis не нужны
         # Визуализация уже есть в calibration_result.jpg
@@ -187,7 +321,7 @@ class StreamProcessor:
         
         # Трекинг фигур с использованием ByteTrack
         # persist=True сохраняет треки между кадрами
-        if self.detector is None:
+        if self.detector is None and self.engine == 'yolo':
             # Режим без детекции - возвращаем пустой результат
             return {
                 'status': 'processed',
@@ -202,36 +336,53 @@ class StreamProcessor:
             }
 
         square_corners_grid = np.array(self.mapping_data['square_corners'])
-        hand_result = detect_hand_on_board(
-            warped,
-            square_corners_grid,
-            min_landmarks_inside=self.hand_landmarks_inside_min,
-        )
-        hand_on_board = (
-            hand_result.available
-            and hand_result.landmarks_inside >= self.hand_landmarks_inside_min
-        )
+        if self.hand_detection:
+            with trace.span('hand'):
+                hand_result = detect_hand_on_board(
+                    warped,
+                    square_corners_grid,
+                    min_landmarks_inside=self.hand_landmarks_inside_min,
+                )
+        else:
+            hand_result = HandDetectionResult(False, 0, 0, False)
+        hand_on_board = self._hand_on_board(hand_result)
+        self._last_observation = {'hand_result': hand_result, 'board': None}
 
         if hand_probe_only or hand_on_board:
-            if hand_on_board:
-                self.board_state_history.clear()
-            return {
-                'status': 'processed',
-                'board_snapshot': False,
-                'history_frozen': hand_on_board,
-                'hand_detected': hand_on_board,
-                'detections_info': self._history_hand_info(
-                    hand_result,
-                    history_frozen=hand_on_board,
-                ),
-            }
+            return self._hand_frame_result(hand_result, hand_on_board)
+
+        if self.drift_tracker is not None:
+            with trace.span('drift'):
+                self._board_drift = self._track_drift(frame)
+                if self._board_drift is not None:
+                    warped = cv2.warpPerspective(frame, self._warp_matrix, self._warp_size)
+
+        occupied = None
+        gate_recheck = False
+        if self.occupancy_mode != 'off':
+            with trace.span('occupancy'):
+                occupied = self._apply_index_map(self.occupancy.predict(warped))
+            if (
+                self.occupancy_mode == 'gate'
+                and self._snapshot_state is not None
+                and np.array_equal(occupied, self._snapshot_state != -1)
+            ):
+                self._gated_streak += 1
+                if self._gated_streak < self.gate_recheck_interval:
+                    return self._gated_frame(hand_result, trace)
+                gate_recheck = True
+            self._gated_streak = 0
+
+        if self.engine == 'squares':
+            return self._classify_frame(warped, hand_result, occupied, gate_recheck, trace)
 
         try:
             # Детекция идет на warped изображении (после перспективной трансформации)
             # Warped - это трансформированное изображение, где доска выровнена в квадрат
             # Фигуры НЕ обрезаются, потому что трансформация сохраняет все содержимое доски
             # (просто меняет перспективу). Это правильно, так как фигуры на краях остаются видимыми
-            tracks = self.detector.track(warped, persist=True)
+            with trace.span('yolo'):
+                tracks = self.detector.track(warped, persist=True)
             
             # Фильтрация по confidence - не используем детекции с низкой уверенностью
             # Это помогает стабилизировать детекции и избежать ложных срабатываний
@@ -301,7 +452,7 @@ class StreamProcessor:
             # Логирование детекций убрано - дублируется в NestJS
                 
         except Exception as e:
-            print(f"❌ [DETECTION] Tracking error: {str(e)}", file=sys.stderr, flush=True)
+            _detection_log.error('Tracking error for %s: %s', self.game_token, e)
             return {
                 'status': 'error',
                 'message': f'Tracking error: {str(e)}',
@@ -311,31 +462,152 @@ class StreamProcessor:
                 }
             }
         
-        board_state_raw = self.board_mapper.tracks_to_board_state(
-            tracks_for_board, square_corners_grid,
-        )
+        with trace.span('squares'):
+            board_state_raw = self.board_mapper.tracks_to_board_state(
+                tracks_for_board, square_corners_grid,
+            )
+
+            if self.index_map is None:
+                tracks_for_orientation = (
+                    board_filtered_tracks
+                    if 'board_filtered_tracks' in locals()
+                    else tracks_for_board
+                )
+                self._try_init_orientation(
+                    board_state_raw, tracks=tracks_for_orientation,
+                )
+
+            if self.index_map is not None:
+                current_board_state = self._apply_index_map(board_state_raw)
+            else:
+                current_board_state = board_state_raw
+
+            confidence_map = np.zeros((8, 8), dtype=np.float32)
+            for i in range(8):
+                for j in range(8):
+                    if current_board_state[i, j] != -1:
+                        confidence_map[i, j] = 1.0
+
+        if occupied is not None:
+            # клетки, где классификатор занятости и YOLO расходятся
+            detections_info['occupancy_mismatch'] = int(np.count_nonzero(occupied != (current_board_state != -1)))
+        if gate_recheck:
+            self._recheck_gate(current_board_state, detections_info)
+
+        self._last_observation['board'] = (current_board_state, confidence_map, detections_info, tracks)
+        return self._vote(current_board_state, confidence_map, detections_info, tracks, trace)
+
+    def _classify_frame(
+        self,
+        warped: np.ndarray,
+        hand_result,
+        occupied: Optional[np.ndarray],
+        gate_recheck: bool,
+        trace,
+    ) -> Dict:
+        """
+        Движок squares: 64 клетки одним батчем классификатора, без NMS,
+        трекера и поиска клетки по рамке. Ориентация определяется по
+        самой позиции (рамок белых фигур нет).
+        """
+        with trace.span('classify'):
+            board_state_raw, confidence_raw = self.square_classifier.classify(warped)
 
         if self.index_map is None:
-            tracks_for_orientation = (
-                board_filtered_tracks
-                if 'board_filtered_tracks' in locals()
-                else tracks_for_board
-            )
-            self._try_init_orientation(
-                board_state_raw, tracks=tracks_for_orientation,
-            )
+            self._try_init_orientation(board_state_raw)
+        current_board_state = self._apply_index_map(board_state_raw)
+        confidence_map = self._apply_index_map_to_confidence(confidence_raw)
 
-        if self.index_map is not None:
-            current_board_state = self._apply_index_map(board_state_raw)
-        else:
-            current_board_state = board_state_raw
+        classes_detected = {}  # type: Dict[str, int]
+        for piece_id in current_board_state[current_board_state != -1].tolist():
+            class_name = self._piece_id_to_class[piece_id]
+            classes_detected[class_name] = classes_detected.get(class_name, 0) + 1
+        occupied_squares = int(np.count_nonzero(current_board_state != -1))
+        detections_info = {
+            **self._history_hand_info(hand_result, history_frozen=False),
+            'engine': 'squares',
+            'total_detections': occupied_squares,
+            'board_mapped_detections': occupied_squares,
+            'classes_detected': classes_detected,
+            'min_square_confidence': round(float(confidence_map.min()), 3),
+        }
+        if occupied is not None:
+            detections_info['occupancy_mismatch'] = int(np.count_nonzero(occupied != (current_board_state != -1)))
+        if gate_recheck:
+            self._recheck_gate(current_board_state, detections_info)
 
-        confidence_map = np.zeros((8, 8), dtype=np.float32)
-        for i in range(8):
-            for j in range(8):
-                if current_board_state[i, j] != -1:
-                    confidence_map[i, j] = 1.0
+        self._last_observation['board'] = (current_board_state, confidence_map, detections_info, [])
+        return self._vote(current_board_state, confidence_map, detections_info, [], trace)
 
+    def process_duplicate_frame(self, *, hand_probe_only: bool = False, trace=None) -> Optional[Dict]:
+        """
+        Кадр, совпавший с предыдущим: warp, рука, сдвиг и YOLO не повторяются,
+        берутся результаты прошлого кадра, а история голосования продвигается
+        как для обычного кадра. None — прошлый кадр не дал нужных результатов
+        (ошибка, нет маппинга, был только пробник руки); тогда кадр нужно
+        обработать через process_frame.
+        """
+        observation = self._last_observation
+        if observation is None:
+            return None
+        if trace is None:
+            trace = NULL_TRACE
+        self._board_drift = None
+        hand_result = observation['hand_result']
+        hand_on_board = self._hand_on_board(hand_result)
+        if hand_probe_only or hand_on_board:
+            return self._hand_frame_result(hand_result, hand_on_board)
+        if observation['board'] is None:
+            return None
+        current_board_state, confidence_map, detections_info, tracks = observation['board']
+        detections_info = {**detections_info, 'history_frames': len(self.board_state_history)}
+        # повтор не проходит детекцию — контрольным кадром gate он не считается
+        detections_info.pop('occupancy_recheck', None)
+        detections_info.pop('occupancy_recheck_failed', None)
+        result = self._vote(current_board_state, confidence_map, detections_info, tracks, trace)
+        if detections_info.get('occupancy_gated'):
+            result['detection_skipped'] = True
+        return result
+
+    def _gated_frame(self, hand_result, trace) -> Dict:
+        """
+        Занятость клеток совпала с последним снимком: YOLO не запускается,
+        в историю голосования идёт состояние снимка. Любой ход освобождает
+        исходную клетку, поэтому та же занятость — та же позиция.
+        """
+        state = self._snapshot_state
+        confidence_map = (state != -1).astype(np.float32)
+        detections_info = {
+            **self._history_hand_info(hand_result, history_frozen=False),
+            'occupancy_gated': True,
+        }
+        self._last_observation['board'] = (state, confidence_map, detections_info, [])
+        result = self._vote(state, confidence_map, detections_info, [], trace)
+        result['detection_skipped'] = True
+        return result
+
+    def _recheck_gate(self, current_board_state: np.ndarray, detections_info: Dict) -> None:
+        """
+        Контрольный кадр gate прошёл детекцию. Если позиция разошлась со
+        снимком, копии снимка в истории ничего не подтверждают: история
+        очищается, а gate выключается до следующего снимка, набранного
+        только по детекциям.
+        """
+        detections_info['occupancy_recheck'] = True
+        if not np.array_equal(current_board_state, self._snapshot_state):
+            detections_info['occupancy_recheck_failed'] = True
+            self.board_state_history.clear()
+            self._snapshot_state = None
+
+    def _vote(
+        self,
+        current_board_state: np.ndarray,
+        confidence_map: np.ndarray,
+        detections_info: Dict,
+        tracks: List[Dict],
+        trace,
+    ) -> Dict:
+        """Кадр в историю; на history_size кадрах — снимок позиции голосованием."""
         self.board_state_history.append(
             (current_board_state.copy(), confidence_map.copy()),
         )
@@ -350,8 +622,10 @@ class StreamProcessor:
                 'detections_info': detections_info,
             }
 
-        voted_state = self._stabilize_board_state(self.board_state_history)
+        with trace.span('voting'):
+            voted_state = self._stabilize_board_state(self.board_state_history)
         self.board_state_history.clear()
+        self._snapshot_state = voted_state
 
         tracks_dict = {
             str(track['track_id']): {
@@ -580,13 +854,16 @@ class StreamProcessor:
                     else:  # Правая половина
                         best_orientation = 'rot270'    # Камера справа
                 
-                print(f"[ORIENTATION] Using bbox: {len(white_pieces_coords)} white pieces, avg (X, Y): ({avg_white_x:.1f}, {avg_white_y:.1f}), mid (X, Y): ({mid_x:.1f}, {mid_y:.1f}), selected: {best_orientation}", file=sys.stderr, flush=True)
+                _orientation_log.debug(
+                    'Using bbox: %d white pieces, avg (X, Y): (%.1f, %.1f), mid (X, Y): (%.1f, %.1f), selected: %s',
+                    len(white_pieces_coords), avg_white_x, avg_white_y, mid_x, mid_y, best_orientation,
+                )
                 
                 # Проверяем score для выбранной ориентации
                 state_oriented = self._apply_orientation(board_state_raw, best_orientation)
                 best_score = self._score_orientation(state_oriented, canonical)
                 orientation_from_bbox = True
-                print(f"[ORIENTATION] Selected {best_orientation} based on bbox, score: {best_score:.3f}", file=sys.stderr, flush=True)
+                _orientation_log.debug('Selected %s based on bbox, score: %.3f', best_orientation, best_score)
             else:
                 # Fallback: используем старую логику по board_state (только identity и rot180)
                 best_orientation = None
@@ -601,7 +878,10 @@ class StreamProcessor:
                     white_pieces_bottom = np.sum((state_oriented[4:8, :] >= 0) & (state_oriented[4:8, :] <= 5))
                     white_pieces_top = np.sum((state_oriented[0:4, :] >= 0) & (state_oriented[0:4, :] <= 5))
                     
-                    print(f"[ORIENTATION] {name} score: {score:.3f} (whites bottom [4-7]: {white_pieces_bottom}, top [0-3]: {white_pieces_top})", file=sys.stderr, flush=True)
+                    _orientation_log.debug(
+                        '%s score: %.3f (whites bottom [4-7]: %d, top [0-3]: %d)',
+                        name, score, white_pieces_bottom, white_pieces_top,
+                    )
                     
                     if white_pieces_bottom > white_pieces_top:
                         if score > best_score:
@@ -625,7 +905,10 @@ class StreamProcessor:
                 white_pieces_bottom = np.sum((state_oriented[4:8, :] >= 0) & (state_oriented[4:8, :] <= 5))
                 white_pieces_top = np.sum((state_oriented[0:4, :] >= 0) & (state_oriented[0:4, :] <= 5))
                 
-                print(f"[ORIENTATION] {name} score: {score:.3f} (whites bottom [4-7]: {white_pieces_bottom}, top [0-3]: {white_pieces_top})", file=sys.stderr, flush=True)
+                _orientation_log.debug(
+                    '%s score: %.3f (whites bottom [4-7]: %d, top [0-3]: %d)',
+                    name, score, white_pieces_bottom, white_pieces_top,
+                )
                 
                 if white_pieces_bottom > white_pieces_top:
                     if score > best_score:
@@ -636,23 +919,32 @@ class StreamProcessor:
                         best_score = score
                         best_orientation = name
 
-        print(f"[ORIENTATION] Best: {best_orientation}, score: {best_score:.3f}, threshold: {threshold}, from_bbox: {orientation_from_bbox}", file=sys.stderr, flush=True)
+        _orientation_log.debug(
+            'Best: %s, score: %.3f, threshold: %s, from_bbox: %s',
+            best_orientation, best_score, threshold, orientation_from_bbox,
+        )
 
         # Если ориентация выбрана по bbox, применяем её независимо от score
         # (bbox более надежный индикатор чем score для стартовой позиции)
         if best_orientation is None:
-            print(f"[ORIENTATION] Auto-orientation failed: no orientation selected", file=sys.stderr, flush=True)
+            log_sampled(
+                _orientation_log, logging.INFO, self.game_token,
+                'Auto-orientation failed for %s: no orientation selected', self.game_token,
+            )
             return
         
         if not orientation_from_bbox and best_score < threshold:
             # Автоматическую ориентацию определить не удалось —
             # оставляем index_map = None, позже можно будет добавить
             # ручное задание a1.
-            print(f"[ORIENTATION] Auto-orientation failed (score {best_score:.3f} < {threshold})", file=sys.stderr, flush=True)
+            log_sampled(
+                _orientation_log, logging.INFO, self.game_token,
+                'Auto-orientation failed for %s (score %.3f < %s)', self.game_token, best_score, threshold,
+            )
             return
         
         if orientation_from_bbox:
-            print(f"[ORIENTATION] Applying {best_orientation} based on bbox (ignoring threshold)", file=sys.stderr, flush=True)
+            _orientation_log.debug('Applying %s based on bbox (ignoring threshold)', best_orientation)
 
         # Уточняем: среди 4 поворотов берём максимальный score с канонической стартовой позицией
         refined_orientation = best_orientation
@@ -664,11 +956,9 @@ class StreamProcessor:
                 refined_score = score
                 refined_orientation = name
         if refined_orientation != best_orientation:
-            print(
-                f"[ORIENTATION] Refined {best_orientation} -> {refined_orientation} "
-                f'(score {best_score:.3f} -> {refined_score:.3f})',
-                file=sys.stderr,
-                flush=True,
+            _orientation_log.debug(
+                'Refined %s -> %s (score %.3f -> %.3f)',
+                best_orientation, refined_orientation, best_score, refined_score,
             )
         best_orientation = refined_orientation
         best_score = refined_score
@@ -697,24 +987,31 @@ class StreamProcessor:
                 for j in range(8):
                     index_map[i, j] = (7 - j, i)
         else:
-            print(f"[ORIENTATION] Unknown orientation: {best_orientation}", file=sys.stderr, flush=True)
+            _orientation_log.warning('Unknown orientation: %s', best_orientation)
             return
 
         self.index_map = index_map
         self._save_index_map_to_mapping_file()
-        print(f"[ORIENTATION] Auto-orientation succeeded: {best_orientation}", file=sys.stderr, flush=True)
+        _orientation_log.info('Auto-orientation succeeded for %s: %s', self.game_token, best_orientation)
 
     def _save_index_map_to_mapping_file(self) -> None:
         if self.index_map is None or not self.mapping_data:
             return
+        if self.mapping_busy is not None and self.mapping_busy():
+            # калибровка токена в процессе и перепишет файл; index_map остаётся в памяти
+            _orientation_log.info('Calibration in flight for %s, index_map not saved', self.game_token)
+            return
         try:
-            mapping_file = self.mapping_dir / f'{self.game_token}_mapping.json'
-            payload = dict(self.mapping_data)
+            # index_map дописывается в файл с диска, а не в mapping_data сессии:
+            # если маппинг успели перекалибровать, старый его не затирает
+            payload = load_mapping_data(self.game_token, self.mapping_dir)
+            if not payload or payload.get('board_corners') != self.mapping_data.get('board_corners'):
+                _orientation_log.info('Mapping for %s changed on disk, index_map not saved', self.game_token)
+                return
             payload['index_map'] = self.index_map.tolist()
-            with open(mapping_file, 'w', encoding='utf-8') as f:
-                json.dump(payload, f, ensure_ascii=False, indent=2)
+            save_mapping_data(self.game_token, payload, self.mapping_dir)
         except Exception as e:
-            print(f"[ORIENTATION] Failed to save index_map: {e}", file=sys.stderr, flush=True)
+            _orientation_log.warning('Failed to save index_map: %s', e)
 
     def _visualize_mapping(self, original_frame: np.ndarray, warped_frame: np.ndarray) -> None:
         """
@@ -769,9 +1066,9 @@ class StreamProcessor:
             cv2.imwrite(str(vis_original_path), vis_original)
             cv2.imwrite(str(vis_warped_path), vis_warped)
             
-            print(f"📊 [VISUALIZATION] Mapping visualization saved: {vis_original_path} and {vis_warped_path}", file=sys.stderr, flush=True)
+            _log.debug('Mapping visualization saved: %s and %s', vis_original_path, vis_warped_path)
         except Exception as e:
-            print(f"⚠️ [VISUALIZATION] Failed to visualize mapping: {str(e)}", file=sys.stderr, flush=True)
+            _log.warning('Failed to visualize mapping: %s', e)
     
     def _apply_index_map(self, board_state_raw: np.ndarray) -> np.ndarray:
         """
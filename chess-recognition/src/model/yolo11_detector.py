@@ -2,11 +2,16 @@
 YOLO 11 детектор для шахматных фигур с поддержкой ByteTrack трекинга
 """
 import cv2
+import logging
 import numpy as np
 from typing import List, Tuple, Optional, Dict
-from ultralytics import YOLO
 from pathlib import Path
 import json
+import threading
+
+from worker_logging import get_logger, log_sampled
+
+_board_state_log = get_logger('board_state')
 
 
 class YOLO11Detector:
@@ -21,8 +26,11 @@ class YOLO11Detector:
             conf_threshold: Порог уверенности для детекции
             iou_threshold: Порог IoU для NMS
         """
+        # ultralytics тянет torch — импортируем только при создании детектора,
+        # BoardStateMapper из этого модуля без него обходится
+        from ultralytics import YOLO
+
         # Проверка существования файла модели
-        from pathlib import Path
         model_file = Path(model_path)
         
         if not model_file.exists():
@@ -58,6 +66,10 @@ class YOLO11Detector:
         
         # Загрузка конфигурации классов
         self.class_names = self.model.names
+
+        # Детектор общий для сессий воркера и потока калибровки:
+        # вызовы модели ultralytics не потокобезопасны
+        self._lock = threading.Lock()
         
     def predict(self, image: np.ndarray) -> List[Tuple[str, Tuple[int, int, int, int], float, int]]:
         """
@@ -70,12 +82,13 @@ class YOLO11Detector:
             Список детекций: (class_name, bbox, confidence, class_id)
             bbox формат: (x1, y1, x2, y2)
         """
-        results = self.model.predict(
-            source=image,
-            conf=self.conf_threshold,
-            iou=self.iou_threshold,
-            verbose=False
-        )
+        with self._lock:
+            results = self.model.predict(
+                source=image,
+                conf=self.conf_threshold,
+                iou=self.iou_threshold,
+                verbose=False
+            )
         
         detections = []
         for result in results:
@@ -114,14 +127,15 @@ class YOLO11Detector:
                 ...
             ]
         """
-        results = self.model.track(
-            source=image,
-            conf=self.conf_threshold,
-            iou=self.iou_threshold,
-            persist=persist,
-            tracker='bytetrack.yaml',  # Используем ByteTrack
-            verbose=False
-        )
+        with self._lock:
+            results = self.model.track(
+                source=image,
+                conf=self.conf_threshold,
+                iou=self.iou_threshold,
+                persist=persist,
+                tracker='bytetrack.yaml',  # Используем ByteTrack
+                verbose=False
+            )
         
         tracks = []
         for result in results:
@@ -209,10 +223,12 @@ class BoardStateMapper:
             else:
                 pieces_outside += 1
         
-        # Логируем статистику для отладки
-        filled_squares = np.sum(board_state != -1)
-        import sys
-        print(f"[BOARD_STATE] Mapped {pieces_mapped} pieces to board, {pieces_outside} outside, {filled_squares}/64 squares filled", file=sys.stderr, flush=True)
+        # Логируем статистику для отладки (сэмплированно, аргументы форматируются лениво)
+        log_sampled(
+            _board_state_log, logging.DEBUG, None,
+            'Mapped %d pieces to board, %d outside, %d/64 squares filled',
+            pieces_mapped, pieces_outside, int(np.sum(board_state != -1)),
+        )
         
         return board_state, cell_confidence
     
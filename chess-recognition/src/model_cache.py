@@ -0,0 +1,117 @@
+"""
+Кеш готовых к запуску весов для быстрого старта воркера.
+
+Ключ — sha256 исходного файла весов, версий torch/torchvision и
+параметров загрузки (модель, устройство, размер входа, режим
+оптимизации). Что хранится:
+  corner-<key>.pt  — state_dict CornerRegressor в zip-формате torch.save,
+                     грузится через mmap без копирования в память;
+  corner-<key>.ts  — проверенный TorchScript (режим trace), грузится
+                     сразу, без fuse/trace/сверки;
+  inductor/        — кеш скомпилированных графов torch.compile.
+
+Записи пишутся атомарно (tmp + replace); для каждого вида хранится
+KEEP_PER_KIND последних, старые удаляются.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import torch
+import torch.nn as nn
+
+from model_paths import MODELS_DIR
+from worker_logging import get_logger
+
+DEFAULT_MODEL_CACHE_DIR = os.environ.get('CV_MODEL_CACHE') or str(MODELS_DIR / '.cache')
+KEEP_PER_KIND = 3
+_CHUNK = 1 << 20
+
+_log = get_logger('models')
+
+
+def _library_versions() -> str:
+    import torchvision
+
+    return f'torch={torch.__version__};torchvision={torchvision.__version__}'
+
+
+class ModelCache:
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._hashes: Dict[str, str] = {}
+
+    def file_hash(self, path: str) -> str:
+        if path not in self._hashes:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(_CHUNK), b''):
+                    digest.update(chunk)
+            self._hashes[path] = digest.hexdigest()
+        return self._hashes[path]
+
+    def key(self, weights_path: str, **params) -> str:
+        digest = hashlib.sha256(self.file_hash(weights_path).encode('ascii'))
+        digest.update(_library_versions().encode('ascii'))
+        for name in sorted(params):
+            digest.update(f';{name}={params[name]}'.encode('utf-8'))
+        return digest.hexdigest()[:24]
+
+    def _path(self, kind: str, key: str, suffix: str) -> Path:
+        return self.directory / f'{kind}-{key}{suffix}'
+
+    def _write(self, path: Path, save) -> None:
+        tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        try:
+            save(tmp)
+            os.replace(tmp, path)
+        except Exception as exc:
+            tmp.unlink(missing_ok=True)
+            _log.warning('Failed to write model cache %s: %s', path.name, exc)
+            return
+        self._prune(path)
+
+    def _prune(self, latest: Path) -> None:
+        kind = latest.name.split('-', 1)[0]
+        entries = sorted(
+            self.directory.glob(f'{kind}-*{latest.suffix}'),
+            key=lambda p: p.stat().st_mtime,
+            reverse=True,
+        )
+        for path in entries[KEEP_PER_KIND:]:
+            path.unlink(missing_ok=True)
+
+    def load_state(self, kind: str, key: str, device: str) -> Optional[Dict[str, torch.Tensor]]:
+        path = self._path(kind, key, '.pt')
+        if not path.is_file():
+            return None
+        try:
+            return torch.load(path, map_location=device, mmap=True, weights_only=True)
+        except Exception as exc:
+            _log.warning('Broken model cache entry %s, ignoring: %s', path.name, exc)
+            return None
+
+    def save_state(self, kind: str, key: str, state: Dict[str, torch.Tensor]) -> None:
+        self._write(self._path(kind, key, '.pt'), lambda tmp: torch.save(state, tmp))
+
+    def load_script(self, kind: str, key: str, device: str) -> Optional[nn.Module]:
+        path = self._path(kind, key, '.ts')
+        if not path.is_file():
+            return None
+        try:
+            return torch.jit.load(str(path), map_location=device)
+        except Exception as exc:
+            _log.warning('Broken model cache entry %s, ignoring: %s', path.name, exc)
+            return None
+
+    def save_script(self, kind: str, key: str, module: nn.Module) -> None:
+        self._write(self._path(kind, key, '.ts'), lambda tmp: torch.jit.save(module, str(tmp)))
+
+    def enable_compile_cache(self) -> None:
+        """Графы torch.compile переживают перезапуск (FX graph cache inductor)."""
+        os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', str(self.directory / 'inductor'))
+        os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
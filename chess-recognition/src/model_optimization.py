@@ -0,0 +1,148 @@
+"""
+Оптимизация моделей при загрузке воркера.
+
+Режимы (--optimize-models / CV_OPTIMIZE_MODELS):
+  off     — eager-модели как есть;
+  fuse    — Conv+BN слиты (torch.fx), веса и вход в channels-last;
+  trace   — fuse + TorchScript trace и freeze;
+  compile — fuse + torch.compile.
+
+Оптимизированный граф сверяется с eager на пробном входе; при ошибке или
+расхождении больше OPTIMIZE_ATOL остаётся eager. YOLO Conv+BN сливает сам
+ultralytics (AutoBackend при первом predict), поэтому при любом режиме,
+кроме off, сеть YOLO получает только channels-last; сверка идёт с
+выходом исходной, ещё не слитой сети и покрывает оба изменения.
+Выигрыш по времени пишется в лог.
+"""
+from __future__ import annotations
+
+import os
+import statistics
+import time
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from worker_logging import get_logger
+
+OPTIMIZE_MODES = ('off', 'fuse', 'trace', 'compile')
+DEFAULT_OPTIMIZE_MODE = os.environ.get('CV_OPTIMIZE_MODELS', 'off')
+# Допустимое расхождение выходов (координаты углов нормированы в [0, 1])
+OPTIMIZE_ATOL = 1e-4
+_TIMING_RUNS = 5
+
+_log = get_logger('models')
+
+
+def _median_ms(run: Callable[[], object]) -> float:
+    samples = []
+    for _ in range(_TIMING_RUNS):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(samples)
+
+
+def _first_tensor(output) -> torch.Tensor:
+    # YOLO в eval возвращает (предсказания, промежуточные карты)
+    return output[0] if isinstance(output, (tuple, list)) else output
+
+
+def _build(model: nn.Module, sample: torch.Tensor, mode: str) -> nn.Module:
+    from torch.fx.experimental.optimization import fuse
+
+    fused = fuse(model).to(memory_format=torch.channels_last)
+    if mode == 'trace':
+        with torch.inference_mode():
+            traced = torch.jit.trace(fused, sample)
+        return torch.jit.freeze(traced.eval())
+    if mode == 'compile':
+        return torch.compile(fused)
+    return fused
+
+
+def optimize_corner_model(model: nn.Module, img_size: int, device: str, mode: str) -> Tuple[nn.Module, Dict]:
+    """
+    Возвращает (модель, отчёт). Модель — оптимизированная, если она
+    совпала с eager на пробном входе, иначе исходная.
+    """
+    report: Dict = {'mode': mode}
+    if mode == 'off':
+        return model, report
+
+    sample = torch.rand(1, 3, img_size, img_size, device=device).contiguous(memory_format=torch.channels_last)
+    with torch.inference_mode():
+        reference = model(sample)
+        report['eager_ms'] = round(_median_ms(lambda: model(sample)), 2)
+
+    try:
+        optimized = _build(model, sample, mode)
+        with torch.inference_mode():
+            # первый вызов — прогрев (для compile здесь и происходит компиляция)
+            output = optimized(sample)
+            diff = float((output - reference).abs().max())
+            report['max_abs_diff'] = diff
+            if diff > OPTIMIZE_ATOL:
+                raise ValueError(f'output mismatch {diff:.2e} > {OPTIMIZE_ATOL:.0e}')
+            report['optimized_ms'] = round(_median_ms(lambda: optimized(sample)), 2)
+    except Exception as exc:
+        _log.warning('Corner model optimization (%s) failed, using eager: %s', mode, exc)
+        report['fallback'] = str(exc)
+        return model, report
+
+    report['speedup'] = round(report['eager_ms'] / max(report['optimized_ms'], 1e-6), 2)
+    _log.info(
+        'Corner model optimized (%s): %.1f ms -> %.1f ms (x%.2f), max diff %.1e',
+        mode, report['eager_ms'], report['optimized_ms'], report['speedup'], report['max_abs_diff'],
+    )
+    return optimized, report
+
+
+def optimize_yolo(detector, mode: str, img_size: int = 640) -> Dict:
+    """
+    Channels-last для сети внутри ultralytics. Эталонный выход снимается
+    до первого predict, то есть до слияния Conv+BN в AutoBackend, так что
+    сверка проверяет и fuse ultralytics, и channels-last. Замеры predict
+    заодно прогревают предиктор до первого кадра сессии.
+    """
+    report: Dict = {'mode': 'channels_last' if mode != 'off' else 'off'}
+    if mode == 'off':
+        return report
+
+    net = detector.model.model
+    device = next(net.parameters()).device
+    sample = torch.rand(1, 3, img_size, img_size, device=device)
+    with detector._lock, torch.inference_mode():
+        net.eval()
+        reference = _first_tensor(net(sample))
+
+    blank = np.zeros((img_size, img_size, 3), dtype=np.uint8)
+    report['eager_ms'] = round(_median_ms(lambda: detector.predict(blank)), 2)
+    # предиктор мог перенести сеть на своё устройство
+    device = next(net.parameters()).device
+    sample, reference = sample.to(device), reference.to(device)
+    try:
+        with detector._lock:
+            with torch.inference_mode():
+                net.to(memory_format=torch.channels_last)
+                output = _first_tensor(net(sample.contiguous(memory_format=torch.channels_last)))
+        diff = float((output - reference).abs().max())
+        report['max_abs_diff'] = diff
+        # выход YOLO в пикселях входа — допуск относительный
+        if diff > OPTIMIZE_ATOL * max(float(reference.abs().max()), 1.0):
+            raise ValueError(f'output mismatch {diff:.2e}')
+    except Exception as exc:
+        net.to(memory_format=torch.contiguous_format)
+        _log.warning('YOLO optimization failed, using eager: %s', exc)
+        report['fallback'] = str(exc)
+        return report
+
+    report['optimized_ms'] = round(_median_ms(lambda: detector.predict(blank)), 2)
+    report['speedup'] = round(report['eager_ms'] / max(report['optimized_ms'], 1e-6), 2)
+    _log.info(
+        'YOLO optimized (channels-last): %.1f ms -> %.1f ms (x%.2f), max diff vs unfused %.1e',
+        report['eager_ms'], report['optimized_ms'], report['speedup'], report['max_abs_diff'],
+    )
+    return report
@@ -18,6 +18,14 @@ def corner_model_path() -> str:
     )
 
 
+def occupancy_model_path() -> str:
+    return os.environ.get('OCCUPANCY_MODEL_PATH') or str(MODELS_DIR / 'square_occupancy.json')
+
+
+def square_classifier_model_path() -> str:
+    return os.environ.get('SQUARE_CLASSIFIER_MODEL_PATH') or str(MODELS_DIR / 'square_classifier.pt')
+
+
 def hand_landmarker_model_path() -> str:
     env = os.environ.get('HAND_LANDMARKER_MODEL')
     if env and Path(env).is_file():
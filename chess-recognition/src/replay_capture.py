@@ -0,0 +1,167 @@
+"""
+Воспроизведение файла захвата (inference_worker.py --record) на свежем воркере.
+
+Команды register/frame/unregister подаются в stdin inference_worker.py с
+исходными интервалами (--speed 1), ускоренно (--speed 4) или без пауз
+(--speed 0). Как и Node, в полёте держится один кадр: следующий
+отправляется после frame_result предыдущего. Полученные frame_result
+сравниваются с записанными по полям DIFF_FIELDS.
+
+Пример:
+    python src/replay_capture.py capture.cccap --speed 0 --report replay.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker_capture import KIND_COMMAND, KIND_MAPPING, KIND_RESULT, CaptureReader
+from worker_client import RESULT_TIMEOUT_S, WorkerProcess
+from worker_metrics import LatencyHistogram
+
+# Поля frame_result, которые должны совпасть при детерминированном воспроизведении
+DIFF_FIELDS = (
+    'status',
+    'board_snapshot',
+    'board_state',
+    'tracks_count',
+    'history_frozen',
+    'hand_detected',
+    'detection_skipped',
+)
+
+
+def _diff(expected: Dict, actual: Dict) -> Dict:
+    return {
+        field: {'expected': expected.get(field), 'actual': actual.get(field)}
+        for field in DIFF_FIELDS
+        if expected.get(field) != actual.get(field)
+    }
+
+
+def replay(args: argparse.Namespace) -> Dict:
+    reader = CaptureReader(Path(args.capture))
+    mappings_dir = Path(args.mappings_dir or tempfile.mkdtemp(prefix='cv_replay_'))
+    mappings_dir.mkdir(parents=True, exist_ok=True)
+
+    worker_args = ['--mappings-dir', str(mappings_dir), '--log-level', args.log_level]
+    if args.yolo_model:
+        worker_args += ['--yolo-model', args.yolo_model]
+    if args.corner_model:
+        worker_args += ['--corner-model', args.corner_model]
+    worker = WorkerProcess(worker_args)
+
+    # Записанные результаты идут в файле после своих кадров — собираем их заранее
+    expected: Dict[str, Deque[Dict]] = defaultdict(deque)
+    for record in reader:
+        if record.kind == KIND_RESULT:
+            expected[record.msg.get('token')].append(record.msg)
+    latency = LatencyHistogram()
+    mismatches: List[Dict] = []
+    frames = 0
+    compared = 0
+
+    try:
+        worker.wait_event('ready', args.ready_timeout)
+        started = time.perf_counter()
+        first_t: Optional[float] = None
+
+        for record in reader:
+            if record.kind == KIND_MAPPING:
+                (mappings_dir / f"{record.msg['token']}_mapping.json").write_bytes(record.payload)
+                continue
+            if record.kind != KIND_COMMAND:
+                continue
+
+            msg = record.msg
+            if first_t is None:
+                first_t = record.t
+            if args.speed > 0:
+                delay = (record.t - first_t) / args.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            cmd = msg.get('cmd')
+            if cmd == 'frame':
+                if args.limit and frames >= args.limit:
+                    break
+                sent = time.perf_counter()
+                worker.send(msg, record.payload)
+                result = worker.wait_event('frame_result', RESULT_TIMEOUT_S)
+                latency.record(time.perf_counter() - sent)
+                frames += 1
+                pending = expected.get(msg['token'])
+                if not pending:
+                    continue
+                recorded = pending.popleft()
+                compared += 1
+                diff = _diff(recorded, result)
+                if diff:
+                    mismatches.append({'token': msg['token'], 'seq': msg.get('seq'), 'frame': frames - 1, 'diff': diff})
+            elif cmd == 'register':
+                worker.send(msg)
+                worker.wait_event('registered', RESULT_TIMEOUT_S)
+            elif cmd == 'unregister':
+                worker.send(msg)
+                worker.wait_event('unregistered', RESULT_TIMEOUT_S)
+        wall = time.perf_counter() - started
+    finally:
+        worker.close()
+        reader.close()
+
+    return {
+        'capture': str(args.capture),
+        'speed': args.speed,
+        'frames': frames,
+        'compared': compared,
+        'mismatches': len(mismatches),
+        'wall_s': round(wall, 3),
+        'fps': round(frames / wall, 2) if wall else 0.0,
+        'round_trip': latency.summary(),
+        'diffs': mismatches[:args.max_diffs],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Воспроизведение захвата протокола CV-воркера')
+    parser.add_argument('capture', help='Файл, записанный inference_worker.py --record')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Множитель скорости: 1 — исходные интервалы, 0 — без пауз')
+    parser.add_argument('--limit', type=int, default=None, help='Не больше N кадров')
+    parser.add_argument('--mappings-dir', default=None, help='Куда класть маппинги из захвата')
+    parser.add_argument('--yolo-model', default=None)
+    parser.add_argument('--corner-model', default=None)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--ready-timeout', type=float, default=120.0)
+    parser.add_argument('--max-diffs', type=int, default=50, help='Сколько расхождений класть в отчёт')
+    parser.add_argument('--report', default=None, help='JSON с результатами воспроизведения')
+    parser.add_argument('--strict', action='store_true', help='Код выхода 1 при любом расхождении')
+    args = parser.parse_args()
+
+    report = replay(args)
+    rt = report['round_trip']
+    print(f"frames={report['frames']} compared={report['compared']} mismatches={report['mismatches']} "
+          f"fps={report['fps']} p50={rt.get('p50_ms')}ms p95={rt.get('p95_ms')}ms")
+    for item in report['diffs'][:10]:
+        print(f"DIFF: {item['token']} frame={item['frame']} seq={item['seq']} {json.dumps(item['diff'], ensure_ascii=False)}")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f'Saved: {args.report}')
+
+    if args.strict and report['mismatches']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
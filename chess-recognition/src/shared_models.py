@@ -3,15 +3,21 @@
 """
 from __future__ import annotations
 
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
+import cv2
+import numpy as np
 import torch
 import torch.nn as nn
 from torchvision import models
 
+from model.square_classifier import SquareCropClassifier
 from model.yolo11_detector import YOLO11Detector
+from model_cache import ModelCache
+from model_optimization import optimize_corner_model, optimize_yolo
 
 
 class CornerRegressor(nn.Module):
@@ -38,12 +44,56 @@ class CornerRegressor(nn.Module):
         return torch.sigmoid(self.backbone(x))
 
 
+# Нормализация ImageNet, с которой обучался CornerRegressor
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class CornerPreprocessor:
+    """
+    BGR-кадр -> нормализованный вход CornerRegressor (1, 3, S, S) без PIL.
+
+    Ресайз через cv2, затем BGR->RGB и (x / 255 - mean) / std одной парой
+    numpy-операций прямо в заранее выделенный channels-last тензор.
+    Буфер переиспользуется: результат действителен до следующего вызова
+    (калибровки идут в одном потоке).
+    """
+
+    def __init__(self, img_size: int, device: str = 'cpu'):
+        self.img_size = img_size
+        self.device = device
+        self._input = torch.empty((1, 3, img_size, img_size), dtype=torch.float32).contiguous(
+            memory_format=torch.channels_last,
+        )
+        # в channels-last памяти это непрерывный массив (S, S, 3)
+        self._hwc = self._input.permute(0, 2, 3, 1)[0].numpy()
+        std = np.array(IMAGENET_STD, dtype=np.float32)
+        self._scale = 1.0 / (255.0 * std)
+        self._shift = np.array(IMAGENET_MEAN, dtype=np.float32) / std
+
+    def __call__(self, image: np.ndarray) -> torch.Tensor:
+        height, width = image.shape[:2]
+        size = self.img_size
+        # Апскейл маленького кропа — LANCZOS4, уменьшение — INTER_AREA
+        interpolation = cv2.INTER_LANCZOS4 if max(height, width) < size else cv2.INTER_AREA
+        resized = cv2.resize(image, (size, size), interpolation=interpolation)
+        np.multiply(resized[:, :, ::-1], self._scale, out=self._hwc, casting='unsafe')
+        np.subtract(self._hwc, self._shift, out=self._hwc)
+        if self.device == 'cpu':
+            return self._input
+        return self._input.to(self.device, non_blocking=True)
+
+
 @dataclass
 class CornerModelBundle:
     model: nn.Module
     device: str
     img_size: int
     model_name: str
+    preprocess: CornerPreprocessor = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.preprocess = CornerPreprocessor(self.img_size, self.device)
 
 
 class SharedInferenceModels:
@@ -52,33 +102,113 @@ class SharedInferenceModels:
         self.corner: Optional[CornerModelBundle] = None
         self.yolo_path: Optional[str] = None
         self.corner_path: Optional[str] = None
+        # Движок squares (model.square_classifier); грузится только по запросу сессии
+        self.squares: Optional[SquareCropClassifier] = None
+        self.squares_path: Optional[str] = None
+        # Время загрузки моделей в секундах (для метрик воркера)
+        self.load_seconds: Dict[str, float] = {}
+        # Отчёты model_optimization по моделям (eager_ms, optimized_ms, fallback)
+        self.optimization: Dict[str, Dict] = {}
 
-    def load(self, yolo_path: str, corner_path: str, img_size: int = 640) -> None:
-        if self.yolo is None or self.yolo_path != yolo_path:
-            self.yolo = YOLO11Detector(yolo_path)
-            self.yolo_path = yolo_path
+    def load(
+        self,
+        yolo_path: str,
+        corner_path: str,
+        img_size: int = 640,
+        optimize: str = 'off',
+        cache: Optional[ModelCache] = None,
+    ) -> None:
+        """
+        optimize — режим из model_optimization.OPTIMIZE_MODES;
+        cache — кеш весов ResNet (mmap state_dict, TorchScript для trace)
+        """
+        self.load_yolo(yolo_path, optimize)
+        self.load_corner(corner_path, img_size, optimize, cache)
 
+    def load_yolo(self, yolo_path: str, optimize: str = 'off') -> None:
+        if self.yolo is not None and self.yolo_path == yolo_path:
+            return
+        started = time.perf_counter()
+        detector = YOLO11Detector(yolo_path)
+        self.optimization['yolo'] = optimize_yolo(detector, optimize)
+        if optimize == 'off':
+            # прогрев: подготовка предиктора ultralytics не должна ложиться на первый кадр
+            detector.predict(np.zeros((640, 640, 3), dtype=np.uint8))
+        self.yolo = detector
+        self.yolo_path = yolo_path
+        self.load_seconds['yolo'] = time.perf_counter() - started
+
+    def load_squares(self, squares_path: str) -> None:
+        if self.squares is not None and self.squares_path == squares_path:
+            return
+        if not Path(squares_path).exists():
+            raise FileNotFoundError(f'Square classifier not found: {squares_path}')
+        started = time.perf_counter()
+        classifier = SquareCropClassifier.load(Path(squares_path))
+        # прогрев: выделение буферов и выбор алгоритмов свёрток не на первом кадре
+        classifier.classify(np.zeros((640, 640, 3), dtype=np.uint8))
+        self.squares = classifier
+        self.squares_path = squares_path
+        self.load_seconds['squares'] = time.perf_counter() - started
+
+    def load_corner(
+        self,
+        corner_path: str,
+        img_size: int = 640,
+        optimize: str = 'off',
+        cache: Optional[ModelCache] = None,
+    ) -> None:
         corner_file = Path(corner_path)
         if not corner_file.exists():
             raise FileNotFoundError(f'Corner model not found: {corner_path}')
+        if self.corner is not None and self.corner_path == corner_path:
+            return
 
-        if self.corner is None or self.corner_path != corner_path:
-            model_name = 'resnet34'
-            lower = corner_path.lower()
-            if 'resnet18' in lower:
-                model_name = 'resnet18'
-            elif 'resnet50' in lower:
-                model_name = 'resnet50'
+        started = time.perf_counter()
+        model_name = 'resnet34'
+        lower = corner_path.lower()
+        if 'resnet18' in lower:
+            model_name = 'resnet18'
+        elif 'resnet50' in lower:
+            model_name = 'resnet50'
 
-            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        model = None
+        if cache is not None:
+            if optimize == 'compile':
+                cache.enable_compile_cache()
+            state_key = cache.key(corner_path, model=model_name, device=device)
+            script_key = cache.key(corner_path, model=model_name, device=device, img_size=img_size, mode=optimize)
+            if optimize == 'trace':
+                # TorchScript из кеша уже сверен с eager при записи
+                model = cache.load_script('corner', script_key, device)
+                if model is not None:
+                    self.optimization['corner'] = {'mode': optimize, 'cached': True}
+        if model is None:
+            state = cache.load_state('corner', state_key, device) if cache is not None else None
+            if state is None:
+                state = torch.load(corner_path, map_location=device)
+                if cache is not None:
+                    cache.save_state('corner', state_key, state)
             model = CornerRegressor(model_name=model_name, pretrained=False)
-            model.load_state_dict(torch.load(corner_path, map_location=device))
+            if cache is not None:
+                # assign: параметры остаются отображёнными из файла кеша, без копии
+                model.load_state_dict(state, assign=True)
+            else:
+                model.load_state_dict(state)
             model.to(device)
             model.eval()
-            self.corner = CornerModelBundle(
-                model=model,
-                device=device,
-                img_size=img_size,
-                model_name=model_name,
-            )
-            self.corner_path = corner_path
+            model, self.optimization['corner'] = optimize_corner_model(model, img_size, device, optimize)
+            if cache is not None and optimize == 'trace' and 'fallback' not in self.optimization['corner']:
+                cache.save_script('corner', script_key, model)
+        bundle = CornerModelBundle(
+            model=model,
+            device=device,
+            img_size=img_size,
+            model_name=model_name,
+        )
+        with torch.inference_mode():
+            bundle.model(bundle.preprocess(np.zeros((img_size, img_size, 3), dtype=np.uint8)))
+        self.corner = bundle
+        self.corner_path = corner_path
+        self.load_seconds['corner'] = time.perf_counter() - started
@@ -2,9 +2,10 @@
 Сервер для обработки потока кадров в реальном времени
 """
 import argparse
+import logging
 import sys
-import json
 import os
+import time
 import warnings
 from pathlib import Path
 
@@ -15,7 +16,24 @@ warnings.filterwarnings('ignore', message='.*pkg_resources.*')
 # Добавление пути к модулям
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from model.stream_processor import StreamProcessor
+from worker_framing import FrameReader
+from worker_logging import DEFAULT_LOG_LEVEL, configure_logging, get_logger, log_sampled
+from worker_output import SERIALIZERS, OutputWriter
+
+_startup_log = get_logger('startup')
+_stdin_log = get_logger('stdin')
+_frame_log = get_logger('frame')
+_detection_log = get_logger('detection')
+
+
+class _ClassesSummary:
+    """Ленивая строка 'класс: количество' — собирается только при записи в лог."""
+
+    def __init__(self, classes):
+        self.classes = classes
+
+    def __str__(self):
+        return ', '.join(f'{cls}: {count}' for cls, count in self.classes.items())
 
 
 def main():
@@ -23,84 +41,87 @@ def main():
     parser.add_argument('--token', required=True, help='Токен игры')
     parser.add_argument('--model', required=True, help='Путь к модели YOLO 11')
     parser.add_argument('--mappings-dir', default='./chessboard_mappings', help='Директория для маппингов')
+    parser.add_argument('--serializer', choices=SERIALIZERS, default='auto', help='Сериализатор результатов в stdout')
+    parser.add_argument('--log-level', default=DEFAULT_LOG_LEVEL, help='Уровень логирования в stderr')
     
     args = parser.parse_args()
+    configure_logging(args.log_level)
     
     mappings_dir = Path(args.mappings_dir)
     
     # Инициализация обработчика потока
-    # Тестовый лог для проверки stderr
-    import sys
-    print(f"🚀 [STARTUP] Starting stream server for token {args.token}, model: {args.model}", file=sys.stderr, flush=True)
+    _startup_log.info('Starting stream server for token %s, model: %s', args.token, args.model)
     
+    output = OutputWriter(serializer=args.serializer)
+
     try:
+        # Тяжёлые импорты (torch, ultralytics, mediapipe) — только после разбора
+        # аргументов: --help и ошибки аргументов их не ждут
+        import cv2
+        import numpy as np
+        from model.stream_processor import StreamProcessor
+
         processor = StreamProcessor(
             model_path=args.model,
             game_token=args.token,
             mapping_dir=mappings_dir,
             on_move_detected=lambda move, board_state: None
         )
-        print(f"✅ [STARTUP] StreamProcessor initialized successfully", file=sys.stderr, flush=True)
+        _startup_log.info('StreamProcessor initialized successfully')
     except FileNotFoundError as e:
         error_msg = f"File not found: {str(e)}. Make sure the model file exists or the system will use a pretrained model."
-        print(json.dumps({'status': 'error', 'message': error_msg}), flush=True)
+        output.emit({'status': 'error', 'message': error_msg})
+        output.close()
         sys.exit(1)
     except ValueError as e:
         # Ошибка маппинга
         error_msg = str(e)
-        print(json.dumps({'status': 'error', 'message': error_msg}), flush=True)
+        output.emit({'status': 'error', 'message': error_msg})
+        output.close()
         sys.exit(1)
     except Exception as e:
         error_msg = f"Initialization error: {str(e)}"
-        print(json.dumps({'status': 'error', 'message': error_msg}), flush=True)
+        output.emit({'status': 'error', 'message': error_msg})
+        output.close()
         sys.exit(1)
     
     # Обработка кадров из stdin (бинарные данные)
+    MAX_FRAME_SIZE = 10 * 1024 * 1024  # 10MB
+    reader = FrameReader(sys.stdin.buffer)
     frame_count = 0
     try:
         while True:
             # Читаем длину кадра (4 байта)
-            length_bytes = sys.stdin.buffer.read(4)
-            if not length_bytes or len(length_bytes) != 4:
-                print(f"[STDIN] No more data or incomplete length bytes: {len(length_bytes) if length_bytes else 0}", file=sys.stderr, flush=True)
+            length_bytes = reader.read_exact(4)
+            if length_bytes is None:
+                _stdin_log.info('No more data or incomplete length bytes: %d', reader.buffered)
                 break
             
             frame_length = int.from_bytes(length_bytes, byteorder='big')
             
             # Проверка валидности длины кадра (максимум 10MB)
-            MAX_FRAME_SIZE = 10 * 1024 * 1024  # 10MB
             if frame_length > MAX_FRAME_SIZE or frame_length <= 0:
-                print(f"[STDIN] Invalid frame length: {frame_length} bytes (max {MAX_FRAME_SIZE}), skipping...", file=sys.stderr, flush=True)
-                # Пытаемся восстановить синхронизацию - пропускаем этот кадр
-                # Читаем и выбрасываем следующие 4 байта, надеясь что это начало следующего кадра
-                sys.stdin.buffer.read(4)
+                _stdin_log.warning('Invalid frame length: %d bytes (max %d), skipping...', frame_length, MAX_FRAME_SIZE)
+                # Пропускаем тело кадра целиком — следующий префикс длины начинается сразу за ним
+                reader.skip(frame_length)
                 continue
             
-            print(f"[STDIN] Received frame length: {frame_length} bytes", file=sys.stderr, flush=True)
-            
-            # Читаем сам кадр
-            frame_data = b''
-            while len(frame_data) < frame_length:
-                chunk = sys.stdin.buffer.read(frame_length - len(frame_data))
-                if not chunk:
-                    print(f"[STDIN] Incomplete frame data: got {len(frame_data)}/{frame_length} bytes", file=sys.stderr, flush=True)
-                    break
-                frame_data += chunk
+            _stdin_log.debug('Received frame length: %d bytes', frame_length)
             
-            if len(frame_data) != frame_length:
-                print(json.dumps({'status': 'error', 'message': 'Incomplete frame data'}), flush=True)
-                continue
+            # Сам кадр — memoryview на буфер reader, без копирования
+            frame_data = reader.read_exact(frame_length)
+            if frame_data is None:
+                _stdin_log.warning('Incomplete frame data: got %d/%d bytes', reader.buffered, frame_length)
+                output.emit({'status': 'error', 'message': 'Incomplete frame data'})
+                break
             
             try:
                 # Декодируем изображение из бинарных данных
-                import cv2
-                import numpy as np
-                
                 nparr = np.frombuffer(frame_data, np.uint8)
                 frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
                 
                 if frame is None:
-                    print(json.dumps({'status': 'error', 'message': 'Failed to decode image'}), flush=True)
+                    output.emit({'status': 'error', 'message': 'Failed to decode image'})
                     continue
                 
                 # Логируем размер изображения в терминал (периодически, чтобы не спамить)
@@ -108,7 +129,6 @@ def main():
                     processor._last_size_log_time = 0
                     processor._last_size = None
                 
-                import time
                 current_time = time.time()
                 h, w = frame.shape[:2]
                 current_size = f"{w}x{h}"
@@ -116,34 +136,36 @@ def main():
                 # Логируем при первом кадре или если размер изменился, или раз в 5 секунд
                 if (processor._last_size != current_size or 
                     current_time - processor._last_size_log_time > 5):
-                    print(f"[FRAME] Image size: {w}x{h}, data size: {len(frame_data)} bytes", 
-                          file=sys.stderr, flush=True)
+                    _frame_log.info('Image size: %dx%d, data size: %d bytes', w, h, len(frame_data))
                     processor._last_size = current_size
                     processor._last_size_log_time = current_time
                 
-                # Логируем обработку каждого кадра
                 frame_count += 1
-                print(f"[FRAME] Processing frame #{frame_count} {w}x{h}...", file=sys.stderr, flush=True)
+                _frame_log.debug('Processing frame #%d %dx%d...', frame_count, w, h)
                 result = processor.process_frame(frame)
                 
-                # Логируем результат детекции
-                if result.get('detections_info'):
+                # Логируем результат детекции (не чаще раза в интервал сэмплирования)
+                if result.get('detections_info') and _detection_log.isEnabledFor(logging.INFO):
                     det_info = result['detections_info']
                     total = det_info.get('total_detections', 0)
                     if total > 0:
-                        classes_str = ', '.join([f"{cls}: {count}" for cls, count in det_info.get('classes_detected', {}).items()])
-                        print(f"[DETECTION] Found {total} pieces: {classes_str}", file=sys.stderr, flush=True)
+                        log_sampled(
+                            _detection_log, logging.INFO, args.token,
+                            'Found %d pieces: %s', total, _ClassesSummary(det_info.get('classes_detected', {})),
+                        )
                     else:
-                        print(f"[DETECTION] No pieces detected", file=sys.stderr, flush=True)
+                        log_sampled(_detection_log, logging.INFO, args.token, 'No pieces detected')
                 
-                print(json.dumps(result), flush=True)
+                output.emit(result)
             except Exception as e:
-                print(json.dumps({'status': 'error', 'message': str(e)}), flush=True)
+                output.emit({'status': 'error', 'message': str(e)})
     except KeyboardInterrupt:
         pass
     except Exception as e:
-        print(json.dumps({'status': 'error', 'message': str(e)}), flush=True)
+        output.emit({'status': 'error', 'message': str(e)})
+        output.close()
         sys.exit(1)
+    output.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,391 @@
+"""
+Синтетические кадры доски по FEN/PGN для бенчмарков и тестов без камеры.
+
+Фигуры вырезаются по YOLO-разметке из merged_new/train и накладываются
+на нарисованную доску (вид сверху, a1 внизу слева). Затем доска
+переносится на фон случайной гомографией с неравномерным освещением,
+размытием и шумом. Камера в пределах партии неподвижна (одна гомография),
+освещение и шум меняются от кадра к кадру. Всё детерминировано seed.
+
+Для каждого кадра известны углы доски, фигуры по клеткам и FEN; рядом
+пишется маппинг в формате map_chessboard и, по желанию, файл захвата
+для replay_capture.py / load_generator.py.
+
+Пример:
+    python src/synthetic_board.py --pgn game.pgn --out synthetic/game1 --capture synthetic/game1.cccap
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import chess
+import chess.pgn
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_paths import CHESS_RECOGNITION_ROOT
+from worker_capture import CaptureWriter
+
+# Классы merged_new/data.yaml -> символы фигур
+CLASS_TO_SYMBOL = {
+    0: 'P', 1: 'R', 2: 'B', 3: 'N', 4: 'K', 5: 'Q',
+    6: 'p', 7: 'r', 8: 'b', 9: 'k', 10: 'q', 11: 'n',
+}
+DEFAULT_PIECE_SOURCE = CHESS_RECOGNITION_ROOT / 'merged_new' / 'train'
+# Размер warped-изображения в маппинге (как OUTPUT_IMAGE_SIZE в improved_board_mapping)
+WARPED_SIZE = (640, 640)
+BOARD_PX = 640
+BOARD_MARGIN = 48
+MIN_CROP_PX = 24
+
+
+class PieceBank:
+    """Вырезки фигур из размеченных фотографий, по символу фигуры."""
+
+    def __init__(
+        self,
+        source: Path = DEFAULT_PIECE_SOURCE,
+        *,
+        max_images: int = 300,
+        max_per_symbol: int = 40,
+        seed: int = 0,
+    ):
+        self.crops: Dict[str, List[np.ndarray]] = {symbol: [] for symbol in CLASS_TO_SYMBOL.values()}
+        images_dir, labels_dir = source / 'images', source / 'labels'
+        if not images_dir.is_dir():
+            raise FileNotFoundError(f'Piece source not found: {images_dir}')
+
+        rng = np.random.default_rng(seed)
+        images = sorted(images_dir.iterdir())
+        rng.shuffle(images)
+        for image_path in images[:max_images]:
+            if all(len(c) >= max_per_symbol for c in self.crops.values()):
+                break
+            label = labels_dir / f'{image_path.stem}.txt'
+            if not label.is_file():
+                continue
+            image = cv2.imread(str(image_path))
+            if image is None:
+                continue
+            height, width = image.shape[:2]
+            for line in label.read_text().splitlines():
+                parts = line.split()
+                if len(parts) != 5:
+                    continue
+                symbol = CLASS_TO_SYMBOL.get(int(parts[0]))
+                if symbol is None or len(self.crops[symbol]) >= max_per_symbol:
+                    continue
+                cx, cy, w, h = (float(v) for v in parts[1:])
+                x0, x1 = int((cx - w / 2) * width), int((cx + w / 2) * width)
+                y0, y1 = int((cy - h / 2) * height), int((cy + h / 2) * height)
+                x0, y0 = max(0, x0), max(0, y0)
+                if x1 - x0 < MIN_CROP_PX or y1 - y0 < MIN_CROP_PX:
+                    continue
+                self.crops[symbol].append(image[y0:y1, x0:x1].copy())
+
+        missing = [symbol for symbol, crops in self.crops.items() if not crops]
+        if missing:
+            raise ValueError(f'No crops for pieces: {"".join(missing)}')
+
+    def pick(self, symbol: str, rng: np.random.Generator) -> np.ndarray:
+        crops = self.crops[symbol]
+        return crops[int(rng.integers(len(crops)))]
+
+
+@dataclass
+class RenderedFrame:
+    image: np.ndarray
+    # углы игрового поля в кадре: a8, h8, h1, a1 (по часовой, начиная с левого верхнего)
+    corners: np.ndarray
+    squares: Dict[str, str]
+    fen: str
+
+
+def _soft_mask(height: int, width: int) -> np.ndarray:
+    """Эллиптическая маска с размытым краем: фон вырезки не даёт жёсткой рамки."""
+    mask = np.zeros((height, width), dtype=np.float32)
+    cv2.ellipse(mask, (width // 2, height // 2), (max(1, width // 2 - 2), max(1, height // 2 - 2)), 0, 0, 360, 1.0, -1)
+    k = max(3, (min(height, width) // 6) | 1)
+    return cv2.GaussianBlur(mask, (k, k), 0)[..., None]
+
+
+def mapping_for_corners(corners: np.ndarray, game_token: str) -> Dict:
+    """Маппинг в формате map_chessboard по известным углам доски."""
+    width, height = WARPED_SIZE
+    dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners.astype(np.float32), dst)
+    step_x, step_y = width / 8, height / 8
+    grid = [[[j * step_x, i * step_y] for j in range(9)] for i in range(9)]
+    return {
+        'success': True,
+        'game_token': game_token,
+        'synthetic': 'render',
+        'board_corners': corners.tolist(),
+        'perspective_matrix': matrix.tolist(),
+        'warped_image_shape': [height, width, 3],
+        'square_corners': grid,
+    }
+
+
+class SyntheticBoardRenderer:
+    """Рендер позиций одной «камерой»: гомография фиксируется при создании."""
+
+    def __init__(
+        self,
+        bank: PieceBank,
+        *,
+        frame_size: Tuple[int, int] = (1280, 720),
+        seed: int = 0,
+        blur: bool = True,
+        noise: float = 4.0,
+    ):
+        self.bank = bank
+        self.frame_size = frame_size
+        self.seed = seed
+        self.blur = blur
+        self.noise = noise
+        rng = np.random.default_rng(seed)
+
+        light = rng.uniform(150, 220, size=3)
+        self.light_square = light
+        self.dark_square = light * rng.uniform(0.45, 0.65)
+        self.frame_color = light * rng.uniform(0.25, 0.4)
+        self.background = self._background(rng)
+        self.homography, self.corners = self._camera(rng)
+
+    def _background(self, rng: np.random.Generator) -> np.ndarray:
+        width, height = self.frame_size
+        base = rng.uniform(40, 200, size=3)
+        gradient = np.linspace(0.7, 1.2, width, dtype=np.float32)[None, :, None]
+        background = np.ones((height, width, 3), dtype=np.float32) * base * gradient
+        background += rng.normal(0, 6, size=background.shape)
+        return cv2.GaussianBlur(background, (0, 0), 3)
+
+    def _camera(self, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """Случайный ракурс: наклон (верх доски уже низа), поворот, масштаб и сдвиг."""
+        width, height = self.frame_size
+        size = BOARD_PX + 2 * BOARD_MARGIN
+        board_h = height * rng.uniform(0.6, 0.85)
+        bottom_w = board_h * rng.uniform(1.0, 1.3)
+        top_w = bottom_w * rng.uniform(0.6, 0.9)
+        cx = width / 2 + rng.uniform(-0.08, 0.08) * width
+        cy = height / 2 + rng.uniform(-0.05, 0.05) * height
+        quad = np.array([
+            [-top_w / 2, -board_h / 2],
+            [top_w / 2, -board_h / 2],
+            [bottom_w / 2, board_h / 2],
+            [-bottom_w / 2, board_h / 2],
+        ], dtype=np.float32)
+        angle = np.deg2rad(rng.uniform(-8, 8))
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]], dtype=np.float32)
+        dst = quad @ rotation.T + np.array([cx, cy], dtype=np.float32)
+        src = np.array([[0, 0], [size, 0], [size, size], [0, size]], dtype=np.float32)
+        homography = cv2.getPerspectiveTransform(src, dst)
+
+        m = BOARD_MARGIN
+        field = np.array([[m, m], [m + BOARD_PX, m], [m + BOARD_PX, m + BOARD_PX], [m, m + BOARD_PX]], dtype=np.float32)
+        corners = cv2.perspectiveTransform(field[None], homography)[0]
+        return homography, corners
+
+    def _top_down(self, board: chess.Board, rng: np.random.Generator) -> np.ndarray:
+        size = BOARD_PX + 2 * BOARD_MARGIN
+        square = BOARD_PX // 8
+        canvas = np.empty((size, size, 3), dtype=np.float32)
+        canvas[:] = self.frame_color
+        for rank in range(8):
+            for file in range(8):
+                color = self.light_square if (rank + file) % 2 else self.dark_square
+                y = BOARD_MARGIN + (7 - rank) * square
+                x = BOARD_MARGIN + file * square
+                canvas[y:y + square, x:x + square] = color
+
+        # сверху вниз (от 8-й горизонтали к 1-й): ближние фигуры перекрывают дальние
+        for rank in range(7, -1, -1):
+            for file in range(8):
+                piece = board.piece_at(chess.square(file, rank))
+                if piece is None:
+                    continue
+                crop = self.bank.pick(piece.symbol(), rng)
+                width = int(square * rng.uniform(0.7, 0.85))
+                height = min(int(width * crop.shape[0] / crop.shape[1]), int(square * 1.6))
+                sprite = cv2.resize(crop, (width, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+                # основание фигуры — чуть выше нижнего края клетки
+                x0 = BOARD_MARGIN + file * square + (square - width) // 2
+                y1 = BOARD_MARGIN + (8 - rank) * square - square // 10
+                y0 = y1 - height
+                sy0 = max(0, -y0)
+                y0 = max(0, y0)
+                mask = _soft_mask(height, width)[sy0:]
+                region = canvas[y0:y1, x0:x0 + width]
+                region[:] = region * (1 - mask) + sprite[sy0:] * mask
+        return canvas
+
+    def render(self, board: chess.Board, index: int = 0) -> RenderedFrame:
+        rng = np.random.default_rng((self.seed, index))
+        top_down = self._top_down(board, rng)
+        width, height = self.frame_size
+
+        warped = cv2.warpPerspective(top_down, self.homography, (width, height), flags=cv2.INTER_LINEAR)
+        mask = cv2.warpPerspective(
+            np.ones(top_down.shape[:2], dtype=np.float32), self.homography, (width, height),
+        )[..., None]
+        image = self.background * (1 - mask) + warped * mask
+
+        # неравномерное освещение: линейный градиент в случайном направлении
+        angle = rng.uniform(0, 2 * np.pi)
+        xs = np.linspace(-1, 1, width, dtype=np.float32)[None, :]
+        ys = np.linspace(-1, 1, height, dtype=np.float32)[:, None]
+        gain = 1.0 + rng.uniform(0.05, 0.25) * (np.cos(angle) * xs + np.sin(angle) * ys)
+        image = image * gain[..., None] * rng.uniform(0.85, 1.1) + rng.uniform(-12, 12)
+
+        if self.blur:
+            sigma = rng.uniform(0.0, 1.4)
+            if sigma > 0.3:
+                image = cv2.GaussianBlur(image, (0, 0), sigma)
+        if self.noise > 0:
+            image = image + rng.normal(0, self.noise, size=image.shape)
+
+        squares = {chess.square_name(sq): piece.symbol() for sq, piece in board.piece_map().items()}
+        return RenderedFrame(
+            image=np.clip(image, 0, 255).astype(np.uint8),
+            corners=self.corners.copy(),
+            squares=squares,
+            fen=board.fen(),
+        )
+
+
+def positions_from_pgn(path: Path) -> List[Tuple[chess.Board, Optional[str]]]:
+    """Позиции партии: начальная и после каждого хода (с UCI этого хода)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        game = chess.pgn.read_game(f)
+    if game is None:
+        raise ValueError(f'No game in PGN: {path}')
+    board = game.board()
+    positions = [(board.copy(), None)]
+    for move in game.mainline_moves():
+        board.push(move)
+        positions.append((board.copy(), move.uci()))
+    return positions
+
+
+def positions_from_fens(fens: Iterable[str]) -> List[Tuple[chess.Board, Optional[str]]]:
+    return [(chess.Board(fen.strip()), None) for fen in fens if fen.strip()]
+
+
+def render_sequence(
+    renderer: SyntheticBoardRenderer,
+    positions: List[Tuple[chess.Board, Optional[str]]],
+    out_dir: Path,
+    *,
+    frames_per_position: int = 10,
+    fps: float = 10.0,
+    jpeg_quality: int = 85,
+    game_token: str = 'synthetic',
+    capture: Optional[Path] = None,
+) -> int:
+    """
+    Пишет кадры JPEG, labels.jsonl с эталоном и маппинг; с capture — файл
+    захвата (register, кадры с шагом 1/fps, unregister). Возвращает число кадров.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    mapping = mapping_for_corners(renderer.corners, game_token)
+    with open(out_dir / f'{game_token}_mapping.json', 'w', encoding='utf-8') as f:
+        json.dump(mapping, f, indent=2)
+
+    writer = CaptureWriter(capture) if capture is not None else None
+    if writer is not None:
+        writer.mapping(game_token, out_dir)
+        writer.command({'cmd': 'register', 'token': game_token}, t=0.0)
+
+    index = 0
+    with open(out_dir / 'labels.jsonl', 'w', encoding='utf-8') as labels:
+        for position, (board, move) in enumerate(positions):
+            for repeat in range(frames_per_position):
+                frame = renderer.render(board, index)
+                ok, encoded = cv2.imencode('.jpg', frame.image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+                if not ok:
+                    raise RuntimeError('JPEG encoding failed')
+                name = f'frame_{index:05d}.jpg'
+                (out_dir / name).write_bytes(encoded.tobytes())
+                labels.write(json.dumps({
+                    'frame': name,
+                    'index': index,
+                    'position': position,
+                    # ход, приведший к позиции, — только на первом её кадре
+                    'move': move if repeat == 0 else None,
+                    'fen': frame.fen,
+                    'corners': frame.corners.round(2).tolist(),
+                    'squares': frame.squares,
+                }, ensure_ascii=False) + '\n')
+                if writer is not None:
+                    payload = encoded.tobytes()
+                    writer.command(
+                        {'cmd': 'frame', 'token': game_token, 'length': len(payload), 'seq': index + 1},
+                        payload,
+                        t=index / fps,
+                    )
+                index += 1
+
+    if writer is not None:
+        writer.command({'cmd': 'unregister', 'token': game_token}, t=index / fps)
+        writer.close()
+    return index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Синтетические кадры шахматной доски по FEN/PGN')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--pgn', help='Партия PGN (кадры для каждой позиции)')
+    source.add_argument('--fen', nargs='+', help='Одна или несколько позиций FEN')
+    source.add_argument('--fen-file', help='Файл с FEN по одной на строку')
+    parser.add_argument('--out', required=True, help='Папка для кадров и labels.jsonl')
+    parser.add_argument('--frames-per-position', type=int, default=10)
+    parser.add_argument('--fps', type=float, default=10.0, help='Темп кадров в файле захвата')
+    parser.add_argument('--size', type=int, nargs=2, default=(1280, 720), metavar=('W', 'H'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-blur', action='store_true')
+    parser.add_argument('--noise', type=float, default=4.0, help='СКО гауссова шума')
+    parser.add_argument('--jpeg-quality', type=int, default=85)
+    parser.add_argument('--pieces-from', default=str(DEFAULT_PIECE_SOURCE), help='Датасет с YOLO-разметкой фигур')
+    parser.add_argument('--token', default='synthetic')
+    parser.add_argument('--capture', default=None, help='Записать также файл захвата для replay')
+    args = parser.parse_args()
+
+    if args.pgn:
+        positions = positions_from_pgn(Path(args.pgn))
+    elif args.fen:
+        positions = positions_from_fens(args.fen)
+    else:
+        positions = positions_from_fens(Path(args.fen_file).read_text(encoding='utf-8').splitlines())
+
+    bank = PieceBank(Path(args.pieces_from), seed=args.seed)
+    renderer = SyntheticBoardRenderer(
+        bank,
+        frame_size=tuple(args.size),
+        seed=args.seed,
+        blur=not args.no_blur,
+        noise=args.noise,
+    )
+    frames = render_sequence(
+        renderer,
+        positions,
+        Path(args.out),
+        frames_per_position=args.frames_per_position,
+        fps=args.fps,
+        jpeg_quality=args.jpeg_quality,
+        game_token=args.token,
+        capture=Path(args.capture) if args.capture else None,
+    )
+    print(f'Rendered {frames} frames ({len(positions)} positions) to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
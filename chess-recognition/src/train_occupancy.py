@@ -0,0 +1,122 @@
+"""
+Обучение классификатора занятости клеток (model/occupancy.py).
+
+Занятость всех 64 клеток берётся из разметки, перенесённой на
+выровненную доску (board_dataset.LabelledBoardSource). Каждый
+--val-every-й снимок откладывается для проверки. Отчёт: точность по
+клеткам и доля досок, где совпали все 64 клетки (от неё зависит, как
+часто режим gate сможет пропускать YOLO).
+
+Пример:
+    python src/train_occupancy.py --datasets merged_new/train merged_new/valid --output models/square_occupancy.json
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import warnings
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+warnings.filterwarnings('ignore', category=UserWarning)
+warnings.filterwarnings('ignore', message='.*pkg_resources.*')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from board_dataset import DEFAULT_TRAIN_DATASETS, MAPPING_MODES, LabelledBoardSource
+from improved_board_mapping import SQUARE_COUNT
+from model.occupancy import OccupancyClassifier, board_features, square_colors, square_feature_matrix
+from model_paths import occupancy_model_path
+from worker_logging import configure_logging
+
+
+def collect(args: argparse.Namespace) -> Tuple[List[Dict], int]:
+    """Строки признаков по снимкам: [{'x', 'y', 'colors', 'val'}], число пропущенных."""
+    source = LabelledBoardSource(
+        args.datasets,
+        limit=args.limit,
+        mapping=args.mapping,
+        yolo_model=args.yolo_model,
+        corner_model=args.corner_model,
+    )
+    boards: List[Dict] = []
+    for index, board in enumerate(source):
+        features = board_features(board.warped)
+        boards.append({
+            'x': square_feature_matrix(features),
+            'y': board.occupancy.reshape(-1),
+            'colors': square_colors(features),
+            'val': index % args.val_every == 0,
+        })
+    return boards, source.skipped
+
+
+def evaluate(classifier: OccupancyClassifier, boards: List[Dict]) -> Dict:
+    if not boards:
+        return {}
+    correct = exact = 0
+    false_empty = false_occupied = 0
+    for board in boards:
+        predicted = classifier.square_probabilities(board['x'], board['colors']) >= classifier.threshold
+        correct += int(np.count_nonzero(predicted == board['y']))
+        exact += int(np.array_equal(predicted, board['y']))
+        false_empty += int(np.count_nonzero(~predicted & board['y']))
+        false_occupied += int(np.count_nonzero(predicted & ~board['y']))
+    squares = len(boards) * SQUARE_COUNT * SQUARE_COUNT
+    return {
+        'boards': len(boards),
+        'square_accuracy': round(correct / squares, 4),
+        'board_exact': round(exact / len(boards), 4),
+        'false_empty': false_empty,
+        'false_occupied': false_occupied,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Обучение классификатора занятости клеток')
+    parser.add_argument('--datasets', nargs='+', default=list(DEFAULT_TRAIN_DATASETS),
+                        help='Папки датасетов с YOLO-разметкой относительно chess-recognition/')
+    parser.add_argument('--limit', type=int, default=None, help='Не больше N изображений на датасет')
+    parser.add_argument('--mapping', choices=MAPPING_MODES, default='auto',
+                        help='auto — map_chessboard (снимки без маппинга пропускаются), synthetic — рамка с отступом')
+    parser.add_argument('--val-every', type=int, default=5, help='Каждый N-й снимок — в проверочную выборку')
+    parser.add_argument('--l2', type=float, default=1e-2)
+    parser.add_argument('--yolo-model', default=None)
+    parser.add_argument('--corner-model', default=None)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', default=None, help='Куда сохранить веса (по умолчанию models/square_occupancy.json)')
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    boards, skipped = collect(args)
+    train = [board for board in boards if not board['val']]
+    val = [board for board in boards if board['val']]
+    if not train:
+        print('ERROR: no labelled boards to train on', file=sys.stderr)
+        sys.exit(1)
+
+    classifier = OccupancyClassifier.fit(
+        np.vstack([board['x'] for board in train]),
+        np.concatenate([board['y'] for board in train]),
+        np.concatenate([board['colors'] for board in train]),
+        l2=args.l2,
+    )
+    report = {'train': evaluate(classifier, train), 'val': evaluate(classifier, val)}
+    print(f'Boards: {len(train)} train, {len(val)} val, {skipped} skipped')
+    for split, metrics in report.items():
+        if metrics:
+            print(f"{split:<6} square accuracy {metrics['square_accuracy']:.2%}, "
+                  f"all 64 squares right on {metrics['board_exact']:.2%} of boards "
+                  f"(false empty {metrics['false_empty']}, false occupied {metrics['false_occupied']})")
+
+    output = Path(args.output or occupancy_model_path())
+    output.parent.mkdir(parents=True, exist_ok=True)
+    classifier.save(output, datasets=args.datasets, mapping=args.mapping, report=report)
+    print(f'Saved: {output}')
+
+
+if __name__ == '__main__':
+    main()
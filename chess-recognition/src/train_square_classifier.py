@@ -0,0 +1,170 @@
+"""
+Обучение классификатора клеток для движка squares (model/square_classifier.py).
+
+Вырезки всех 64 клеток берутся с размеченных выровненных досок
+(board_dataset.LabelledBoardSource); класс — ID фигуры из разметки + 1,
+0 — пусто. Пустых клеток на доске большинство, поэтому в обучение идёт
+только доля --empty-keep из них. Каждый --val-every-й снимок целиком
+откладывается для проверки; сохраняются веса эпохи с лучшей точностью по
+клеткам на проверке. Сравнение с YOLO — benchmark_engines.py.
+
+Пример:
+    python src/train_square_classifier.py --datasets merged_new/train merged_new/valid --epochs 30
+"""
+from __future__ import annotations
+
+import argparse
+import copy
+import os
+import sys
+import warnings
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+warnings.filterwarnings('ignore', category=UserWarning)
+warnings.filterwarnings('ignore', message='.*pkg_resources.*')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from board_dataset import DEFAULT_TRAIN_DATASETS, MAPPING_MODES, BoardAccuracy, LabelledBoardSource
+from model.square_classifier import (
+    CROP_SIZE,
+    SQUARE_COUNT,
+    SquareCropClassifier,
+    SquareNet,
+    crops_to_tensor,
+    square_crops,
+)
+from model_paths import square_classifier_model_path
+from worker_logging import configure_logging
+
+# Проверочная доска: вырезки (64, CROP_SIZE, CROP_SIZE, 3) и разметка (8, 8)
+ValBoard = Tuple[np.ndarray, np.ndarray]
+
+
+def collect(args: argparse.Namespace, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, List[ValBoard], int]:
+    """Обучающие вырезки и классы, проверочные доски, число пропущенных снимков."""
+    source = LabelledBoardSource(
+        args.datasets,
+        limit=args.limit,
+        mapping=args.mapping,
+        yolo_model=args.yolo_model,
+        corner_model=args.corner_model,
+    )
+    crops: List[np.ndarray] = []
+    labels: List[np.ndarray] = []
+    val: List[ValBoard] = []
+    for index, board in enumerate(source):
+        board_crops = np.ascontiguousarray(square_crops(board.warped)).reshape(-1, CROP_SIZE, CROP_SIZE, 3)
+        if index % args.val_every == 0:
+            val.append((board_crops, board.board_state))
+            continue
+        classes = board.board_state.reshape(-1).astype(np.int64) + 1
+        keep = (classes != 0) | (rng.random(classes.size) < args.empty_keep)
+        crops.append(board_crops[keep])
+        labels.append(classes[keep])
+    if not crops:
+        return np.empty((0, CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8), np.empty(0, dtype=np.int64), val, source.skipped
+    return np.concatenate(crops), np.concatenate(labels), val, source.skipped
+
+
+def _augment(inputs: torch.Tensor) -> torch.Tensor:
+    """Яркость и контраст ±20%, отражение по горизонтали для половины батча."""
+    count = inputs.shape[0]
+    gain = torch.empty(count, 1, 1, 1, device=inputs.device).uniform_(0.8, 1.2)
+    offset = torch.empty(count, 1, 1, 1, device=inputs.device).uniform_(-0.1, 0.1)
+    inputs = (inputs * gain + offset).clamp_(0.0, 1.0)
+    flip = torch.rand(count, device=inputs.device) < 0.5
+    inputs[flip] = inputs[flip].flip(3)
+    return inputs
+
+
+def evaluate(model: SquareNet, boards: List[ValBoard], device: str) -> Dict:
+    accuracy = BoardAccuracy()
+    model.eval()
+    with torch.inference_mode():
+        for crops, expected in boards:
+            classes = model(crops_to_tensor(crops, device)).argmax(dim=1)
+            accuracy.add(classes.cpu().numpy().reshape(SQUARE_COUNT, SQUARE_COUNT) - 1, expected)
+    return accuracy.summary()
+
+
+def train(args: argparse.Namespace, x: np.ndarray, y: np.ndarray, val: List[ValBoard], rng: np.random.Generator) -> Tuple[SquareNet, Dict]:
+    """Модель лучшей по проверке эпохи (без проверки — последней) и её метрики."""
+    device = args.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(args.seed)
+    model = SquareNet().to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, args.epochs)
+    best_state, best_metrics, best_score = None, {}, -1.0
+    for epoch in range(1, args.epochs + 1):
+        model.train()
+        order = rng.permutation(len(y))
+        total_loss = 0.0
+        for start in range(0, len(order), args.batch_size):
+            batch = order[start:start + args.batch_size]
+            inputs = _augment(crops_to_tensor(x[batch], device))
+            targets = torch.from_numpy(y[batch]).to(device)
+            loss = F.cross_entropy(model(inputs), targets)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += float(loss.item()) * len(batch)
+        scheduler.step()
+
+        metrics = evaluate(model, val, device) if val else {}
+        line = f'epoch {epoch:>3} loss {total_loss / len(y):.4f}'
+        if metrics:
+            line += (f" val square {metrics['square_accuracy']:.2%} occupancy {metrics['occupancy_accuracy']:.2%}"
+                     f" board exact {metrics['board_exact']:.2%}")
+        print(line)
+        score = metrics.get('square_accuracy', float(epoch))
+        if score > best_score:
+            best_state, best_metrics, best_score = copy.deepcopy(model.state_dict()), metrics, score
+    model.load_state_dict(best_state)
+    return model, best_metrics
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Обучение классификатора клеток (движок squares)')
+    parser.add_argument('--datasets', nargs='+', default=list(DEFAULT_TRAIN_DATASETS),
+                        help='Папки датасетов с YOLO-разметкой относительно chess-recognition/')
+    parser.add_argument('--limit', type=int, default=None, help='Не больше N изображений на датасет')
+    parser.add_argument('--mapping', choices=MAPPING_MODES, default='auto',
+                        help='auto — map_chessboard (снимки без маппинга пропускаются), synthetic — рамка с отступом')
+    parser.add_argument('--val-every', type=int, default=5, help='Каждый N-й снимок — в проверочную выборку')
+    parser.add_argument('--empty-keep', type=float, default=0.3, help='Доля пустых клеток в обучающей выборке')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--lr', type=float, default=2e-3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--device', default=None, help='cuda или cpu (по умолчанию cuda, если доступна)')
+    parser.add_argument('--yolo-model', default=None)
+    parser.add_argument('--corner-model', default=None)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', default=None, help='Куда сохранить веса (по умолчанию models/square_classifier.pt)')
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    rng = np.random.default_rng(args.seed)
+    x, y, val, skipped = collect(args, rng)
+    if not len(y):
+        print('ERROR: no labelled boards to train on', file=sys.stderr)
+        sys.exit(1)
+    print(f'Crops: {len(y)} train ({int(np.count_nonzero(y))} occupied), {len(val)} val boards, {skipped} skipped')
+
+    model, metrics = train(args, x, y, val, rng)
+    output = Path(args.output or square_classifier_model_path())
+    output.parent.mkdir(parents=True, exist_ok=True)
+    SquareCropClassifier(model, next(model.parameters()).device.type).save(
+        output, datasets=args.datasets, mapping=args.mapping, report={'val': metrics},
+    )
+    print(f'Saved: {output}')
+
+
+if __name__ == '__main__':
+    main()
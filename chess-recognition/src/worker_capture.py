@@ -0,0 +1,168 @@
+"""
+Запись протокола воркера в файл захвата для воспроизведения нагрузки.
+
+Формат (little-endian):
+    MAGIC
+    записи: <B kind><d t><I json_len><I payload_len> json payload
+    индекс: JSON {"frames": [смещения записей кадров], "records": N}
+    хвост:  <Q смещение индекса> INDEX_MAGIC
+
+t — секунды от начала записи. Команды пишутся вместе с JPEG кадра,
+результаты frame_result — как их отправил воркер; при register в файл
+попадает маппинг сессии, чтобы воспроизведение не зависело от
+chessboard_mappings на машине, где запускается replay.
+Если воркер упал и хвоста нет, CaptureReader читает записи подряд.
+"""
+from __future__ import annotations
+
+import json
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional
+
+MAGIC = b'CCCAP1\n'
+INDEX_MAGIC = b'CCIDX1'
+
+KIND_COMMAND = 1
+KIND_RESULT = 2
+KIND_MAPPING = 3
+
+_HEADER = struct.Struct('<BdII')
+_FOOTER = struct.Struct('<Q')
+
+
+def _json_default(value):
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+class CaptureRecord(NamedTuple):
+    kind: int
+    t: float
+    msg: Dict
+    payload: bytes
+
+
+class CaptureWriter:
+    """Потокобезопасная запись команд, маппингов и результатов в файл захвата."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file: BinaryIO = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._frames: List[int] = []
+        self._records = 0
+        self._closed = False
+
+    def _write(self, kind: int, msg: Dict, payload: bytes = b'', t: Optional[float] = None) -> None:
+        body = json.dumps(msg, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+        with self._lock:
+            if self._closed:
+                return
+            offset = self._file.tell()
+            if kind == KIND_COMMAND and msg.get('cmd') == 'frame':
+                self._frames.append(offset)
+            if t is None:
+                t = time.perf_counter() - self._started
+            self._file.write(_HEADER.pack(kind, t, len(body), len(payload)))
+            self._file.write(body)
+            if payload:
+                self._file.write(payload)
+            # Node завершает воркер через kill сразу после shutdown —
+            # без flush хвост захвата терялся бы
+            self._file.flush()
+            self._records += 1
+
+    def command(self, msg: Dict, payload: bytes = b'', t: Optional[float] = None) -> None:
+        """t — явное время записи (для сгенерированных захватов), иначе текущее."""
+        self._write(KIND_COMMAND, msg, payload, t)
+
+    def mapping(self, token: str, mappings_dir: Path) -> None:
+        mapping_file = mappings_dir / f'{token}_mapping.json'
+        if mapping_file.is_file():
+            self._write(KIND_MAPPING, {'token': token}, mapping_file.read_bytes())
+
+    def result(self, payload: Dict) -> None:
+        self._write(KIND_RESULT, payload)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            index_offset = self._file.tell()
+            index = {'frames': self._frames, 'records': self._records}
+            self._file.write(json.dumps(index, separators=(',', ':')).encode('utf-8'))
+            self._file.write(_FOOTER.pack(index_offset) + INDEX_MAGIC)
+            self._file.close()
+
+
+class CaptureReader:
+    """Чтение файла захвата: последовательно или по индексу кадров."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file: BinaryIO = open(path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ValueError(f'Not a capture file: {path}')
+        self.index: Optional[Dict] = None
+        self._end: Optional[int] = None
+        self._load_index()
+
+    def _load_index(self) -> None:
+        tail = _FOOTER.size + len(INDEX_MAGIC)
+        self._file.seek(0, 2)
+        size = self._file.tell()
+        if size < len(MAGIC) + tail:
+            return
+        self._file.seek(size - tail)
+        footer = self._file.read(tail)
+        if footer[_FOOTER.size:] != INDEX_MAGIC:
+            return
+        (offset,) = _FOOTER.unpack(footer[:_FOOTER.size])
+        self._file.seek(offset)
+        self.index = json.loads(self._file.read(size - tail - offset).decode('utf-8'))
+        self._end = offset
+
+    @property
+    def frame_count(self) -> Optional[int]:
+        return len(self.index['frames']) if self.index else None
+
+    def _read_at(self, offset: int) -> Optional[CaptureRecord]:
+        self._file.seek(offset)
+        header = self._file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None
+        kind, t, json_len, payload_len = _HEADER.unpack(header)
+        body = self._file.read(json_len)
+        payload = self._file.read(payload_len) if payload_len else b''
+        if len(body) < json_len or len(payload) < payload_len:
+            # оборванная запись в конце файла без индекса
+            return None
+        return CaptureRecord(kind, t, json.loads(body.decode('utf-8')), payload)
+
+    def __iter__(self) -> Iterator[CaptureRecord]:
+        offset = len(MAGIC)
+        while self._end is None or offset < self._end:
+            record = self._read_at(offset)
+            if record is None:
+                return
+            offset = self._file.tell()
+            yield record
+
+    def frame(self, n: int) -> CaptureRecord:
+        """n-я команда frame (нужен индекс)."""
+        if self.index is None:
+            raise ValueError('Capture has no index (worker did not close it)')
+        record = self._read_at(self.index['frames'][n])
+        if record is None:
+            raise ValueError(f'Truncated frame record: {n}')
+        return record
+
+    def close(self) -> None:
+        self._file.close()
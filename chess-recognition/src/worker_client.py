@@ -0,0 +1,69 @@
+"""
+Клиент inference_worker.py для инструментов разработки (replay, нагрузка):
+запуск воркера дочерним процессом и чтение его событий из stdout.
+"""
+from __future__ import annotations
+
+import json
+import queue
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+RESULT_TIMEOUT_S = 30.0
+
+
+class WorkerProcess:
+    """inference_worker.py в дочернем процессе; события stdout читает отдельный поток."""
+
+    def __init__(self, args: List[str]):
+        script = Path(__file__).resolve().parent / 'inference_worker.py'
+        self.proc = subprocess.Popen(
+            [sys.executable, str(script), *args],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=script.parent,
+        )
+        self.events: queue.Queue = queue.Queue()
+        self._reader = threading.Thread(target=self._read, name='worker-client-stdout', daemon=True)
+        self._reader.start()
+
+    def _read(self) -> None:
+        for line in self.proc.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                self.events.put(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        self.events.put(None)
+
+    def send(self, msg: Dict, payload: bytes = b'') -> None:
+        self.proc.stdin.write(json.dumps(msg).encode('utf-8') + b'\n' + payload)
+        self.proc.stdin.flush()
+
+    def wait_event(self, event: str, timeout: float) -> Dict:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'No {event} from worker in {timeout:.0f}s')
+            try:
+                msg = self.events.get(timeout=remaining)
+            except queue.Empty:
+                raise TimeoutError(f'No {event} from worker in {timeout:.0f}s') from None
+            if msg is None:
+                raise RuntimeError(f'Worker exited while waiting for {event}')
+            if msg.get('event') == event:
+                return msg
+
+    def close(self) -> None:
+        try:
+            self.send({'cmd': 'shutdown'})
+            self.proc.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
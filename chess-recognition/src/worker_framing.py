@@ -0,0 +1,117 @@
+"""
+Чтение кадрированного протокола из stdin без лишних копий.
+
+FrameReader читает поток через readinto1 в заранее выделенный bytearray,
+который растёт только под кадр больше текущей ёмкости. readline() и
+read_exact() возвращают memoryview на этот буфер — его можно отдать в
+np.frombuffer/cv2.imdecode без копирования. Представление действительно
+до следующего вызова reader (данные сдвигаются к началу буфера).
+
+Слишком длинные кадры и строки пропускаются через skip() без
+буферизации, поэтому поток не теряет синхронизацию.
+"""
+from __future__ import annotations
+
+from typing import BinaryIO, Optional
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+# Строка JSON-команды длиннее этого — мусор в потоке, а не команда
+MAX_LINE_SIZE = 1 << 20
+_READ_SIZE = 1 << 16
+
+
+class FrameReader:
+    def __init__(self, stream: BinaryIO, initial_size: int = DEFAULT_BUFFER_SIZE):
+        self._stream = stream
+        self._buf = bytearray(max(initial_size, _READ_SIZE))
+        self._start = 0
+        self._end = 0
+        self.eof = False
+
+    @property
+    def buffered(self) -> int:
+        return self._end - self._start
+
+    def _reserve(self, needed: int) -> None:
+        """Свободное место под needed байт после уже прочитанных."""
+        pending = self._end - self._start
+        if pending + needed > len(self._buf):
+            # новый буфер вместо resize: старый мог быть экспортирован в memoryview
+            grown = bytearray(max(len(self._buf) * 2, pending + needed))
+            grown[:pending] = self._buf[self._start:self._end]
+            self._buf = grown
+        elif self._end + needed > len(self._buf) or (self._start and not pending):
+            # сдвиг непрочитанного к началу, без изменения размера
+            self._buf[:pending] = self._buf[self._start:self._end]
+        else:
+            return
+        self._start = 0
+        self._end = pending
+
+    def _fill(self, needed: int = _READ_SIZE) -> bool:
+        """Одно чтение из потока (до свободного места в буфере); False на EOF."""
+        if self.eof:
+            return False
+        self._reserve(needed)
+        with memoryview(self._buf) as view:
+            n = self._stream.readinto1(view[self._end:])
+        if not n:
+            self.eof = True
+            return False
+        self._end += n
+        return True
+
+    def readline(self) -> Optional[memoryview]:
+        """
+        Строка без '\\n' или None на EOF. Строки длиннее MAX_LINE_SIZE
+        отбрасываются целиком — чтение продолжается со следующей.
+        """
+        scanned = self._start
+        while True:
+            newline = self._buf.find(b'\n', scanned, self._end)
+            if newline >= 0:
+                start, self._start = self._start, newline + 1
+                if newline - start > MAX_LINE_SIZE:
+                    scanned = self._start
+                    continue
+                return memoryview(self._buf)[start:newline]
+            if self._end - self._start > MAX_LINE_SIZE:
+                self._start = self._end
+                self._discard_line()
+                scanned = self._start
+                continue
+            scanned = self._end
+            offset = scanned - self._start
+            if not self._fill():
+                return None
+            scanned = self._start + offset
+
+    def _discard_line(self) -> None:
+        while True:
+            if not self._fill():
+                return
+            newline = self._buf.find(b'\n', self._start, self._end)
+            if newline >= 0:
+                self._start = newline + 1
+                return
+            self._start = self._end
+
+    def read_exact(self, length: int) -> Optional[memoryview]:
+        """Ровно length байт или None, если поток закончился раньше."""
+        while self._end - self._start < length:
+            if not self._fill(length - (self._end - self._start)):
+                return None
+        view = memoryview(self._buf)[self._start:self._start + length]
+        self._start += length
+        return view
+
+    def skip(self, length: int) -> int:
+        """Пропуск length байт без накопления; возвращает сколько пропущено."""
+        skipped = 0
+        while skipped < length:
+            if self._start == self._end and not self._fill():
+                break
+            take = min(length - skipped, self._end - self._start)
+            self._start += take
+            skipped += take
+        return skipped
@@ -0,0 +1,146 @@
+"""
+Логирование CV-процессов: уровни, ленивое форматирование и сэмплирование
+горячих сообщений по сессиям.
+
+Строки в stderr сохраняют формат "[TAG] сообщение", по тегу Node
+раскладывает вывод воркера по уровням. Для WARNING и выше после тега
+добавляется имя уровня ("[WORKER] ERROR ...").
+"""
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, TextIO
+
+ROOT_LOGGER = 'chesscast'
+DEFAULT_LOG_LEVEL = os.environ.get('CV_LOG_LEVEL', 'INFO')
+DEFAULT_SAMPLE_INTERVAL = 1.0
+
+
+class _TagFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        tag = record.name.rsplit('.', 1)[-1].upper()
+        message = record.getMessage()
+        if record.levelno >= logging.WARNING:
+            line = f'[{tag}] {record.levelname} {message}'
+        else:
+            line = f'[{tag}] {message}'
+        if record.exc_info:
+            line = f'{line}\n{self.formatException(record.exc_info)}'
+        return line
+
+
+class LogSampler:
+    """Пропускает не больше одной записи на ключ за interval секунд."""
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._last: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: Hashable) -> bool:
+        if self.interval <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                return False
+            self._last[key] = now
+            return True
+
+    def forget(self, session: str) -> None:
+        with self._lock:
+            for key in [k for k in self._last if isinstance(k, tuple) and session in k]:
+                del self._last[key]
+
+
+_sampler = LogSampler()
+
+
+def get_logger(tag: str) -> logging.Logger:
+    """Логгер с тегом: get_logger('worker') пишет строки '[WORKER] ...'."""
+    return logging.getLogger(f'{ROOT_LOGGER}.{tag.lower()}')
+
+
+def configure_logging(level: str = DEFAULT_LOG_LEVEL, stream: Optional[TextIO] = None) -> None:
+    """Однократная настройка обработчика stderr для всех логгеров chesscast.*."""
+    root = logging.getLogger(ROOT_LOGGER)
+    if not root.handlers:
+        handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+        handler.setFormatter(_TagFormatter())
+        root.addHandler(handler)
+    root.setLevel(_parse_level(level))
+    root.propagate = False
+
+
+def _parse_level(level: Any) -> int:
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError(f'Unknown log level: {level}')
+    return value
+
+
+def set_log_config(
+    level: Optional[str] = None,
+    loggers: Optional[Dict[str, str]] = None,
+    sample_interval: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Изменение уровней логирования во время работы (команда воркера log_config).
+
+    loggers: {тег: уровень}, например {'orientation': 'DEBUG'}.
+    Возвращает текущую конфигурацию.
+    """
+    if level is not None:
+        logging.getLogger(ROOT_LOGGER).setLevel(_parse_level(level))
+    for tag, tag_level in (loggers or {}).items():
+        get_logger(tag).setLevel(_parse_level(tag_level))
+    if sample_interval is not None:
+        _sampler.interval = max(0.0, float(sample_interval))
+    return log_config()
+
+
+def log_config() -> Dict[str, Any]:
+    root = logging.getLogger(ROOT_LOGGER)
+    prefix = f'{ROOT_LOGGER}.'
+    tags = {
+        name[len(prefix):]: logging.getLevelName(logger.level)
+        for name, logger in logging.Logger.manager.loggerDict.items()
+        if name.startswith(prefix)
+        and isinstance(logger, logging.Logger)
+        and logger.level != logging.NOTSET
+    }
+    return {
+        'level': logging.getLevelName(root.level),
+        'loggers': tags,
+        'sample_interval': _sampler.interval,
+    }
+
+
+def log_sampled(
+    logger: logging.Logger,
+    level: int,
+    session: Optional[str],
+    msg: str,
+    *args: Any,
+) -> None:
+    """
+    Запись горячего пути: не чаще раза в sample_interval на (логгер, сессия, шаблон).
+    Аргументы форматируются только если запись действительно пишется.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if not _sampler.allow((logger.name, session, msg)):
+        return
+    logger.log(level, msg, *args)
+
+
+def forget_session(session: str) -> None:
+    """Сброс состояния сэмплера для завершённой сессии."""
+    _sampler.forget(session)
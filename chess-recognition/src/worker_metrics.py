@@ -0,0 +1,342 @@
+"""
+Метрики inference-воркера: тайминги стадий кадра, гистограммы задержек
+(p50/p95/p99) глобально и по сессиям, счётчики кадров, RSS и время
+загрузки моделей. Читаются командой stats и, опционально, через
+Prometheus-эндпоинт на localhost.
+"""
+from __future__ import annotations
+
+import math
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Порядок стадий в отчётах (остальные идут следом по алфавиту)
+FRAME_STAGES = ('read', 'dedup', 'decode', 'warp', 'hand', 'drift', 'occupancy', 'yolo', 'classify', 'squares', 'voting', 'serialize', 'total')
+
+# Относительная точность бакетов гистограммы: 2% (как HDR с ~2 значащими цифрами)
+_BUCKET_GROWTH = 1.02
+_LOG_GROWTH = math.log(_BUCKET_GROWTH)
+_MIN_VALUE_US = 1.0
+
+# Границы бакетов при экспорте в Prometheus (секунды)
+PROMETHEUS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LatencyHistogram:
+    """Лог-линейная гистограмма задержек с ограниченной относительной ошибкой."""
+
+    __slots__ = ('_buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self._buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        value_us = max(seconds * 1e6, _MIN_VALUE_US)
+        index = int(math.log(value_us) / _LOG_GROWTH)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """Значение q-го перцентиля (0..100) в секундах."""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(self.count * q / 100.0))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                # середина бакета в геометрическом смысле
+                value_us = math.exp((index + 0.5) * _LOG_GROWTH)
+                return min(max(value_us / 1e6, self.min), self.max)
+        return self.max
+
+    def cumulative(self, bounds: Iterable[float]) -> List[Tuple[float, int]]:
+        """Кумулятивные количества для заданных верхних границ (секунды)."""
+        ordered = sorted(self._buckets.items())
+        result = []
+        position = 0
+        seen = 0
+        for upper in bounds:
+            limit_us = upper * 1e6
+            while position < len(ordered) and math.exp((ordered[position][0] + 1) * _LOG_GROWTH) <= limit_us:
+                seen += ordered[position][1]
+                position += 1
+            result.append((upper, seen))
+        return result
+
+    def summary(self) -> Dict[str, float]:
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1e3, 3),
+            'p50_ms': round(self.percentile(50) * 1e3, 3),
+            'p95_ms': round(self.percentile(95) * 1e3, 3),
+            'p99_ms': round(self.percentile(99) * 1e3, 3),
+            'min_ms': round(self.min * 1e3, 3),
+            'max_ms': round(self.max * 1e3, 3),
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace: 'FrameTrace', name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self) -> '_Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.trace.add(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+class FrameTrace:
+    """Спаны стадий одного кадра: (имя, начало по perf_counter, длительность в секундах)."""
+
+    __slots__ = ('started', 'spans')
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = time.perf_counter() if started is None else started
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def span(self, name: str) -> _Span:
+        return _Span(self, name)
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        self.spans.append((name, start, duration))
+
+    def durations(self) -> Dict[str, float]:
+        result: Dict[str, float] = {}
+        for name, _start, duration in self.spans:
+            result[name] = result.get(name, 0.0) + duration
+        return result
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+class _NullTrace:
+    """Трейс-заглушка для вызовов без метрик (stream_server, бенчмарки)."""
+
+    __slots__ = ()
+    _span = _NullSpan()
+
+    def span(self, name: str) -> _NullSpan:
+        return self._span
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def _stage_order(names: Iterable[str]) -> List[str]:
+    names = set(names)
+    ordered = [name for name in FRAME_STAGES if name in names]
+    return ordered + sorted(names - set(FRAME_STAGES))
+
+
+def rss_bytes() -> Optional[int]:
+    """Текущий RSS процесса."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return int(psutil.Process().memory_info().rss)
+
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return int(peak) if sys.platform == 'darwin' else int(peak) * 1024
+
+
+class _StageSet:
+    __slots__ = ('stages', 'counters')
+
+    def __init__(self):
+        self.stages: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, int] = {}
+
+    def observe(self, name: str, seconds: float) -> None:
+        hist = self.stages.get(name)
+        if hist is None:
+            hist = self.stages[name] = LatencyHistogram()
+        hist.record(seconds)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self) -> Dict:
+        data = {
+            'counters': dict(sorted(self.counters.items())),
+            'stages': {name: self.stages[name].summary() for name in _stage_order(self.stages)},
+        }
+        processed = self.counters.get('frames_processed', 0)
+        if processed:
+            # доля кадров, обработанных как повтор прошлого (frame_dedup)
+            data['duplicate_rate'] = round(self.counters.get('frames_duplicate', 0) / processed, 4)
+        return data
+
+
+class MetricsRegistry:
+    """Глобальные и посессионные гистограммы стадий и счётчики."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global = _StageSet()
+        self._sessions: Dict[str, _StageSet] = {}
+        self.model_load_seconds: Dict[str, float] = {}
+        self.started_at = time.time()
+
+    def _session(self, token: str) -> _StageSet:
+        stage_set = self._sessions.get(token)
+        if stage_set is None:
+            stage_set = self._sessions[token] = _StageSet()
+        return stage_set
+
+    def observe(self, name: str, seconds: float, token: Optional[str] = None) -> None:
+        with self._lock:
+            self._global.observe(name, seconds)
+            if token is not None:
+                self._session(token).observe(name, seconds)
+
+    def observe_trace(self, token: Optional[str], trace: FrameTrace) -> None:
+        durations = trace.durations()
+        with self._lock:
+            session = self._session(token) if token is not None else None
+            for name, seconds in durations.items():
+                self._global.observe(name, seconds)
+                if session is not None:
+                    session.observe(name, seconds)
+
+    def incr(self, name: str, token: Optional[str] = None, n: int = 1) -> None:
+        with self._lock:
+            self._global.incr(name, n)
+            if token is not None:
+                self._session(token).incr(name, n)
+
+    def set_model_load_time(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self.model_load_seconds[model] = round(seconds, 3)
+
+    def drop_session(self, token: str) -> None:
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._global = _StageSet()
+            self._sessions.clear()
+
+    def snapshot(self, token: Optional[str] = None) -> Dict:
+        with self._lock:
+            data = {
+                'uptime_s': round(time.time() - self.started_at, 1),
+                'rss_bytes': rss_bytes(),
+                'peak_rss_bytes': peak_rss_bytes(),
+                'model_load_seconds': dict(self.model_load_seconds),
+                **self._global.summary(),
+            }
+            if token is not None:
+                session = self._sessions.get(token)
+                data['sessions'] = {token: session.summary()} if session else {}
+            else:
+                data['sessions'] = {t: s.summary() for t, s in self._sessions.items()}
+        return data
+
+    def prometheus_text(self) -> str:
+        """Экспорт в текстовом формате Prometheus (гистограммы в секундах)."""
+        lines = [
+            '# HELP chesscast_worker_stage_seconds Frame stage latency.',
+            '# TYPE chesscast_worker_stage_seconds histogram',
+        ]
+        with self._lock:
+            for name in _stage_order(self._global.stages):
+                hist = self._global.stages[name]
+                for upper, cumulative in hist.cumulative(PROMETHEUS_BUCKETS):
+                    lines.append(
+                        f'chesscast_worker_stage_seconds_bucket{{stage="{name}",le="{upper:.6g}"}} {cumulative}'
+                    )
+                lines.append(f'chesscast_worker_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {hist.count}')
+                lines.append(f'chesscast_worker_stage_seconds_sum{{stage="{name}"}} {hist.total:.6f}')
+                lines.append(f'chesscast_worker_stage_seconds_count{{stage="{name}"}} {hist.count}')
+
+            lines.append('# TYPE chesscast_worker_frames_total counter')
+            for name, value in sorted(self._global.counters.items()):
+                lines.append(f'chesscast_worker_frames_total{{kind="{name}"}} {value}')
+
+            lines.append('# TYPE chesscast_worker_model_load_seconds gauge')
+            for model, seconds in sorted(self.model_load_seconds.items()):
+                lines.append(f'chesscast_worker_model_load_seconds{{model="{model}"}} {seconds}')
+
+            lines.append('# TYPE chesscast_worker_sessions gauge')
+            lines.append(f'chesscast_worker_sessions {len(self._sessions)}')
+
+        rss = rss_bytes()
+        if rss is not None:
+            lines.append('# TYPE chesscast_worker_rss_bytes gauge')
+            lines.append(f'chesscast_worker_rss_bytes {rss}')
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(registry: MetricsRegistry, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Поднимает GET /metrics на localhost в фоновом потоке."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    return server
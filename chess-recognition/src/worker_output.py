@@ -0,0 +1,152 @@
+"""
+Асинхронный вывод событий воркера в stdout.
+
+Сериализация и запись в pipe вынесены в отдельный поток с ограниченной
+очередью: медленный читатель на стороне Node больше не останавливает
+инференс, а накопившиеся события пишутся одним write + flush.
+Очередь одна (FIFO), поэтому порядок событий, в том числе внутри
+одной сессии, сохраняется.
+"""
+from __future__ import annotations
+
+import json
+import queue
+import sys
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_QUEUE_SIZE = 256
+SERIALIZERS = ('auto', 'json', 'orjson')
+
+_STOP = object()
+
+
+def _json_default(value: Any) -> Any:
+    """numpy-скаляры и массивы -> обычные python-типы."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _dumps_json(payload: Any) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=_json_default).encode('utf-8')
+
+
+def _dumps_orjson(payload: Any) -> bytes:
+    try:
+        return orjson.dumps(
+            payload,
+            default=_json_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    except TypeError:
+        # orjson строже к типам (например, int > 64 бит) — откатываемся на json
+        return _dumps_json(payload)
+
+
+def resolve_serializer(name: str = 'auto') -> Callable[[Any], bytes]:
+    """Сериализатор одной строки протокола (JSON в UTF-8, без перевода строки)."""
+    if name not in SERIALIZERS:
+        raise ValueError(f'Unknown serializer: {name}')
+    if name == 'orjson' and orjson is None:
+        raise ValueError('orjson is not installed')
+    if name in ('auto', 'orjson') and orjson is not None:
+        return _dumps_orjson
+    return _dumps_json
+
+
+class OutputWriter:
+    """Поток записи JSON-строк в stdout с ограниченной очередью."""
+
+    def __init__(
+        self,
+        stream: Optional[BinaryIO] = None,
+        *,
+        serializer: str = 'auto',
+        max_queue: int = DEFAULT_QUEUE_SIZE,
+        on_serialize: Optional[Callable[[Any, float], None]] = None,
+    ):
+        """
+        on_serialize: наблюдатель (событие, секунды сериализации) —
+        вызывается из потока вывода, используется для метрик.
+        """
+        self.stream = stream if stream is not None else sys.stdout.buffer
+        self._dumps = resolve_serializer(serializer)
+        self.on_serialize = on_serialize
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_queue))
+        self._closed = False
+        self._broken = False
+        self._thread = threading.Thread(target=self._run, name='worker-output', daemon=True)
+        self._thread.start()
+
+    def emit(self, payload: dict) -> None:
+        """
+        Ставит событие в очередь. При заполненной очереди блокирует вызывающий
+        поток (backpressure): терять frame_result нельзя — Node ждёт ответ на
+        каждый отправленный кадр.
+        """
+        if self._closed:
+            raise RuntimeError('OutputWriter is closed')
+        self._queue.put(payload)
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """Дописывает всё, что осталось в очереди, и останавливает поток."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _serialize(self, payload: Any) -> bytes:
+        try:
+            return self._dumps(payload)
+        except Exception as exc:
+            fallback = {'event': 'error', 'message': f'Serialization error: {exc}'}
+            if isinstance(payload, dict) and 'token' in payload:
+                fallback['token'] = payload['token']
+            return _dumps_json(fallback)
+
+    def _write(self, data: bytes) -> None:
+        if self._broken:
+            return
+        try:
+            self.stream.write(data)
+            self.stream.flush()
+        except (BrokenPipeError, ValueError, OSError):
+            # Читатель закрыл pipe: дальше писать некуда, но поток не падает,
+            # чтобы emit не блокировался на заполненной очереди.
+            self._broken = True
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            chunks = []
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                    continue
+                if self.on_serialize is None:
+                    chunks.append(self._serialize(item))
+                else:
+                    started = time.perf_counter()
+                    chunks.append(self._serialize(item))
+                    self.on_serialize(item, time.perf_counter() - started)
+                chunks.append(b'\n')
+
+            if chunks:
+                self._write(b''.join(chunks))
+            if stop:
+                return
@@ -0,0 +1,204 @@
+"""
+Профилирование живого воркера по команде profile: следующие N кадров
+под cProfile или сэмплирующим профайлером, плюс дельта памяти tracemalloc.
+
+Пока профилирование не запущено, воркер не держит профайлер вовсе
+(InferenceWorker.profiler is None) — накладных расходов нет.
+"""
+from __future__ import annotations
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+PROFILE_MODES = ('cprofile', 'sampling')
+DEFAULT_PROFILE_FRAMES = 100
+DEFAULT_PROFILE_TOP = 20
+DEFAULT_SAMPLE_INTERVAL_MS = 5.0
+MAX_PROFILE_FRAMES = 10000
+# Глубина стека, которую tracemalloc хранит для каждого выделения
+_TRACEMALLOC_FRAMES = 10
+
+
+class _StackSampler:
+    """Поток, снимающий стек целевого потока раз в interval (только пока кадр в работе)."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.active = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='worker-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            if not self.active:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(1.0)
+
+    def collapsed(self) -> str:
+        """Формат flamegraph.pl / speedscope: 'a;b;c count' на строку."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class FrameProfiler:
+    """Профиль следующих frames кадров; enable/disable вызываются вокруг обработки кадра."""
+
+    def __init__(
+        self,
+        output_dir: Path,
+        frames: int = DEFAULT_PROFILE_FRAMES,
+        *,
+        mode: str = 'cprofile',
+        top: int = DEFAULT_PROFILE_TOP,
+        memory: bool = True,
+        sample_interval_ms: float = DEFAULT_SAMPLE_INTERVAL_MS,
+    ):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f'Unknown profile mode: {mode}')
+        if not 0 < frames <= MAX_PROFILE_FRAMES:
+            raise ValueError(f'frames must be in 1..{MAX_PROFILE_FRAMES}')
+        self.output_dir = output_dir
+        self.frames = frames
+        self.mode = mode
+        self.top = max(1, top)
+        self.memory = memory
+        self.sample_interval = max(0.5, sample_interval_ms) / 1e3
+        self.done = 0
+        self.elapsed = 0.0
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[_StackSampler] = None
+        self._started_tracemalloc = False
+        self._memory_before: Optional[tracemalloc.Snapshot] = None
+        self._frame_started = 0.0
+
+        if mode == 'cprofile':
+            self._profile = cProfile.Profile()
+        else:
+            self._sampler = _StackSampler(threading.get_ident(), self.sample_interval)
+        if memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(_TRACEMALLOC_FRAMES)
+                self._started_tracemalloc = True
+            self._memory_before = tracemalloc.take_snapshot()
+
+    def enable(self) -> None:
+        self._frame_started = time.perf_counter()
+        if self._profile is not None:
+            self._profile.enable()
+        else:
+            self._sampler.active = True
+
+    def disable(self) -> bool:
+        """Завершает кадр; True, когда набрано нужное число кадров."""
+        if self._profile is not None:
+            self._profile.disable()
+        else:
+            self._sampler.active = False
+        self.elapsed += time.perf_counter() - self._frame_started
+        self.done += 1
+        return self.done >= self.frames
+
+    def cancel(self) -> None:
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    def finish(self) -> Dict:
+        """Пишет файлы профиля в output_dir и возвращает пути и сводку top-N."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        base = self.output_dir / f'profile_{time.strftime("%Y%m%d_%H%M%S")}_{self.mode}'
+        files: Dict[str, str] = {}
+        result: Dict = {
+            'mode': self.mode,
+            'frames': self.done,
+            'profiled_ms': round(self.elapsed * 1e3, 3),
+        }
+
+        if self._profile is not None:
+            path = base.with_suffix('.pstats')
+            self._profile.dump_stats(str(path))
+            files['pstats'] = str(path)
+            result['top'] = self._cprofile_top()
+        else:
+            self._sampler.stop()
+            path = base.with_suffix('.collapsed')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self._sampler.collapsed())
+            files['collapsed'] = str(path)
+            result['top'] = self._sampling_top()
+
+        if self.memory:
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            diff = after.compare_to(self._memory_before, 'lineno')
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            path = base.with_suffix('.memory.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                for stat in diff[:100]:
+                    f.write(f'{stat}\n')
+            files['memory'] = str(path)
+            result['memory'] = {
+                'traced_bytes': current,
+                'traced_peak_bytes': peak,
+                'top': [
+                    {
+                        'location': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                        'size_diff_kb': round(stat.size_diff / 1024, 1),
+                        'count_diff': stat.count_diff,
+                    }
+                    for stat in diff[:self.top]
+                ],
+            }
+
+        result['files'] = files
+        return result
+
+    def _cprofile_top(self) -> List[Dict]:
+        stats = pstats.Stats(self._profile, stream=io.StringIO()).sort_stats('cumulative')
+        top = []
+        for func in stats.fcn_list[:self.top]:
+            primitive_calls, calls, tottime, cumtime, _callers = stats.stats[func]
+            filename, lineno, name = func
+            top.append({
+                'function': f'{name} ({os.path.basename(filename)}:{lineno})',
+                'calls': calls,
+                'tottime_ms': round(tottime * 1e3, 3),
+                'cumtime_ms': round(cumtime * 1e3, 3),
+            })
+        return top
+
+    def _sampling_top(self) -> List[Dict]:
+        """Функции с наибольшим собственным временем (вершина стека)."""
+        own: Counter = Counter()
+        total = 0
+        for stack, count in self._sampler.stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+            total += count
+        return [
+            {'function': name, 'samples': count, 'share': round(count / total, 4)}
+            for name, count in own.most_common(self.top)
+        ]
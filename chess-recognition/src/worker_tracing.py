@@ -0,0 +1,121 @@
+"""
+Трассировка кадров воркера: кольцевой буфер спанов последних кадров и
+экспорт в Chrome trace-event JSON (chrome://tracing, Perfetto).
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from worker_metrics import FrameTrace
+
+DEFAULT_TRACE_BUFFER = 512
+
+# Точка отсчёта: perf_counter и wall clock в момент импорта, чтобы
+# переводить capture_ts от Node (epoch, мс) в шкалу perf_counter.
+_PERF_ORIGIN = time.perf_counter()
+_WALL_ORIGIN = time.time()
+
+
+def wall_to_perf(epoch_seconds: float) -> float:
+    return _PERF_ORIGIN + (epoch_seconds - _WALL_ORIGIN)
+
+
+@dataclass
+class FrameRecord:
+    token: str
+    seq: Optional[int]
+    capture_ts: Optional[float]
+    trace: FrameTrace
+
+
+def frame_timing(record: FrameRecord) -> Dict:
+    """Тайминги кадра для frame_result: длительности стадий и задержка доставки, мс."""
+    timing: Dict = {
+        'spans': {name: round(seconds * 1e3, 3) for name, seconds in record.trace.durations().items()},
+    }
+    if record.capture_ts is not None:
+        transport = record.trace.started - wall_to_perf(record.capture_ts / 1e3)
+        timing['transport_ms'] = round(transport * 1e3, 3)
+    return timing
+
+
+class TraceBuffer:
+    """Последние N кадров со спанами (потокобезопасный кольцевой буфер)."""
+
+    def __init__(self, size: int = DEFAULT_TRACE_BUFFER):
+        self._records: deque = deque(maxlen=max(1, size))
+        self._lock = threading.Lock()
+
+    def add(self, record: FrameRecord) -> None:
+        with self._lock:
+            self._records.append(record)
+
+    def last(self, n: Optional[int] = None) -> List[FrameRecord]:
+        with self._lock:
+            records = list(self._records)
+        return records if not n else records[-n:]
+
+    def chrome_trace(self, n: Optional[int] = None) -> Dict:
+        """
+        Trace-event JSON: одна "нить" на сессию, события фазы X с
+        длительностями стадий; доставка от Node — отдельный спан transport.
+        """
+        pid = os.getpid()
+        thread_ids: Dict[str, int] = {}
+        events: List[Dict] = []
+
+        for record in self.last(n):
+            tid = thread_ids.get(record.token)
+            if tid is None:
+                tid = thread_ids[record.token] = len(thread_ids) + 1
+                events.append({
+                    'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                    'args': {'name': record.token},
+                })
+
+            args = {'token': record.token, 'seq': record.seq}
+            durations = record.trace.durations()
+            total = durations.get('total', 0.0)
+            events.append({
+                'name': f'frame {record.seq}' if record.seq is not None else 'frame',
+                'cat': 'frame', 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': _to_us(record.trace.started), 'dur': round(total * 1e6, 1),
+                'args': args,
+            })
+            if record.capture_ts is not None:
+                capture = wall_to_perf(record.capture_ts / 1e3)
+                events.append({
+                    'name': 'transport', 'cat': 'queue', 'ph': 'X', 'pid': pid, 'tid': tid,
+                    'ts': _to_us(capture),
+                    'dur': round(max(0.0, record.trace.started - capture) * 1e6, 1),
+                    'args': args,
+                })
+            for name, start, duration in record.trace.spans:
+                if name == 'total':
+                    continue
+                events.append({
+                    'name': name, 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': tid,
+                    'ts': _to_us(start), 'dur': round(duration * 1e6, 1),
+                    'args': args,
+                })
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path: Path, n: Optional[int] = None) -> int:
+        """Пишет trace JSON в файл, возвращает число кадров."""
+        data = self.chrome_trace(n)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        return sum(1 for event in data['traceEvents'] if event.get('cat') == 'frame')
+
+
+def _to_us(perf_seconds: float) -> float:
+    return round((perf_seconds - _PERF_ORIGIN) * 1e6, 1)